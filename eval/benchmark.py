@@ -0,0 +1,303 @@
+## offline micro benchmarks for every pipeline stage, nothing leaves the machine:
+## local mode qdrant, fake gemini and LM Studio (eval/stubs.py), real models from the local fastembed cache or --fake-models.
+## results are saved as json so runs can be compared, i.e.
+##   python eval/benchmark.py --fake-models
+##   python eval/benchmark.py --fake-models --compare eval/out/benchmarks/<earlier run>.json
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from eval.stubs import COLLECTION_KEYWORDS, install_stubs, start_metadata_stub
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+OUT_DIR = os.path.join(REPO_ROOT, "eval", "out", "benchmarks")
+FORMATS = ["PDF", "HTML", "TXT", "JSON"]
+REGRESSION_THRESHOLD = 0.10 # relative change in p95 latency or throughput reported as a regression by --compare
+
+_FILLER = ("battery charging setup warranty manual specification performance settings connection bluetooth wireless "
+           "display resolution storage memory update support review price model feature quality sound audio power").split()
+
+class PeakRss:
+    '''
+        description: samples this process' resident memory on a background thread while the block runs.
+            rss covers onnx/native allocations that tracemalloc would miss, the sampling adds no per call overhead.
+    '''
+    def __init__(self, interval_s: float = 0.005):
+        self.interval_s = interval_s
+        self.start_mb = None
+        self.peak_mb = None
+        self._stop = threading.Event()
+
+    def _sample(self):
+        from phase_2_pipeline.lib.embedding_models import _current_rss_mb
+        while not self._stop.wait(self.interval_s):
+            rss = _current_rss_mb()
+            if rss is not None:
+                self.peak_mb = max(self.peak_mb or rss, rss)
+
+    def __enter__(self):
+        from phase_2_pipeline.lib.embedding_models import _current_rss_mb
+        self.start_mb = self.peak_mb = _current_rss_mb()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+def measure(fn, inputs: list, units=lambda result: 1, quiet: bool = True) -> tuple:
+    '''
+        description: calls fn once per input, in order, and times every call.
+
+        input: fn, inputs (each is passed as fn(*input)), units (work done by one call, i.e. chunks parsed)
+        output: (results, stats) with latency percentiles per call, units per second and peak memory
+    '''
+    results = []
+    latencies = []
+    total_units = 0
+    output = io.StringIO() if quiet else None
+    with PeakRss() as memory, contextlib.redirect_stdout(output) if quiet else contextlib.nullcontext():
+        start = time.perf_counter()
+        for args in inputs:
+            call_start = time.perf_counter()
+            result = fn(*args)
+            latencies.append((time.perf_counter() - call_start) * 1000)
+            total_units += units(result)
+            results.append(result)
+        wall_s = time.perf_counter() - start
+
+    latencies = np.asarray(latencies) if latencies else np.zeros(1)
+    return results, {
+        "calls": len(inputs),
+        "units": total_units,
+        "wall_s": round(wall_s, 4),
+        "throughput_per_s": round(total_units / wall_s, 2) if wall_s > 0 else None,
+        "mean_ms": round(float(latencies.mean()), 3),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+        "max_ms": round(float(latencies.max()), 3),
+        "peak_rss_mb": None if memory.peak_mb is None else round(memory.peak_mb, 1),
+        "rss_growth_mb": None if memory.peak_mb is None else round(memory.peak_mb - memory.start_mb, 1),
+    }
+
+def write_synthetic_corpus(root: str, files_per_format: int, words_per_file: int, seed: int = 0) -> dict:
+    '''
+        description: deterministic HTML, TXT and JSON documents per collection, built from the collection's keywords
+            and filler words, with headings and paragraphs so chunking has structure to cut on. no PDFs are generated.
+
+        output: {collection: directory}
+    '''
+    rng = random.Random(seed)
+    directories = {}
+    for collection, keywords in COLLECTION_KEYWORDS.items():
+        directory = os.path.join(root, collection)
+        os.makedirs(directory, exist_ok=True)
+        vocabulary = keywords * 4 + _FILLER
+        for i in range(files_per_format):
+            paragraphs = []
+            remaining = words_per_file
+            while remaining > 0:
+                length = min(remaining, rng.randint(40, 120))
+                paragraphs.append(" ".join(rng.choice(vocabulary) for _ in range(length)) + ".")
+                remaining -= length
+            title = f"{keywords[0]} guide {i}"
+
+            with open(os.path.join(directory, f"{collection}_{i}.html"), "w", encoding="utf-8") as f:
+                body = "".join(f"<h2>section {n}</h2><p>{paragraph}</p>\n" for n, paragraph in enumerate(paragraphs))
+                f.write(f"<html><head><title>{title}</title></head><body>{body}</body></html>")
+            with open(os.path.join(directory, f"{collection}_{i}.txt"), "w", encoding="utf-8") as f:
+                f.write("\n\n".join(f"# section {n}\n{paragraph}" for n, paragraph in enumerate(paragraphs)))
+            with open(os.path.join(directory, f"{collection}_{i}.json"), "w", encoding="utf-8") as f:
+                json.dump({f"section_{n}": paragraph for n, paragraph in enumerate(paragraphs)}, f, indent=2)
+        directories[collection] = directory
+    return directories
+
+def load_queries(count: int) -> list:
+    # the eval prompts, repeated with a variant suffix past the first pass so every query is new to the caches
+    with open(os.path.join(REPO_ROOT, "eval", "prompts2.json"), "r", encoding="utf-8") as f:
+        prompts = [prompt for category in json.load(f) for prompt in category["prompts"]]
+    return [prompts[i % len(prompts)] + ("" if i < len(prompts) else f" (variant {i // len(prompts)})") for i in range(count)]
+
+def run_data_load(directories: dict, repeats: int, quiet: bool) -> dict:
+    import phase_2_pipeline.data_load as data_load
+    from phase_2_pipeline.lib.doc_parsers import list_files
+
+    stages = {}
+    chunks_by_collection = {collection: [] for collection in directories}
+    for data_format in FORMATS:
+        process = getattr(data_load, f"process_{data_format.lower()}_from_directory")
+        inputs = [(directory,) for directory in directories.values() if list_files(directory, data_format)]
+        if not inputs:
+            continue
+        for attempt in range(repeats):
+            # later passes are served from the extraction cache
+            results, stats = measure(process, inputs, units=len, quiet=quiet)
+            stages[f"process_{data_format.lower()}_from_directory{' (warm)' if attempt else ''}"] = stats
+        for (directory,), chunks in zip(inputs, results):
+            chunks_by_collection[os.path.basename(directory.rstrip(os.sep))].extend(chunks)
+
+    collections = [collection for collection, chunks in chunks_by_collection.items() if chunks]
+    enriched, stats = measure(
+        lambda chunks: list(data_load.enrich_chunks(chunks)),
+        [(chunks_by_collection[collection],) for collection in collections], units=len, quiet=quiet,
+    )
+    stages["enrich_chunks"] = stats
+
+    for attempt in range(repeats):
+        # later passes overwrite the same point ids
+        _, stats = measure(data_load.upload_to_qdrant, list(zip(enriched, collections)), units=lambda count: count, quiet=quiet)
+        stages[f"upload_to_qdrant{' (warm)' if attempt else ''}"] = stats
+    return stages
+
+def run_query_stages(queries: list, repeats: int, quiet: bool) -> dict:
+    from phase_2_pipeline.p1_query_preprocess import query_preprocess
+    from phase_2_pipeline.p2_bi_encoder_rank import bi_encoder_rank
+    from phase_2_pipeline.p3_cross_encoder_rerank import cross_encoder_rerank
+    from phase_2_pipeline.p4_output_generation import output_generation
+
+    stages = {}
+    for attempt in range(repeats):
+        # later passes repeat the same queries, so preprocess/embedding/rerank are served from their caches
+        suffix = " (warm)" if attempt else ""
+        processed, stages["query_preprocess" + suffix] = measure(query_preprocess, [(query,) for query in queries], quiet=quiet)
+        candidates, stages["bi_encoder_rank" + suffix] = measure(bi_encoder_rank, [(query,) for query in processed], quiet=quiet)
+        reranked, stages["cross_encoder_rerank" + suffix] = measure(cross_encoder_rerank, list(zip(candidates, processed)), quiet=quiet)
+        _, stages["output_generation" + suffix] = measure(
+            output_generation, [(final, query["query"]) for final, query in zip(reranked, processed)], quiet=quiet,
+        )
+    return stages
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+def _settings(args) -> dict:
+    from phase_2_pipeline.lib import constants
+    settings = {
+        "fake_models": args.fake_models,
+        "queries": args.queries,
+        "repeats": args.repeats,
+        "qdrant": args.qdrant_path or ":memory:",
+        "data_dir": args.data_dir or "synthetic",
+    }
+    for name in ("VECTOR_STORE_BACKEND", "RESULTS_COUNT", "FINAL_COUNT", "RERANK_CASCADE", "RERANK_FIELD", "HYBRID_SEARCH",
+                 "QUANTIZATION", "ROUTER_ENABLED", "CHUNK_MAX_TOKENS", "PARSE_WORKERS", "EMBEDDING_MODEL_NAME", "RERANKER_MODEL_NAME"):
+        settings[name] = getattr(constants, name)
+    return settings
+
+def compare(current: dict, previous: dict, threshold: float = REGRESSION_THRESHOLD) -> list:
+    '''
+        output: one line per stage found in both runs, with p50/p95/throughput change, flagged when p95 latency grew
+            or throughput dropped by more than threshold
+    '''
+    lines = []
+    for stage, stats in current["stages"].items():
+        before = previous["stages"].get(stage)
+        if before is None:
+            continue
+
+        def change(key):
+            return (stats[key] - before[key]) / before[key] if before.get(key) and stats.get(key) is not None else 0.0
+
+        regression = change("p95_ms") > threshold or change("throughput_per_s") < -threshold
+        lines.append(
+            f"{stage:>42}: p50 {change('p50_ms'):+7.1%}  p95 {change('p95_ms'):+7.1%}  "
+            f"throughput {change('throughput_per_s'):+7.1%}{'  REGRESSION' if regression else ''}"
+        )
+    return lines
+
+def main():
+    parser = argparse.ArgumentParser(description="offline benchmark of every pipeline stage")
+    parser.add_argument("--fake-models", action="store_true", help="hashing bi encoder/word overlap cross encoder instead of fastembed models")
+    parser.add_argument("--queries", type=int, default=50, help="queries per pass, eval/prompts2.json prompts cycled with variants")
+    parser.add_argument("--repeats", type=int, default=2, help="passes over the same inputs, passes after the first are reported as (warm)")
+    parser.add_argument("--data-dir", help="directory with one sub directory of documents per collection (default: synthetic HTML/TXT/JSON corpus)")
+    parser.add_argument("--files-per-format", type=int, default=4, help="synthetic documents per format and collection")
+    parser.add_argument("--words-per-file", type=int, default=1500, help="words per synthetic document")
+    parser.add_argument("--qdrant-path", help="local qdrant storage directory (default: in memory)")
+    parser.add_argument("--gemini-latency", type=float, default=0.0, help="seconds the fake gemini waits per call")
+    parser.add_argument("--lm-studio-latency", type=float, default=0.0, help="seconds the fake LM Studio waits per chunk")
+    parser.add_argument("--compare", help="earlier benchmark json to compare against")
+    parser.add_argument("--out", default=OUT_DIR, help="directory for the result json")
+    parser.add_argument("--verbose", action="store_true", help="keep the pipeline's own prints")
+    args = parser.parse_args()
+
+    # every cache, artifact and metrics file goes to a scratch directory, set before any pipeline module reads its constants
+    scratch = tempfile.mkdtemp(prefix="rag_benchmark_")
+    metadata_server, metadata_url = start_metadata_stub(args.lm_studio_latency)
+    os.environ.update({
+        "RAG_CACHE_DIR": os.path.join(scratch, "cache"),
+        "RAG_ARTIFACT_DIR": os.path.join(scratch, "artifacts"),
+        "RAG_METRICS_PATH": os.path.join(scratch, "llm_metrics.jsonl"),
+        "RAG_TRACING": "0",
+        "METADATA_LLM_URL": metadata_url,
+    })
+    os.environ.setdefault("RAG_VECTOR_STORE", "qdrant")
+
+    try:
+        install_stubs(fake_models=args.fake_models, qdrant_path=args.qdrant_path, gemini_latency_s=args.gemini_latency)
+        if not args.fake_models:
+            from phase_2_pipeline.lib.embedding_models import warm_up
+            warm_up()
+
+        if args.data_dir:
+            directories = {name: os.path.join(args.data_dir, name) for name in sorted(os.listdir(args.data_dir))
+                           if os.path.isdir(os.path.join(args.data_dir, name))}
+        else:
+            directories = write_synthetic_corpus(os.path.join(scratch, "corpus"), args.files_per_format, args.words_per_file)
+
+        stages = run_data_load(directories, args.repeats, not args.verbose)
+        stages.update(run_query_stages(load_queries(args.queries), args.repeats, not args.verbose))
+    finally:
+        metadata_server.shutdown()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    result = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": _settings(args),
+        "stages": stages,
+    }
+
+    print(f"{'stage':>42}  {'calls':>5}  {'units/s':>10}  {'p50 ms':>9}  {'p95 ms':>9}  {'p99 ms':>9}  {'peak rss':>9}")
+    for stage, stats in stages.items():
+        print(f"{stage:>42}  {stats['calls']:>5}  {stats['throughput_per_s']:>10}  {stats['p50_ms']:>9}  "
+              f"{stats['p95_ms']:>9}  {stats['p99_ms']:>9}  {stats['peak_rss_mb']:>9}")
+
+    os.makedirs(args.out, exist_ok=True)
+    out_path = os.path.join(args.out, datetime.now().strftime("%Y%m%d_%H%M%S") + "_benchmark.json")
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"results wrote to {out_path}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            previous = json.load(f)
+        if previous["settings"] != result["settings"]:
+            print("WARNING: settings differ from the compared run, changes may not be regressions")
+        print(f"compared to {args.compare} ({previous.get('git_commit')}):")
+        for line in compare(result, previous):
+            print(line)
+
+if __name__ == "__main__":
+    main()
@@ -6,12 +6,14 @@ import time
 from datetime import datetime
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from phase_1_pipeline.client import get_client, EMBEDDING_MODEL_NAME
+from phase_1_pipeline.client import EMBEDDING_MODEL_NAME
 from eval.metric_lib import get_metric_from_relevance, L
 from phase_1_pipeline.inference import retrieval_pipeline
+from phase_2_pipeline.lib.vector_store import get_vector_store
 
 if __name__ == "__main__":
-    client = get_client()
+    # qdrant by default, set RAG_VECTOR_STORE=numpy or hnsw to run evals in process from the artifacts
+    client = get_vector_store()
     print(f"Initializing embedding model '{EMBEDDING_MODEL_NAME}'...")
     embedding_model = TextEmbedding(model_name=EMBEDDING_MODEL_NAME)
     print("Model initialized.")
@@ -7,15 +7,24 @@ from datetime import datetime
 from tqdm import tqdm
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from phase_2_pipeline.lib.qdrant_client import get_qdrant_client
-from phase_2_pipeline.lib.embedding_models import bi_encoder_model
+from phase_2_pipeline.lib.constants import VECTOR_STORE_BACKEND
+from phase_2_pipeline.lib.embedding_models import warm_up
 from eval.metric_lib import get_metric_from_relevance
-from phase_2_pipeline.p0_runner import run_pipeline
+from phase_2_pipeline.p0_runner import run_pipeline, run_pipeline_batch
+from phase_2_pipeline.p3_cross_encoder_rerank import get_rerank_stats
+from phase_2_pipeline.lib.collection_router import get_collection_router
+from phase_2_pipeline.lib.tracing import tracing_enabled, get_span_stats, get_exporter
+from phase_2_pipeline.lib.metrics import get_metrics
+
+# number of prompts sent through the pipeline together, 1 runs each prompt on its own with run_pipeline.
+# with larger batches the latency reported per prompt is the batch time divided by the batch size
+BATCH_SIZE = 1
 
 if __name__ == "__main__":
-    client = get_qdrant_client()
-    embedding_model = bi_encoder_model()
-    print("Embedding Model initialized.")
+    # qdrant by default, set RAG_VECTOR_STORE=numpy or hnsw to run evals in process from the artifacts
+    print(f"Vector store backend: {VECTOR_STORE_BACKEND}")
+    model_stats = warm_up()
+    print(f"Models initialized: {model_stats}")
 
     json_path = os.path.join(os.getcwd(), "eval", "prompts2.json")
     evals_file = []
@@ -37,14 +46,24 @@ if __name__ == "__main__":
         "nDCG@K": 0,
         "Latency (milliseconds)": 0
     }
-    for category in tqdm(evals_file, desc="processing categories"):
+    cases = []
+    for category in evals_file:
         for prompt, gold_ids, gold_file in zip(category["prompts"], category["gold_set"], category["gold_files"]):
-            prompts += 1
+            cases.append((prompt, gold_ids, gold_file))
+
+    for batch_start in tqdm(range(0, len(cases), BATCH_SIZE), desc="processing prompts"):
+        batch = cases[batch_start:batch_start + BATCH_SIZE]
 
-            start = time.time()
-            raw_results = run_pipeline(prompt)
+        start = time.time()
+        if BATCH_SIZE == 1:
+            batch_results = [run_pipeline(batch[0][0])]
+        else:
+            batch_results = run_pipeline_batch([case[0] for case in batch])
+        end = time.time()
+
+        for (prompt, gold_ids, gold_file), raw_results in zip(batch, batch_results):
+            prompts += 1
             search_results = raw_results[1]
-            end = time.time()
 
             qdrant_ids = []
             qdrant_files = []
@@ -56,7 +75,7 @@ if __name__ == "__main__":
                 gold_ids = [gold_ids]
 
             # compute metrics
-            latency = end - start
+            latency = (end - start) / len(batch)
             metrics = get_metric_from_relevance(qdrant_ids, gold_ids, qdrant_files, gold_file, latency)
             for metric in metrics:
                 avg_metrics[metric] += metrics[metric]
@@ -74,6 +93,21 @@ if __name__ == "__main__":
 
             results.append(entry)
     print(f"Evaluated {prompts} prompts.")
+    print(f"Rerank stats: {get_rerank_stats()}")
+    router = get_collection_router()
+    print(f"Router stats: {router.stats() if router is not None else 'disabled'}")
+    # token counts, llm latency and estimated cost per llm stage, events are also in the metrics file
+    metrics = get_metrics()
+    metrics.flush()
+    print(f"LLM metrics (events written to {metrics.path}):")
+    for stage, stats in metrics.summary().items():
+        print(f"  {stage}: {stats}")
+    # RAG_TRACING=1 breaks the latency down per stage, every span is also in the trace file
+    if tracing_enabled():
+        get_exporter().flush()
+        print(f"Stage latency (spans written to {get_exporter().path}):")
+        for name, stats in get_span_stats().items():
+            print(f"  {name:>20}: {stats}")
     for metric in avg_metrics:
         avg_metrics[metric] = round(avg_metrics[metric]/prompts, 3)
     results.append(avg_metrics)
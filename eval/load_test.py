@@ -0,0 +1,326 @@
+## load generator for run_pipeline: N concurrent clients (closed loop) or poisson arrivals at a fixed rate (open loop),
+## against the offline stand-ins in eval/stubs.py. each level reports throughput, latency percentiles, error rate and
+## per stage saturation (from lib/tracing.py spans), i.e.
+##   python eval/load_test.py --fake-models --mode closed --levels 1,2,4,8,16
+##   python eval/load_test.py --fake-models --mode open --levels 5,10,20,40 --queries synthetic
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from eval.stubs import COLLECTION_KEYWORDS, install_stubs
+from eval.benchmark import REPO_ROOT, write_synthetic_corpus
+
+OUT_DIR = os.path.join(REPO_ROOT, "eval", "out", "load_tests")
+# spans reported per level, top level stages first
+STAGES = ["query_preprocess", "bi_encoder_rank", "rerank", "output_generation",
+          "route", "llm", "embed_query", "vector_search", "cross_encoder", "load_chunk_text"]
+
+_TEMPLATES = [
+    "what is the battery life of the {keyword}?",
+    "how do I reset my {keyword} to factory settings",
+    "best {keyword} for {use} under 500 dollars",
+    "does the {keyword} support {feature}?",
+    "compare {keyword} {feature} and price",
+]
+_USES = ["travel", "gaming", "work", "students", "photography"]
+_FEATURES = ["bluetooth", "usb c charging", "noise cancelling", "wireless charging", "4k video"]
+
+class QueryMix:
+    '''
+        description: thread safe source of queries.
+            - "prompts": the eval/prompts2.json prompts in order, cycled (after the first round every query is a cache hit)
+            - "synthetic": templated product questions, repeat_ratio of them re-issue an earlier query (cache hits)
+    '''
+    def __init__(self, source: str = "prompts", repeat_ratio: float = 0.2, seed: int = 0):
+        self.source = source
+        self.repeat_ratio = repeat_ratio
+        self.prompts = None
+        if source == "prompts":
+            with open(os.path.join(REPO_ROOT, "eval", "prompts2.json"), "r", encoding="utf-8") as f:
+                self.prompts = [prompt for category in json.load(f) for prompt in category["prompts"]]
+        self._rng = random.Random(seed)
+        self._issued = []
+        self._lock = threading.Lock()
+
+    def next(self) -> str:
+        with self._lock:
+            if self.source == "prompts":
+                query = self.prompts[len(self._issued) % len(self.prompts)]
+            elif self._issued and self._rng.random() < self.repeat_ratio:
+                query = self._rng.choice(self._issued)
+            else:
+                keywords = self._rng.choice(list(COLLECTION_KEYWORDS.values()))
+                query = self._rng.choice(_TEMPLATES).format(
+                    keyword=self._rng.choice(keywords), use=self._rng.choice(_USES), feature=self._rng.choice(_FEATURES),
+                ) + f" #{len(self._issued)}"
+            self._issued.append(query)
+            return query
+
+def _run_one(run, query: str, scheduled_at: float, records: list, lock: threading.Lock):
+    # latency counts from the scheduled start, so time spent queued behind a saturated pipeline is included
+    error = None
+    try:
+        run(query)
+    except Exception as e:
+        error = type(e).__name__
+    with lock:
+        records.append((scheduled_at, time.perf_counter() - scheduled_at, error))
+
+def closed_loop(run, queries: QueryMix, concurrency: int, duration_s: float, think_s: float = 0.0) -> tuple:
+    '''
+        description: concurrency clients, each sends its next query as soon as the previous one finishes
+            (plus an exponential think time with mean think_s).
+
+        output: (records of (start, latency_s, error type or None), wall time in seconds)
+    '''
+    records = []
+    lock = threading.Lock()
+    start = time.perf_counter()
+    deadline = start + duration_s
+
+    def client(seed):
+        rng = random.Random(seed)
+        while time.perf_counter() < deadline:
+            _run_one(run, queries.next(), time.perf_counter(), records, lock)
+            if think_s:
+                time.sleep(rng.expovariate(1 / think_s))
+
+    threads = [threading.Thread(target=client, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return records, time.perf_counter() - start
+
+def open_loop(run, queries: QueryMix, rate: float, duration_s: float, max_inflight: int = 256, seed: int = 0) -> tuple:
+    '''
+        description: requests arrive as a poisson process at rate per second, whether or not earlier ones finished.
+            at most max_inflight run at once, later arrivals queue (and their latency includes the wait).
+
+        output: same as closed_loop
+    '''
+    records = []
+    lock = threading.Lock()
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    arrival = start
+    with ThreadPoolExecutor(max_workers=max_inflight) as pool:
+        while True:
+            arrival += rng.expovariate(rate)
+            if arrival - start > duration_s:
+                break
+            time.sleep(max(0.0, arrival - time.perf_counter()))
+            pool.submit(_run_one, run, queries.next(), arrival, records, lock)
+    return records, time.perf_counter() - start
+
+async def _closed_loop_async(run_async, queries: QueryMix, concurrency: int, duration_s: float, think_s: float) -> tuple:
+    records = []
+    start = time.perf_counter()
+    deadline = start + duration_s
+
+    async def client(seed):
+        rng = random.Random(seed)
+        while time.perf_counter() < deadline:
+            scheduled_at = time.perf_counter()
+            error = None
+            try:
+                await run_async(queries.next())
+            except Exception as e:
+                error = type(e).__name__
+            records.append((scheduled_at, time.perf_counter() - scheduled_at, error))
+            if think_s:
+                await asyncio.sleep(rng.expovariate(1 / think_s))
+
+    await asyncio.gather(*(client(i) for i in range(concurrency)))
+    return records, time.perf_counter() - start
+
+async def _open_loop_async(run_async, queries: QueryMix, rate: float, duration_s: float, seed: int = 0) -> tuple:
+    records = []
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    arrival = start
+
+    async def request(query, scheduled_at):
+        error = None
+        try:
+            await run_async(query)
+        except Exception as e:
+            error = type(e).__name__
+        records.append((scheduled_at, time.perf_counter() - scheduled_at, error))
+
+    tasks = []
+    while True:
+        arrival += rng.expovariate(rate)
+        if arrival - start > duration_s:
+            break
+        await asyncio.sleep(max(0.0, arrival - time.perf_counter()))
+        tasks.append(asyncio.create_task(request(queries.next(), arrival)))
+    await asyncio.gather(*tasks)
+    return records, time.perf_counter() - start
+
+def summarize_level(records: list, wall_s: float, span_stats: dict, warmup_s: float = 0.0) -> dict:
+    '''
+        description: requests started in the first warmup_s seconds are left out of the latency/error numbers.
+            a stage's "busy" is its average number of requests in flight (total time in the stage / wall time),
+            the stage whose busy grows fastest with load is the one saturating.
+    '''
+    first = min((record[0] for record in records), default=0.0)
+    records = [record for record in records if record[0] - first >= warmup_s]
+    latencies = np.asarray([latency * 1000 for _, latency, error in records if error is None])
+    errors = {}
+    for _, _, error in records:
+        if error is not None:
+            errors[error] = errors.get(error, 0) + 1
+
+    def percentile(q):
+        return round(float(np.percentile(latencies, q)), 1) if len(latencies) else None
+
+    stages = {}
+    for name in STAGES:
+        stats = span_stats.get(name)
+        if stats is not None:
+            stages[name] = {
+                "count": stats["count"],
+                "mean_ms": stats["mean_ms"],
+                "p95_ms": stats["p95_ms"],
+                "busy": round(stats["count"] * stats["mean_ms"] / 1000 / wall_s, 2),
+            }
+
+    return {
+        "requests": len(records),
+        "errors": sum(errors.values()),
+        "error_rate": round(sum(errors.values()) / len(records), 4) if records else 0.0,
+        "error_types": errors,
+        "throughput_rps": round(len(latencies) / max(wall_s - warmup_s, 1e-9), 2),
+        "latency_ms": {"p50": percentile(50), "p95": percentile(95), "p99": percentile(99),
+                       "mean": round(float(latencies.mean()), 1) if len(latencies) else None},
+        "stages": stages,
+        "bottleneck": max(("query_preprocess", "bi_encoder_rank", "rerank", "output_generation"),
+                          key=lambda name: stages.get(name, {}).get("busy", 0.0)) if stages else None,
+    }
+
+def load_corpus(directories: dict):
+    # parse and upload without summaries, the load test only needs searchable collections
+    import phase_2_pipeline.data_load as data_load
+    from phase_2_pipeline.lib.doc_parsers import list_files
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        for collection, directory in directories.items():
+            chunks = []
+            for data_format, iterate in data_load.CHUNK_ITERATORS.items():
+                if list_files(directory, data_format):
+                    chunks.extend(iterate(directory))
+            if chunks:
+                data_load.upload_to_qdrant(chunks, collection)
+
+def main():
+    parser = argparse.ArgumentParser(description="concurrent load test of run_pipeline against stubbed external services")
+    parser.add_argument("--mode", choices=["closed", "open"], default="closed", help="closed: N clients back to back, open: poisson arrivals")
+    parser.add_argument("--levels", default="1,2,4,8,16", help="concurrency (closed) or requests per second (open) per level")
+    parser.add_argument("--duration", type=float, default=15.0, help="seconds per level")
+    parser.add_argument("--warmup", type=float, default=2.0, help="seconds at the start of each level left out of the results")
+    parser.add_argument("--think-time", type=float, default=0.0, help="mean seconds a closed loop client waits between requests")
+    parser.add_argument("--max-inflight", type=int, default=256, help="open loop: requests run at once, later arrivals queue")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="drive run_pipeline_async on one event loop instead of threads")
+    parser.add_argument("--queries", choices=["prompts", "synthetic"], default="prompts", help="eval/prompts2.json prompts or templated questions")
+    parser.add_argument("--repeat-ratio", type=float, default=0.2, help="synthetic: share of queries repeating an earlier one")
+    parser.add_argument("--fake-models", action="store_true", help="hashing bi encoder/word overlap cross encoder instead of fastembed models")
+    parser.add_argument("--data-dir", help="directory with one sub directory of documents per collection (default: synthetic corpus)")
+    parser.add_argument("--gemini-latency", type=float, default=0.3, help="seconds the fake gemini waits per call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of fake gemini calls that fail")
+    parser.add_argument("--slo-ms", type=float, default=2000.0, help="p95 latency target used to report capacity")
+    parser.add_argument("--max-error-rate", type=float, default=0.01, help="error rate target used to report capacity")
+    parser.add_argument("--out", default=OUT_DIR, help="directory for the result json")
+    args = parser.parse_args()
+    levels = [float(level) if args.mode == "open" else int(level) for level in args.levels.split(",")]
+
+    # caches, artifacts, metrics and spans go to a scratch directory, set before any pipeline module reads its constants
+    scratch = tempfile.mkdtemp(prefix="rag_load_test_")
+    os.environ.update({
+        "RAG_CACHE_DIR": os.path.join(scratch, "cache"),
+        "RAG_ARTIFACT_DIR": os.path.join(scratch, "artifacts"),
+        "RAG_METRICS_PATH": os.path.join(scratch, "llm_metrics.jsonl"),
+        "RAG_TRACING": "1",
+        "RAG_TRACE_PATH": os.path.join(scratch, "traces.jsonl"),
+    })
+    os.environ.setdefault("RAG_VECTOR_STORE", "qdrant")
+
+    try:
+        install_stubs(fake_models=args.fake_models, gemini_latency_s=args.gemini_latency, gemini_error_rate=args.error_rate)
+        from phase_2_pipeline.p0_runner import run_pipeline, run_pipeline_async
+        from phase_2_pipeline.lib.embedding_models import warm_up
+        from phase_2_pipeline.lib.tracing import get_span_stats, reset_span_stats
+
+        if args.data_dir:
+            directories = {name: os.path.join(args.data_dir, name) for name in sorted(os.listdir(args.data_dir))
+                           if os.path.isdir(os.path.join(args.data_dir, name))}
+        else:
+            directories = write_synthetic_corpus(os.path.join(scratch, "corpus"), 4, 1500)
+        load_corpus(directories)
+        if not args.fake_models:
+            warm_up()
+
+        queries = QueryMix(args.queries, args.repeat_ratio)
+        results = []
+        print(f"{args.mode} loop{' (async)' if args.use_async else ''}, {args.duration:.0f}s per level, "
+              f"gemini stub latency {args.gemini_latency}s, error rate {args.error_rate}")
+        print(f"{'level':>7}  {'requests':>8}  {'rps':>7}  {'p50 ms':>8}  {'p95 ms':>8}  {'p99 ms':>8}  {'errors':>7}  bottleneck (busy)")
+        for level in levels:
+            reset_span_stats()
+            if args.use_async:
+                if args.mode == "closed":
+                    records, wall_s = asyncio.run(_closed_loop_async(run_pipeline_async, queries, level, args.duration, args.think_time))
+                else:
+                    records, wall_s = asyncio.run(_open_loop_async(run_pipeline_async, queries, level, args.duration))
+            elif args.mode == "closed":
+                records, wall_s = closed_loop(run_pipeline, queries, level, args.duration, args.think_time)
+            else:
+                records, wall_s = open_loop(run_pipeline, queries, level, args.duration, args.max_inflight)
+
+            summary = summarize_level(records, wall_s, get_span_stats(), args.warmup)
+            summary["level"] = level
+            results.append(summary)
+
+            latency = summary["latency_ms"]
+            bottleneck = summary["bottleneck"]
+            busy = summary["stages"].get(bottleneck, {}).get("busy") if bottleneck else None
+            print(f"{level:>7}  {summary['requests']:>8}  {summary['throughput_rps']:>7}  {latency['p50']!s:>8}  "
+                  f"{latency['p95']!s:>8}  {latency['p99']!s:>8}  {summary['error_rate']:>7.2%}  {bottleneck} ({busy})")
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    within_slo = [result for result in results if result["latency_ms"]["p95"] is not None
+                  and result["latency_ms"]["p95"] <= args.slo_ms and result["error_rate"] <= args.max_error_rate]
+    capacity = max(within_slo, key=lambda result: result["throughput_rps"]) if within_slo else None
+    if capacity is None:
+        print(f"no level met p95 <= {args.slo_ms:.0f} ms with error rate <= {args.max_error_rate:.1%}")
+    else:
+        print(f"capacity: {capacity['throughput_rps']} requests/s at level {capacity['level']} "
+              f"(p95 {capacity['latency_ms']['p95']} ms <= {args.slo_ms:.0f} ms)")
+
+    os.makedirs(args.out, exist_ok=True)
+    out_path = os.path.join(args.out, datetime.now().strftime("%Y%m%d_%H%M%S") + f"_load_test_{args.mode}.json")
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "settings": {key: value for key, value in vars(args).items() if key != "out"},
+            "capacity": None if capacity is None else {"level": capacity["level"], "throughput_rps": capacity["throughput_rps"]},
+            "levels": results,
+        }, f, indent=2)
+    print(f"results wrote to {out_path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+## compares the adaptive rerank (RERANK_CASCADE, RERANK_SKIP_MARGIN) against scoring every candidate on the prompts2.json
+## prompts, run it before turning either on:
+##   python eval/rerank_recall.py [skip margin, "none" for the cascade alone]
+import os
+import json
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from phase_2_pipeline.lib.embedding_models import warm_up
+from phase_2_pipeline.p1_query_preprocess import query_preprocess
+from phase_2_pipeline.p2_bi_encoder_rank import bi_encoder_rank_batch
+from phase_2_pipeline.p3_cross_encoder_rerank import compare_with_full_rerank
+
+if __name__ == "__main__":
+    skip_margin = None if len(sys.argv) > 1 and sys.argv[1].lower() == "none" else float(sys.argv[1]) if len(sys.argv) > 1 else 0.1
+    warm_up()
+
+    with open(os.path.join(os.getcwd(), "eval", "prompts2.json"), "r", encoding="utf-8") as f:
+        prompts = [prompt for category in json.load(f) for prompt in category["prompts"]]
+
+    processed_queries = [query_preprocess(prompt) for prompt in prompts]
+    initial_chunks_list = bi_encoder_rank_batch(processed_queries)
+    result = compare_with_full_rerank(initial_chunks_list, processed_queries, skip_margin)
+    print(f"adaptive rerank (skip margin {skip_margin}) against full rerank: {result}")
@@ -0,0 +1,211 @@
+## offline stand-ins for the pipeline's external services (gemini, qdrant, LM Studio, fastembed models),
+## used by eval/benchmark.py and eval/load_test.py so stages can be measured without network access or api keys
+import asyncio
+import json
+import os
+import random
+import sys
+import threading
+import time
+import types
+import zlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# words that pick a collection in the fake query preprocess, the first collection is used when none match
+COLLECTION_KEYWORDS = {
+    "camera_data": ["camera", "lens", "canon", "photo"],
+    "displays_data": ["tv", "display", "monitor", "samsung"],
+    "headphone_data": ["headphone", "earbud", "xm4", "bose", "noise"],
+    "laptop_data": ["laptop", "notebook", "macbook", "asus", "dell"],
+    "phone_data": ["phone", "pixel", "iphone", "galaxy", "motorola"],
+}
+
+def _words(text: str) -> list:
+    return "".join(c.lower() if c.isalnum() else " " for c in str(text)).split()
+
+def _approx_tokens(text: str) -> int:
+    # ~4 characters per token, close enough for cost/throughput numbers
+    return max(1, len(text) // 4)
+
+def pick_collection(text: str) -> str:
+    words = set(_words(text))
+    for collection, keywords in COLLECTION_KEYWORDS.items():
+        if words.intersection(keywords):
+            return collection
+    return next(iter(COLLECTION_KEYWORDS))
+
+class FakeBiEncoder:
+    '''
+        description: feature hashing embeddings (every word adds +-1 to a hashed dimension), texts sharing words get
+            similar vectors so search results are meaningful. same api as fastembed's TextEmbedding.
+    '''
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def _vector(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in _words(text) or [""]:
+            h = zlib.crc32(word.encode("utf-8"))
+            vector[h % self.dim] += 1.0 if h & 1 << 31 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def embed(self, texts, batch_size: int = 256, **kwargs):
+        if isinstance(texts, str):
+            texts = [texts]
+        for text in texts:
+            yield self._vector(text)
+
+    query_embed = embed
+    passage_embed = embed
+
+class FakeCrossEncoder:
+    # word overlap between query and candidate, same api as fastembed's TextCrossEncoder
+    def rerank(self, query: str, documents, batch_size: int = 64, **kwargs):
+        query_words = set(_words(query))
+        for document in documents:
+            document_words = set(_words(document))
+            yield len(query_words & document_words) / (len(document_words) ** 0.5 or 1.0)
+
+    def rerank_pairs(self, pairs, batch_size: int = 64, **kwargs):
+        for query, document in pairs:
+            yield from self.rerank(query, [document])
+
+def _response(text: str, prompt_tokens: int):
+    usage = types.SimpleNamespace(prompt_token_count=prompt_tokens, candidates_token_count=_approx_tokens(text))
+    return types.SimpleNamespace(text=text, usage_metadata=usage)
+
+class StubServiceError(RuntimeError):
+    # injected failure, see error_rate
+    pass
+
+class FakeGeminiModels:
+    '''
+        description: models api of the gemini client. requests with a json response schema (query preprocess) get a
+            ProcessedQuery picked by keyword, other requests get a short answer. each call sleeps latency_s,
+            streamed answers are split into stream_pieces chunks. a share error_rate of calls raise StubServiceError.
+    '''
+    def __init__(self, latency_s: float = 0.0, stream_pieces: int = 4, error_rate: float = 0.0):
+        self.latency_s = latency_s
+        self.stream_pieces = stream_pieces
+        self.error_rate = error_rate
+
+    def _answer(self, contents, config) -> tuple:
+        if self.error_rate and random.random() < self.error_rate:
+            raise StubServiceError("injected gemini error")
+        text = contents[-1]["parts"][0]["text"]
+        prompt_tokens = sum(_approx_tokens(part["text"]) for content in contents for part in content["parts"])
+        if config:
+            return json.dumps({"query": text, "collection": pick_collection(text)}), prompt_tokens
+        return "stub answer: " + " ".join(_words(text)[:40]), prompt_tokens
+
+    def generate_content(self, model, contents, config=None):
+        time.sleep(self.latency_s)
+        return _response(*self._answer(contents, config))
+
+    def _pieces(self, contents, config) -> list:
+        text, prompt_tokens = self._answer(contents, config)
+        step = max(1, len(text) // self.stream_pieces)
+        return [_response(text[start:start + step], prompt_tokens) for start in range(0, len(text), step)]
+
+    def generate_content_stream(self, model, contents, config=None):
+        for response in self._pieces(contents, config):
+            time.sleep(self.latency_s / self.stream_pieces)
+            yield response
+
+class FakeAsyncGeminiModels:
+    def __init__(self, models: FakeGeminiModels):
+        self.models = models
+
+    async def generate_content(self, model, contents, config=None):
+        await asyncio.sleep(self.models.latency_s)
+        return _response(*self.models._answer(contents, config))
+
+    async def generate_content_stream(self, model, contents, config=None):
+        async def pieces():
+            for response in self.models._pieces(contents, config):
+                await asyncio.sleep(self.models.latency_s / self.models.stream_pieces)
+                yield response
+        return pieces()
+
+class FakeGeminiClient:
+    # drop in for genai.Client, i.e. set_gemini_client(FakeGeminiClient(latency_s=0.3))
+    def __init__(self, latency_s: float = 0.0, stream_pieces: int = 4, error_rate: float = 0.0):
+        self.models = FakeGeminiModels(latency_s, stream_pieces, error_rate)
+        self.aio = types.SimpleNamespace(models=FakeAsyncGeminiModels(self.models))
+
+class AsyncQdrantAdapter:
+    '''
+        description: async api over a sync QdrantClient (every method runs on a worker thread). local mode clients
+            cannot share storage between QdrantClient and AsyncQdrantClient, this gives the async pipeline the same data.
+    '''
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        method = getattr(self._client, name)
+
+        async def call(*args, **kwargs):
+            return await asyncio.to_thread(method, *args, **kwargs)
+        return call
+
+class _MetadataHandler(BaseHTTPRequestHandler):
+    latency_s = 0.0
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        time.sleep(self.latency_s)
+        text = body["messages"][-1]["content"]
+        content = json.dumps({"summary": " ".join(_words(text)[:30]), "keywords": _words(text)[:6]})
+        out = json.dumps({
+            "choices": [{"message": {"content": content}}],
+            "usage": {"completion_tokens": _approx_tokens(content)},
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+def start_metadata_stub(latency_s: float = 0.0):
+    '''
+        description: openai compatible chat completions server on a free local port, standing in for LM Studio.
+            answers every request with a summary/keywords json built from the chunk text.
+
+        output: (server, url for METADATA_LLM_URL), call server.shutdown() when done
+    '''
+    handler = type("MetadataHandler", (_MetadataHandler,), {"latency_s": latency_s})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions"
+
+def install_stubs(fake_models: bool = True, qdrant_path: str = None, gemini_latency_s: float = 0.0, gemini_error_rate: float = 0.0):
+    '''
+        description: points the pipeline at local stand-ins: a local mode qdrant (in memory, or on disk at qdrant_path),
+            the fake gemini client (failing gemini_error_rate of calls), and with fake_models the hashing bi encoder and word overlap cross encoder
+            (otherwise the real models are loaded from the local fastembed cache).
+            the LM Studio stand-in is separate (start_metadata_stub), its url has to be set before data_load is imported.
+
+        output: the QdrantClient in use
+    '''
+    from qdrant_client import QdrantClient
+    from phase_2_pipeline.lib.qdrant_client import set_qdrant_client
+    from phase_2_pipeline.lib.gemini_client import set_gemini_client
+    from phase_2_pipeline.lib.vector_store import set_vector_store
+    from phase_2_pipeline.lib.embedding_models import register_model
+    from phase_2_pipeline.lib.constants import EMBEDDING_MODEL_NAME, RERANKER_MODEL_NAME
+
+    client = QdrantClient(path=qdrant_path) if qdrant_path else QdrantClient(":memory:")
+    set_qdrant_client(client, AsyncQdrantAdapter(client))
+    set_vector_store(None)
+    set_gemini_client(FakeGeminiClient(gemini_latency_s, error_rate=gemini_error_rate))
+    if fake_models:
+        register_model(EMBEDDING_MODEL_NAME, FakeBiEncoder())
+        register_model(RERANKER_MODEL_NAME, FakeCrossEncoder())
+    return client
@@ -1,12 +1,14 @@
 # edit this file with data to load and run it to push it to the qdrant cluster: python qdrant/data_load.py
 import os
+import sys
 import uuid
 from client import get_client, EMBEDDING_MODEL_NAME
 from qdrant_client import models
-from pypdf import PdfReader
 from fastembed import TextEmbedding
-from bs4 import BeautifulSoup
-import json
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from phase_2_pipeline.lib.doc_parsers import parse_directory
+from phase_2_pipeline.lib.constants import PARSE_WORKERS
 
 ## ------ TODO ------ 
 # modify fields based on location of data, name of collection to store it, and data types
@@ -19,41 +21,18 @@ DATA_FORMAT = "PDF"
 def process_pdf_from_directory():
     """
     Scans a directory for PDF files, extracts text, and splits it into chunks by page.
+    Files are parsed in parallel by PARSE_WORKERS processes.
     
     Returns:
         A list of dictionaries, where each dictionary contains the source filename
         and a specific chunk of text.
     """
-    all_text_chunks = []
-
-    print(f"Scanning for PDF files in '{INPUT_DIRECTORY}'...")
-    for filename in os.listdir(INPUT_DIRECTORY):
-        if filename.lower().endswith(".pdf"):
-            file_path = os.path.join(INPUT_DIRECTORY, filename)
-            try:
-                reader = PdfReader(file_path)
-                chunks = []
-                for page in reader.pages:
-                    page_text = page.extract_text()
-                    if page_text:
-                        chunks.append(page_text.strip())
-                
-                for i, text in enumerate(chunks):
-                    all_text_chunks.append({
-                        "source_file": filename,
-                        "page": i+1,
-                        "text": text 
-                    })
-                print(f"  - Extracted {len(chunks)} text chunks from '{filename}'.")
-
-            except Exception as e:
-                print(f"  - ERROR: Failed to process '{filename}': {e}")
-                
-    return all_text_chunks
+    return list(parse_directory(INPUT_DIRECTORY, "PDF", PARSE_WORKERS))
 
 def process_html_from_directory():
     """
     Scans a directory for .html files, extracts the visible text, and splits it into chunks.
+    Files are parsed in parallel by PARSE_WORKERS processes.
     
     Requires `pip install beautifulsoup4`.
     
@@ -61,94 +40,24 @@ def process_html_from_directory():
         A list of dictionaries, where each dictionary contains the source filename,
         the page title, and a specific chunk of text.
     """
-    all_text_chunks = []
-
-    print(f"Scanning for .html files in '{INPUT_DIRECTORY}'...")
-    for filename in os.listdir(INPUT_DIRECTORY):
-        if filename.lower().endswith((".html", ".htm")):
-            file_path = os.path.join(INPUT_DIRECTORY, filename)
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    soup = BeautifulSoup(f, 'html.parser')
-                
-                # Extract page title for metadata, if it exists
-                page_title = soup.title.string if soup.title else "No Title"
-
-                # Get all human-readable text from the body
-                # .get_text() is powerful; it strips tags and combines text.
-                # The separator ensures paragraphs are spaced, making chunking reliable.
-                full_text = soup.body.get_text(separator='\n\n', strip=True)
-                
-                all_text_chunks.append({
-                    "source_file": filename,
-                    "title": page_title,
-                    "text": full_text
-                })
-                print(f"  - Extracted from '{filename}'.")
-
-            except Exception as e:
-                print(f"  - ERROR: Failed to process '{filename}': {e}")
-                
-    return all_text_chunks
+    return list(parse_directory(INPUT_DIRECTORY, "HTML", PARSE_WORKERS))
 
 def process_txt_from_directory():
     """
     Scans a directory for .txt files, reads their content, and splits it into chunks.
+    Files are parsed in parallel by PARSE_WORKERS processes.
     
     Returns:
         A list of dictionaries, where each dictionary contains the source filename
         and a specific chunk of text.
     """
-    all_text_chunks = []
-
-    print(f"Scanning for .txt files in '{INPUT_DIRECTORY}'...")
-    for filename in os.listdir(INPUT_DIRECTORY):
-        if filename.lower().endswith(".txt"):
-            file_path = os.path.join(INPUT_DIRECTORY, filename)
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    full_text = f.read()
-                
-                all_text_chunks.append({
-                    "source_file": filename,
-                    "text": full_text
-                })
-                print(f"  - Extracted from '{filename}'.")
-
-            except Exception as e:
-                print(f"  - ERROR: Failed to process '{filename}': {e}")
-                
-    return all_text_chunks
+    return list(parse_directory(INPUT_DIRECTORY, "TXT", PARSE_WORKERS))
 
 def process_json_from_directory():
     '''
     expects data represented as a single json object
     '''
-    all_text_chunks = []
-
-    print(f"Scanning for .json files in '{INPUT_DIRECTORY}'...")
-    for filename in os.listdir(INPUT_DIRECTORY):
-        if filename.lower().endswith(".json"):
-            file_path = os.path.join(INPUT_DIRECTORY, filename)
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                
-                # Ensure data is one json object
-                if not isinstance(data, dict):
-                    data = {"data": data}
-
-                payload = {}
-                payload["source_file"] = filename
-                payload["text"] = json.dumps(data, indent=2)
-                all_text_chunks.append(payload)
-                
-                print(f"  - Extracted text from '{filename}'.")
-
-            except Exception as e:
-                print(f"  - ERROR: Failed to process '{filename}': {e}")
-                
-    return all_text_chunks
+    return list(parse_directory(INPUT_DIRECTORY, "JSON", PARSE_WORKERS))
 
 def qdrant_run():
     """
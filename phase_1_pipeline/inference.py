@@ -1,7 +1,6 @@
 # run this file to make inference requests: python qdrant/inference.py
 import os, sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from phase_1_pipeline.client import get_client
 import os
 import pprint
 import datetime
@@ -10,6 +9,10 @@ from phase_1_pipeline.client import EMBEDDING_MODEL_NAME
 from fastembed import TextEmbedding
 from functools import lru_cache
 from tqdm import tqdm
+from phase_2_pipeline.lib.embedding_cache import get_query_embedding_cache
+from phase_2_pipeline.lib.vector_store import VectorStore, QdrantVectorStore, get_vector_store
+from phase_2_pipeline.lib.tracing import traced, span, tracing_enabled, get_span_stats
+from qdrant_client import models
 
 # modify query to ask what you want
 QUERIES = [
@@ -24,23 +27,28 @@ def get_embedding_model():
     embedding_model = TextEmbedding(model_name=EMBEDDING_MODEL_NAME)
     return embedding_model
 
+# client can be any vector store from phase_2_pipeline/lib/vector_store.py or a plain QdrantClient
+@traced("retrieval")
 def retrieval_pipeline(query, collection_name, results_count, client):
-    embedding_model = get_embedding_model()
+    if not isinstance(client, VectorStore):
+        client = QdrantVectorStore(client)
 
-    # create vector for the query
-    query_vector = next(embedding_model.embed([query]))
-    search_results = client.query_points(
-        collection_name=collection_name,
-        query=query_vector.tolist(),
-        # query_vector=query_vector.tolist(), 
-        limit=results_count,  
-        with_payload=True 
-    )
+    # create vector for the query, cached queries skip the embedding model entirely
+    with span("embed_query", queries=1):
+        query_vector = get_query_embedding_cache().embed(EMBEDDING_MODEL_NAME, get_embedding_model, [query])[0]
+    with span("vector_search", collection=collection_name) as search_span:
+        points = client.search(
+            collection_name=collection_name,
+            query_vector=query_vector,
+            limit=results_count,  
+            with_payload=True 
+        )
+        search_span.set_attribute("candidates", len(points))
 
-    return search_results
+    return models.QueryResponse(points=points)
 
 if __name__ == "__main__":
-    client = get_client()
+    client = get_vector_store()
     out_dir = os.path.join(os.getcwd(), "phase_1_pipeline", "results")
     os.makedirs(out_dir, exist_ok=True)  # Create directory if it does not exist
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -61,4 +69,9 @@ if __name__ == "__main__":
             f.write(f"\nLatency: {end - start:.2f} seconds\n")
             f.write("-" * 40 + "\n")
                 
-        print(f"Results saved to: {out_path}")
\ No newline at end of file
+        print(f"Results saved to: {out_path}")
+
+    # RAG_TRACING=1 splits the latency above into query embedding and search
+    if tracing_enabled():
+        for name, stats in get_span_stats().items():
+            print(f"{name:>15}: {stats}")
\ No newline at end of file
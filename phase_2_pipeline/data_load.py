@@ -1,192 +1,155 @@
-import requests
 import os
 import sys
-import uuid
 from qdrant_client import models
-from pypdf import PdfReader
-from bs4 import BeautifulSoup
-import json
+import itertools
 from tqdm import tqdm
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from phase_2_pipeline.lib.qdrant_client import get_qdrant_client
 from phase_2_pipeline.lib.embedding_models import bi_encoder_model
+from phase_2_pipeline.lib.doc_parsers import parse_directory, parse_files, list_files, FILE_PARSERS
+from phase_2_pipeline.lib.chunking import chunk_documents
+from phase_2_pipeline.lib.ingest_manifest import IngestManifest, point_id_for_chunk
+from phase_2_pipeline.lib.metadata_client import MetadataClient
+from phase_2_pipeline.lib.artifact_store import ArtifactStore
+from phase_2_pipeline.lib.collection_router import invalidate_collection_router, build_collection_router
+from phase_2_pipeline.lib.quantization import collection_config
+from phase_2_pipeline.lib.sparse_vectors import embed_sparse_documents, sparse_vectors_config, has_sparse_vectors
+from phase_2_pipeline.lib.constants import PARSE_WORKERS, WRITE_ARTIFACTS, HYBRID_SEARCH, SPARSE_VECTOR_NAME
 
 # ---- TODO used for unit testing ----
 # modify fields based on location of data, name of collection to store it, and data types
 INPUT_DIRECTORY = os.getcwd() + "/data/temp/"
 # valid formats are PDF, HTML, TXT, and JSON
 DATA_FORMAT = "PDF"
+# chunks embedded and uploaded at a time, bounds peak memory during ingestion
+UPLOAD_BATCH_SIZE = 256
+# only the first pages of each pdf are kept
+MAX_PDF_PAGES = 52
+# formats whose files are split into token sized chunks (pdfs stay one chunk per page)
+CHUNKED_FORMATS = ("HTML", "TXT", "JSON")
 
 SYS_PROMPT = '''Return me a json object with one key being 'summary' which is a 4-5 sentence summary of the text in the queries I pass in. For the summary,
 you can jump straight into the summary, avoid filler words like "this text is about" or "the provided text", etc. MAKE SURE SUMMARIES are in ENGLISH. TRANSLATE 
 IF NEEDED, I DONT WANT SUMMARIES IN ANY OTHER LANGUAGE.
 For the second key, 'keywords', include a list of 5-8 keywords that best fit the text in the queries I pass in.'''
 
+_metadata_client = None
+
+def get_metadata_client():
+    global _metadata_client
+    if _metadata_client is None:
+        _metadata_client = MetadataClient(SYS_PROMPT)
+    return _metadata_client
+
 # returns json object from LLM with summary string and keywords list
 def gen_metadata(chunk_text):
-    url = "http://localhost:1234/v1/chat/completions"
-    headers = {
-        "Content-Type": "application/json"
-    }
-    data = {
-        "model": "llama-3.2-3b-instruct",
-        "messages": [
-            {"role": "system", "content": SYS_PROMPT},
-            {"role": "user", "content": chunk_text}
-        ],
-        "temperature": 0.3,
-        "max_tokens": -1,
-        "stream": False
-    }
-
-    response = requests.post(url, headers=headers, json=data)
-    structured_response = response.json()['choices'][0]['message']['content']
-    structured_response = json.loads(structured_response)
-    return structured_response
+    return get_metadata_client().gen_metadata(chunk_text)
 
-def process_pdf_from_directory(dir_path):
+def iter_pdf_chunks(dir_path, workers=PARSE_WORKERS):
     """
     Scans a directory for PDF files, extracts text, and splits it into chunks by page.
+    Files are parsed in parallel by `workers` processes.
     
+    Yields:
+        One dictionary per chunk, containing the source filename, page number,
+        and the chunk of text, in sorted filename order.
+    """
+    return parse_directory(dir_path, "PDF", workers, max_pages=MAX_PDF_PAGES)
+
+def process_pdf_from_directory(dir_path):
+    """
     Returns:
         A list of dictionaries, where each dictionary contains the source filename
-        and a specific chunk of text.
+        and a specific chunk of text (see iter_pdf_chunks).
     """
-    all_text_chunks = []
-
-    print(f"Scanning for PDF files in '{dir_path}'...")
-    for filename in os.listdir(dir_path):
-        if filename.lower().endswith(".pdf"):
-            file_path = os.path.join(dir_path, filename)
-            try:
-                reader = PdfReader(file_path)
-                chunks = []
-                for page in reader.pages:
-                    page_text = page.extract_text()
-                    if page_text:
-                        chunks.append(page_text.strip())
-                
-                for i, text in enumerate(chunks):
-                    all_text_chunks.append({
-                        "source_file": filename,
-                        "page": i+1,
-                        "text": text 
-                    })
-                    if i > 50:
-                        break
-                print(f"  - Extracted {len(chunks)} text chunks from '{filename}'.")
-
-            except Exception as e:
-                print(f"  - ERROR: Failed to process '{filename}': {e}")
-                
-    return all_text_chunks
+    return list(iter_pdf_chunks(dir_path))
 
-def process_html_from_directory(dir_path):
+def iter_html_chunks(dir_path, workers=PARSE_WORKERS):
     """
     Scans a directory for .html files, extracts the visible text, and splits it into chunks.
+    Files are parsed in parallel by `workers` processes.
     
-    Requires `pip install beautifulsoup4`.
-    
+    Yields:
+        One dictionary per chunk, containing the source filename,
+        the page title, and a specific chunk of text with its offsets in the page text.
+    """
+    return chunk_documents(parse_directory(dir_path, "HTML", workers), "HTML")
+
+def process_html_from_directory(dir_path):
+    """
     Returns:
         A list of dictionaries, where each dictionary contains the source filename,
-        the page title, and a specific chunk of text.
+        the page title, and a specific chunk of text (see iter_html_chunks).
     """
-    all_text_chunks = []
-
-    print(f"Scanning for .html files in '{dir_path}'...")
-    for filename in os.listdir(dir_path):
-        if filename.lower().endswith((".html", ".htm")):
-            file_path = os.path.join(dir_path, filename)
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    soup = BeautifulSoup(f, 'html.parser')
-                
-                # Extract page title for metadata, if it exists
-                page_title = soup.title.string if soup.title else "No Title"
-
-                # Get all human-readable text from the body
-                # .get_text() is powerful; it strips tags and combines text.
-                # The separator ensures paragraphs are spaced, making chunking reliable.
-                full_text = soup.body.get_text(separator='\n\n', strip=True)
-                
-                all_text_chunks.append({
-                    "source_file": filename,
-                    "title": page_title,
-                    "text": full_text
-                })
-                print(f"  - Extracted from '{filename}'.")
-
-            except Exception as e:
-                print(f"  - ERROR: Failed to process '{filename}': {e}")
-                
-    return all_text_chunks
+    return list(iter_html_chunks(dir_path))
 
-def process_txt_from_directory(dir_path):
+def iter_txt_chunks(dir_path, workers=PARSE_WORKERS):
     """
     Scans a directory for .txt files, reads their content, and splits it into chunks.
+    Files are parsed in parallel by `workers` processes.
     
+    Yields:
+        One dictionary per chunk, containing the source filename
+        and a specific chunk of text with its offsets in the file.
+    """
+    return chunk_documents(parse_directory(dir_path, "TXT", workers), "TXT")
+
+def process_txt_from_directory(dir_path):
+    """
     Returns:
         A list of dictionaries, where each dictionary contains the source filename
-        and a specific chunk of text.
+        and a specific chunk of text (see iter_txt_chunks).
     """
-    all_text_chunks = []
-
-    print(f"Scanning for .txt files in '{dir_path}'...")
-    for filename in os.listdir(dir_path):
-        if filename.lower().endswith(".txt"):
-            file_path = os.path.join(dir_path, filename)
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    full_text = f.read()
-                
-                all_text_chunks.append({
-                    "source_file": filename,
-                    "text": full_text
-                })
-                print(f"  - Extracted from '{filename}'.")
-
-            except Exception as e:
-                print(f"  - ERROR: Failed to process '{filename}': {e}")
-                
-    return all_text_chunks
+    return list(iter_txt_chunks(dir_path))
+
+def iter_json_chunks(dir_path, workers=PARSE_WORKERS):
+    '''
+    expects data represented as a single json object, yields chunks split on its top level keys
+    '''
+    return chunk_documents(parse_directory(dir_path, "JSON", workers), "JSON")
 
 def process_json_from_directory(dir_path):
     '''
     expects data represented as a single json object
     '''
-    all_text_chunks = []
-
-    print(f"Scanning for .json files in '{dir_path}'...")
-    for filename in os.listdir(dir_path):
-        if filename.lower().endswith(".json"):
-            file_path = os.path.join(dir_path, filename)
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                
-                # Ensure data is one json object
-                if not isinstance(data, dict):
-                    data = {"data": data}
-
-                payload = {}
-                payload["source_file"] = filename
-                payload["text"] = json.dumps(data, indent=2)
-                all_text_chunks.append(payload)
-                
-                print(f"  - Extracted text from '{filename}'.")
-
-            except Exception as e:
-                print(f"  - ERROR: Failed to process '{filename}': {e}")
-                
-    return all_text_chunks
+    return list(iter_json_chunks(dir_path))
 
-def upload_to_qdrant(chunks, collection_name):
+# chunk generator for each valid DATA_FORMAT
+CHUNK_ITERATORS = {
+    "PDF": iter_pdf_chunks,
+    "HTML": iter_html_chunks,
+    "TXT": iter_txt_chunks,
+    "JSON": iter_json_chunks,
+}
+
+def enrich_chunks(chunks):
     """
-    Main function to orchestrate the PDF processing and uploading workflow.
+    Adds the LLM generated summary and keywords to each chunk as it streams through,
+    with METADATA_WORKERS requests to the local LLM in flight at a time.
+
+    Yields:
+        The same chunk dictionaries with 'summary' and 'keywords' added when the LLM returns them.
+    """
+    return get_metadata_client().enrich(chunks, text_chars=2000)
+
+def batched(iterable, batch_size):
+    # same as itertools.batched (python 3.12+), yields lists of up to batch_size items
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+def ensure_collection(client, collection_name):
+    """
+    Creates the collection if it does not exist yet, with bm25 sparse vectors when HYBRID_SEARCH is on
+    and quantized dense vectors when QUANTIZATION is set.
+
+    Returns:
+        True if the collection indexes sparse vectors (uploads must include them).
     """
-    client = get_qdrant_client()
-    
     print(f"\nSetting up Qdrant collection: '{collection_name}'")
 
     # check if collection exists, if not create it
@@ -199,43 +162,140 @@ def upload_to_qdrant(chunks, collection_name):
         print(f"Collection '{collection_name}' does not exist. Creating it now.")
         client.create_collection(
             collection_name=collection_name,
-            vectors_config=models.VectorParams(
-                size=384,
-                distance=models.Distance.COSINE
-            ),
+            **collection_config(size=384, distance=models.Distance.COSINE),
+            sparse_vectors_config=sparse_vectors_config() if HYBRID_SEARCH else None,
         )
         print("Collection created successfully.")
 
+    sparse = has_sparse_vectors(client, collection_name)
+    if HYBRID_SEARCH and not sparse:
+        print(f"WARNING: '{collection_name}' has no sparse vectors, recreate it to use hybrid search.")
+
     print("Collection setup complete.")
+    return sparse
+
+def upload_to_qdrant_stream(chunks, collection_name, batch_size=UPLOAD_BATCH_SIZE, write_artifacts=WRITE_ARTIFACTS):
+    """
+    Streams chunks into a collection in bounded batches: each batch is embedded and uploaded
+    before the next one is pulled from the chunks iterable, so peak memory is bounded by
+    batch_size no matter how large the source directory is. Point ids are derived from each
+    chunk's source, position, and text, so uploading the same chunk again overwrites it.
+    Collections with sparse vectors also get a bm25 vector per chunk.
+    With write_artifacts, every batch is also saved as a shard in the collection's ArtifactStore.
+
+    Returns:
+        The number of points uploaded.
+    """
+    client = get_qdrant_client()
+    sparse = ensure_collection(client, collection_name)
 
-    # Convert Text to Vectors (Embeddings) ---
     embedding_model = bi_encoder_model()
-    
-    print(f"Creating embeddings for {len(chunks)} text chunks...")
-    embeddings_result = embedding_model.embed([item["text"] for item in chunks])
-    print("Embeddings created successfully.")
-    
-    # upload to qdrant
-    print(f"\nUploading {len(chunks)} points to Qdrant...")
-    
-    points_to_upload = []
-    for vector, chunk_data in zip(embeddings_result, chunks):
-        # del chunk_data["text"] # remove raw text from metadata
-        points_to_upload.append(
-            models.PointStruct(
-                id=str(uuid.uuid4()),
-                vector=vector.tolist(),
-                payload=chunk_data
+    artifact_store = ArtifactStore(collection_name) if write_artifacts else None
+
+    print(f"\nEmbedding and uploading points to Qdrant in batches of {batch_size}...")
+    uploaded = 0
+    for batch in batched(chunks, batch_size):
+        embeddings_result = list(embedding_model.embed([item["text"] for item in batch], batch_size=batch_size))
+        sparse_result = embed_sparse_documents([item["text"] for item in batch], batch_size=batch_size) if sparse else None
+
+        points_to_upload = []
+        for i, (vector, chunk_data) in enumerate(zip(embeddings_result, batch)):
+            # del chunk_data["text"] # remove raw text from metadata
+            point_vector = vector.tolist()
+            if sparse:
+                # "" is the collection's unnamed dense vector
+                point_vector = {"": point_vector, SPARSE_VECTOR_NAME: sparse_result[i]}
+            points_to_upload.append(
+                models.PointStruct(
+                    id=point_id_for_chunk(chunk_data),
+                    vector=point_vector,
+                    payload=chunk_data
+                )
             )
-        )
 
-    client.upload_points(
-        collection_name=collection_name,
-        points=points_to_upload,
-        batch_size=256
-    )
+        if artifact_store is not None:
+            artifact_store.write_shard([point.id for point in points_to_upload], embeddings_result, batch)
+
+        client.upload_points(
+            collection_name=collection_name,
+            points=points_to_upload,
+            batch_size=batch_size
+        )
+        uploaded += len(points_to_upload)
+        print(f"  - Uploaded {uploaded} points so far.")
 
     print("Upload complete!")
+    return uploaded
+
+def upload_to_qdrant(chunks, collection_name):
+    """
+    Embeds and uploads a list of chunks to a collection, creating it if needed.
+    """
+    return upload_to_qdrant_stream(chunks, collection_name)
+
+def delete_points(client, collection_name, point_ids):
+    if point_ids:
+        client.delete(
+            collection_name=collection_name,
+            points_selector=models.PointIdsList(points=list(point_ids)),
+        )
+        if WRITE_ARTIFACTS:
+            ArtifactStore(collection_name).delete(point_ids)
+
+def ingest_directory(dir_path, data_format, collection_name, manifest, workers=PARSE_WORKERS):
+    """
+    Incrementally syncs one directory/format into a collection using the ingest manifest:
+        - unchanged files (same content hash) are skipped without parsing, summarizing, or embedding
+        - new and changed files are parsed, enriched, and uploaded; points left over from an older
+          version of a changed file are deleted
+        - files recorded in the manifest that no longer exist have their points deleted
+    The manifest is saved once the upload finishes, so an interrupted run is simply redone next time.
+
+    Returns:
+        A dictionary with the number of changed, unchanged, and deleted files.
+    """
+    client = get_qdrant_client()
+    file_paths = list_files(dir_path, data_format)
+    changed, unchanged, deleted = manifest.diff(collection_name, dir_path, file_paths, FILE_PARSERS[data_format][1])
+    print(f"{len(changed)} new/changed, {len(unchanged)} unchanged, {len(deleted)} deleted {data_format} files in '{dir_path}'")
+
+    for file_key in deleted:
+        delete_points(client, collection_name, manifest.point_ids(collection_name, file_key))
+        manifest.remove(collection_name, file_key)
+
+    # point ids per parsed file, collected as chunks stream past so the manifest can be updated after upload
+    file_hashes = dict(changed)
+    parsed_files = []
+    parse_kwargs = {"max_pages": MAX_PDF_PAGES} if data_format == "PDF" else None
+
+    def changed_chunks():
+        for file_path, chunks, error in parse_files(data_format, list(file_hashes), workers, parse_kwargs, file_hashes):
+            filename = os.path.basename(file_path)
+            if error is not None:
+                # left out of the manifest so it is retried on the next run
+                print(f"  - ERROR: Failed to process '{filename}': {error}")
+                continue
+            if data_format in CHUNKED_FORMATS:
+                chunks = list(chunk_documents(chunks, data_format))
+            print(f"  - Extracted {len(chunks)} text chunks from '{filename}'.")
+            parsed_files.append((file_path, [point_id_for_chunk(chunk) for chunk in chunks]))
+            yield from chunks
+
+    if changed:
+        chunks = enrich_chunks(tqdm(changed_chunks(), desc="generating keywords & summaries"))
+        upload_to_qdrant_stream(chunks, collection_name)
+
+    for file_path, point_ids in parsed_files:
+        file_key = manifest.file_key(file_path)
+        stale_ids = set(manifest.point_ids(collection_name, file_key)) - set(point_ids)
+        delete_points(client, collection_name, stale_ids)
+        manifest.record(collection_name, file_key, file_hashes[file_path], point_ids)
+
+    manifest.save()
+    if changed or deleted:
+        # collection contents moved, so the router's centroids are stale
+        invalidate_collection_router()
+    return {"changed": len(changed), "unchanged": len(unchanged), "deleted": len(deleted)}
 
 if __name__ == "__main__":
     data_sources = ["camera_data", "displays_data", "headphone_data", "laptop_data", "phone_data"]
@@ -243,28 +303,23 @@ if __name__ == "__main__":
 
     data_sources = ["headphone_data/articles", "headphone_data/manuals", "laptop_data/HTML", "laptop_data/PDF"]
 
+    manifest = IngestManifest()
+    collections_changed = False
+
     for data_source in data_sources:
         for data_format in data_formats:
             dir_path = os.getcwd() + f"/data/{data_source}/"
             print(f"\nProcessing data from '{dir_path}' in format '{data_format}'...")
-            if data_format == "PDF":
-                data = process_pdf_from_directory(dir_path)
-            elif data_format == "HTML":
-                data = process_html_from_directory(dir_path)
-            elif data_format == "TXT":
-                data = process_txt_from_directory(dir_path)
-            elif data_format == "JSON":
-                data = process_json_from_directory(dir_path)
-
-            print(f"Generated summaries for data from '{data_source}' in format '{data_format}':")
-            for item in tqdm(data, desc="generating keywords & summaries"):
-                metadata = gen_metadata(item['text'][:2000])
-                if "summary" in metadata:
-                    item['summary'] = metadata['summary']
-                if "keywords" in metadata:
-                    item["keywords"] = metadata["keywords"]
 
+            # parse -> summarize -> embed -> upload, streamed in batches, only for files that changed since the last run
             collection_name = data_source.split("/")
-            upload_to_qdrant(data, collection_name[0])
+            counts = ingest_directory(dir_path, data_format, collection_name[0], manifest)
+            collections_changed = collections_changed or counts["changed"] or counts["deleted"]
+            print(f"metadata generation stats: {get_metadata_client().stats()}")
+
+        print(f"\nAdding data to '{data_source}' collection completed.")
 
-        print(f"\nAdding data to '{data_source}' collection completed.")
\ No newline at end of file
+    if collections_changed:
+        # the query path only loads saved centroids, so they are rebuilt here once every collection is loaded
+        router = build_collection_router(get_qdrant_client())
+        print(f"collection router centroids rebuilt for {router.collections if router is not None else []}")
@@ -0,0 +1,258 @@
+# on disk copy of every uploaded embedding, so collections can be rebuilt without re-running the bi encoder.
+# layout per collection (under ARTIFACT_DIR/<collection>/):
+#   meta.json                   vector size and distance
+#   shard_000000.vectors.npy    float32 (rows, size) matrix, memory mapped on read
+#   shard_000000.ids.npy        point id per row
+#   shard_000000.payload.json   payloads stored by column: {"columns": {field: [value per row]}}
+#   tombstones.json             {point id: shard index at deletion}, rows in older shards are deleted
+import json
+import os
+import sys
+import time
+import numpy as np
+from qdrant_client import models
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from phase_2_pipeline.lib.quantization import collection_config
+from phase_2_pipeline.lib.constants import ARTIFACT_DIR, HYBRID_SEARCH, SPARSE_VECTOR_NAME, QUANTIZATION
+
+class ArtifactStore:
+    '''
+        description: append only, sharded store of (point id, vector, payload) rows for one collection.
+            - every upload batch is written as a new shard
+            - re-uploading an id in a later shard supersedes the older row
+            - deletes are recorded as tombstones so rebuilds do not resurrect removed points
+    '''
+    def __init__(self, collection_name: str, root: str = ARTIFACT_DIR):
+        self.collection_name = collection_name
+        self.dir_path = os.path.join(root, collection_name)
+        self._payload_cache = {}
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.dir_path, name)
+
+    def shards(self) -> list:
+        if not os.path.isdir(self.dir_path):
+            return []
+        return sorted(
+            int(filename[len("shard_"):-len(".vectors.npy")])
+            for filename in os.listdir(self.dir_path)
+            if filename.startswith("shard_") and filename.endswith(".vectors.npy")
+        )
+
+    def meta(self) -> dict:
+        with open(self._path("meta.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def write_shard(self, ids: list, vectors, payloads: list, distance: str = "Cosine"):
+        '''
+            description: writes one batch of points as a new shard.
+
+            input: point ids, vectors (array like, one row per id), payload dicts (one per id)
+        '''
+        os.makedirs(self.dir_path, exist_ok=True)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not os.path.exists(self._path("meta.json")):
+            with open(self._path("meta.json"), "w", encoding="utf-8") as f:
+                json.dump({"size": int(vectors.shape[1]), "distance": distance}, f)
+
+        shards = self.shards()
+        shard = shards[-1] + 1 if shards else 0
+        prefix = self._path(f"shard_{shard:06d}")
+
+        fields = []
+        for payload in payloads:
+            for field in payload:
+                if field not in fields:
+                    fields.append(field)
+        columns = {field: [payload.get(field) for payload in payloads] for field in fields}
+
+        # payload and ids first, the vectors file is what marks a shard as complete
+        with open(prefix + ".payload.json", "w", encoding="utf-8") as f:
+            json.dump({"columns": columns}, f, ensure_ascii=False)
+        np.save(prefix + ".ids.npy", np.asarray([str(point_id) for point_id in ids]))
+        np.save(prefix + ".vectors.npy", vectors)
+        return shard
+
+    def delete(self, ids):
+        ids = list(ids)
+        if not ids or not os.path.isdir(self.dir_path):
+            return
+        tombstones = self._tombstones()
+        shards = self.shards()
+        next_shard = shards[-1] + 1 if shards else 0
+        for point_id in ids:
+            tombstones[str(point_id)] = next_shard
+        with open(self._path("tombstones.json"), "w", encoding="utf-8") as f:
+            json.dump(tombstones, f)
+
+    def _tombstones(self) -> dict:
+        if not os.path.exists(self._path("tombstones.json")):
+            return {}
+        with open(self._path("tombstones.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def load_vectors(self, shard: int):
+        # memory mapped, rows are only read from disk when touched
+        return np.load(self._path(f"shard_{shard:06d}.vectors.npy"), mmap_mode="r")
+
+    def load_ids(self, shard: int):
+        return np.load(self._path(f"shard_{shard:06d}.ids.npy"), mmap_mode="r")
+
+    def load_payload_columns(self, shard: int) -> dict:
+        if shard not in self._payload_cache:
+            with open(self._path(f"shard_{shard:06d}.payload.json"), "r", encoding="utf-8") as f:
+                self._payload_cache[shard] = json.load(f)["columns"]
+        return self._payload_cache[shard]
+
+    def payload(self, shard: int, row: int) -> dict:
+        columns = self.load_payload_columns(shard)
+        return {field: values[row] for field, values in columns.items() if values[row] is not None}
+
+    def live_rows(self) -> dict:
+        '''
+            description: the current row for every point that has not been deleted.
+
+            output: {shard: sorted list of live row indices in that shard}
+        '''
+        tombstones = self._tombstones()
+        latest = {}
+        for shard in self.shards():
+            for row, point_id in enumerate(self.load_ids(shard)):
+                point_id = str(point_id)
+                if tombstones.get(point_id, -1) <= shard:
+                    latest[point_id] = (shard, row)
+                else:
+                    latest.pop(point_id, None)
+
+        rows = {}
+        for shard, row in latest.values():
+            rows.setdefault(shard, []).append(row)
+        return {shard: sorted(rows[shard]) for shard in sorted(rows)}
+
+    def iter_points(self):
+        '''
+            description: yields (shard, rows, ids, vectors, payloads) for the live rows of each shard.
+                vectors is a view into the memory mapped shard when every row is live.
+        '''
+        for shard, rows in self.live_rows().items():
+            vectors = self.load_vectors(shard)
+            ids = self.load_ids(shard)
+            if len(rows) != len(ids):
+                vectors = vectors[rows]
+                ids = ids[rows]
+            yield shard, rows, [str(point_id) for point_id in ids], vectors, [self.payload(shard, row) for row in rows]
+
+def _aliased_collection(client, name: str):
+    # physical collection behind an alias, None when name is not an alias
+    for alias in client.get_aliases().aliases:
+        if alias.alias_name == name:
+            return alias.collection_name
+    return None
+
+def drop_collection(client, name: str):
+    # deletes a collection, or an alias created by rebuild_collection together with the collection behind it
+    physical = _aliased_collection(client, name)
+    if physical is None:
+        if client.collection_exists(name):
+            client.delete_collection(name)
+        return
+    client.update_collection_aliases(change_aliases_operations=[
+        models.DeleteAliasOperation(delete_alias=models.DeleteAlias(alias_name=name)),
+    ])
+    client.delete_collection(physical)
+
+def rebuild_collection(client, collection_name: str, target_collection: str = None, batch_size: int = 256,
+                       quantization: str = QUANTIZATION, force: bool = False) -> int:
+    '''
+        description: recreates a collection straight from its artifacts, no dense embeddings are recomputed.
+            with HYBRID_SEARCH, bm25 sparse vectors are rebuilt from the payload text (tokenizing only, no model inference).
+            - points are uploaded to a new collection "<target>_<timestamp>", the live collections are untouched until it is complete
+            - when the source collection exists in qdrant, the new collection must hold as many points as it does,
+              otherwise the new collection is dropped and nothing is replaced (points uploaded before artifacts were
+              written, or with WRITE_ARTIFACTS off, only exist in qdrant)
+            - the target name then becomes an alias of the new collection: an existing alias is switched over in one
+              step and its old collection deleted, an existing plain collection is deleted first
+            - replacing the source collection itself needs force=True
+
+        input: qdrant client, collection whose artifacts to load, target collection name (defaults to the same name),
+            quantization of the new collection ("none", "scalar" or "binary"), force to allow target == source
+        output: number of points uploaded
+    '''
+    store = ArtifactStore(collection_name)
+    target_collection = target_collection or collection_name
+    if target_collection == collection_name and not force:
+        raise ValueError(f"rebuilding '{collection_name}' would replace it, pass another target collection or force=True")
+    if not os.path.exists(store._path("meta.json")):
+        raise FileNotFoundError(f"no artifacts for '{collection_name}' in {store.dir_path}, was it loaded with WRITE_ARTIFACTS on?")
+    meta = store.meta()
+
+    sparse_config = None
+    if HYBRID_SEARCH:
+        from phase_2_pipeline.lib.sparse_vectors import embed_sparse_documents, sparse_vectors_config
+        sparse_config = sparse_vectors_config()
+
+    build_collection = f"{target_collection}_{int(time.time() * 1000)}"
+    client.create_collection(
+        collection_name=build_collection,
+        **collection_config(meta["size"], models.Distance(meta["distance"]), quantization),
+        sparse_vectors_config=sparse_config,
+    )
+
+    uploaded = 0
+    try:
+        for shard, rows, ids, vectors, payloads in store.iter_points():
+            if sparse_config is not None:
+                sparse_vectors = embed_sparse_documents([payload.get("text", "") for payload in payloads], batch_size=batch_size)
+                vectors = [
+                    {"": vector.tolist(), SPARSE_VECTOR_NAME: sparse_vector}
+                    for vector, sparse_vector in zip(vectors, sparse_vectors)
+                ]
+            client.upload_collection(
+                collection_name=build_collection,
+                vectors=vectors,
+                payload=payloads,
+                ids=ids,
+                batch_size=batch_size,
+            )
+            uploaded += len(ids)
+            print(f"  - Uploaded shard {shard} ({uploaded} points so far).")
+
+        if client.collection_exists(collection_name):
+            source_count = client.count(collection_name, exact=True).count
+            if uploaded != source_count:
+                raise ValueError(f"artifacts of '{collection_name}' hold {uploaded} points but the collection has "
+                                 f"{source_count}, '{target_collection}' was not replaced")
+        else:
+            print(f"  - '{collection_name}' is not in qdrant, point count not checked.")
+    except BaseException:
+        client.delete_collection(build_collection)
+        raise
+
+    old_collection = _aliased_collection(client, target_collection)
+    operations = [models.CreateAliasOperation(create_alias=models.CreateAlias(
+        collection_name=build_collection, alias_name=target_collection,
+    ))]
+    if old_collection is not None:
+        operations.insert(0, models.DeleteAliasOperation(delete_alias=models.DeleteAlias(alias_name=target_collection)))
+    elif client.collection_exists(target_collection):
+        # a plain collection cannot be swapped atomically, queries fail until the alias exists
+        client.delete_collection(target_collection)
+    client.update_collection_aliases(change_aliases_operations=operations)
+    if old_collection is not None:
+        client.delete_collection(old_collection)
+
+    return uploaded
+
+if __name__ == "__main__":
+    # python -m phase_2_pipeline.lib.artifact_store <collection> <target collection> [--force]
+    # target may be the collection itself with --force
+    from phase_2_pipeline.lib.qdrant_client import get_qdrant_client
+
+    args = [arg for arg in sys.argv[1:] if arg != "--force"]
+    if len(args) < 2:
+        sys.exit("usage: python -m phase_2_pipeline.lib.artifact_store <collection> <target collection> [--force]")
+    source, target = args[0], args[1]
+    count = rebuild_collection(get_qdrant_client(), source, target, force="--force" in sys.argv)
+    print(f"rebuilt '{target}' from '{source}' artifacts with {count} points")
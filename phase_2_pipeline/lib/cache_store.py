@@ -0,0 +1,233 @@
+# building blocks for the pipeline caches: a bounded in-memory LRU, a persistent sqlite key/value store, and the two combined
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+class LRUCache:
+    '''
+        description: thread safe, bounded in-memory LRU map. least recently used entries are evicted once
+            max_entries is reached.
+    '''
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._items:
+                return default
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
+
+class SqliteStore:
+    '''
+        description: persistent key/value store (str key -> bytes value) backed by a single sqlite table.
+            one connection is shared by all threads and guarded by a lock, sqlite handles locking between processes.
+            - ttl_seconds: entries older than this are treated as missing (None keeps them forever)
+            - max_entries: oldest entries are evicted once the table grows past this (None is unbounded)
+    '''
+    def __init__(self, db_path: str, table: str, ttl_seconds: float = None, max_entries: int = None):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.db_path = db_path
+        self.table = table
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value BLOB NOT NULL, created_at REAL NOT NULL DEFAULT 0)"
+            )
+            # tables created before entries had a timestamp, their rows count as the oldest
+            columns = [row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")]
+            if "created_at" not in columns:
+                self._conn.execute(f"ALTER TABLE {table} ADD COLUMN created_at REAL NOT NULL DEFAULT 0")
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_created_at ON {table} (created_at)")
+            self._conn.commit()
+
+    def _min_created_at(self) -> float:
+        return 0 if self.ttl_seconds is None else time.time() - self.ttl_seconds
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value FROM {self.table} WHERE key = ? AND created_at >= ?", (key, self._min_created_at())
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def get_many(self, keys: list) -> dict:
+        found = {}
+        min_created_at = self._min_created_at()
+        # stay under sqlite's limit on the number of bound parameters
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT key, value FROM {self.table} WHERE key IN ({placeholders}) AND created_at >= ?",
+                    batch + [min_created_at],
+                ).fetchall()
+            found.update(rows)
+        return found
+
+    def put(self, key: str, value: bytes):
+        self.put_many({key: value})
+
+    def put_many(self, items: dict):
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, created_at) VALUES (?, ?, ?)",
+                [(key, value, now) for key, value in items.items()],
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        # caller holds the lock
+        if self.ttl_seconds is not None:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE created_at < ?", (self._min_created_at(),))
+        if self.max_entries is not None:
+            count = self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    f"DELETE FROM {self.table} WHERE key IN (SELECT key FROM {self.table} ORDER BY created_at LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class TieredCache:
+    '''
+        description: in-process LRU fast path in front of an optional SqliteStore, with hit/miss counters for both tiers.
+            - values are kept as is in memory and converted with encode/decode (default: bytes as is) on disk
+            - entries share the ttl of the disk store
+            - get_or_compute() fills a batch of keys from memory, then disk, and computes only what is left
+            - db_path None keeps the cache in memory only
+
+        input: sqlite path (or None), table, memory entries, ttl/max entries of the disk store, encode (value -> bytes),
+            decode (bytes -> value)
+    '''
+    def __init__(self, db_path: str, table: str, max_memory_entries: int, ttl_seconds: float = None, max_entries: int = None,
+                 encode=None, decode=None):
+        self.memory = LRUCache(max_memory_entries)
+        self.disk = None if db_path is None else SqliteStore(db_path, table, ttl_seconds=ttl_seconds, max_entries=max_entries)
+        self.ttl_seconds = ttl_seconds
+        self.encode = encode or (lambda value: value)
+        self.decode = decode or (lambda value: value)
+        self._stats_lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _count(self, memory_hits=0, disk_hits=0, misses=0):
+        with self._stats_lock:
+            self.memory_hits += memory_hits
+            self.disk_hits += disk_hits
+            self.misses += misses
+
+    def _memory_get(self, key: str):
+        entry = self.memory.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        return value if expires_at is None or expires_at > time.time() else None
+
+    def _memory_put(self, key: str, value):
+        # expiry in memory is counted from when it was stored or read back, at most one extra ttl for a disk hit
+        self.memory.put(key, (self._expires_at(), value))
+
+    def get(self, key: str):
+        return self.get_many([key])[0]
+
+    def get_many(self, keys: list) -> list:
+        '''
+            output: the cached value (or None) for every key, in order
+        '''
+        values = [self._memory_get(key) for key in keys]
+        missing = [i for i, value in enumerate(values) if value is None]
+        memory_hits = len(keys) - len(missing)
+
+        disk_hits = 0
+        if missing and self.disk is not None:
+            stored = self.disk.get_many(list({keys[i]: None for i in missing}))
+            decoded = {key: self.decode(value) for key, value in stored.items()}
+            for key, value in decoded.items():
+                self._memory_put(key, value)
+            for i in missing:
+                if keys[i] in decoded:
+                    values[i] = decoded[keys[i]]
+                    disk_hits += 1
+
+        self._count(memory_hits=memory_hits, disk_hits=disk_hits, misses=len(missing) - disk_hits)
+        return values
+
+    def get_or_compute(self, keys: list, compute) -> list:
+        '''
+            description: cached values for keys, the rest computed in one call and stored in both tiers.
+
+            input: keys (duplicates allowed), compute (function taking the distinct missing keys in first seen order
+                and returning their values in the same order, only called when something is missing)
+            output: one value per key, in order
+        '''
+        values = self.get_many(keys)
+        missing = [i for i, value in enumerate(values) if value is None]
+        if missing:
+            unique = list({keys[i]: None for i in missing})
+            new_values = dict(zip(unique, compute(unique)))
+            self.put_many(new_values)
+            for i in missing:
+                values[i] = new_values[keys[i]]
+        return values
+
+    def put(self, key: str, value):
+        self.put_many({key: value})
+
+    def put_many(self, items: dict):
+        for key, value in items.items():
+            self._memory_put(key, value)
+        if self.disk is not None:
+            self.disk.put_many({key: self.encode(value) for key, value in items.items()})
+
+    def _expires_at(self):
+        return None if self.ttl_seconds is None else time.time() + self.ttl_seconds
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+                "memory_entries": len(self.memory),
+            }
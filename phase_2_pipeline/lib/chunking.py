@@ -0,0 +1,137 @@
+# token aware chunking: splits parsed documents into windows sized for the bi encoder, preferring to cut on
+# structure (headings, paragraphs, top level json keys) and recording where each chunk sits in the source text
+import os
+import re
+import sys
+import threading
+from tokenizers import Tokenizer
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from phase_2_pipeline.lib.embedding_models import bi_encoder_model
+from phase_2_pipeline.lib.constants import CHUNK_MAX_TOKENS, CHUNK_MIN_TOKENS, CHUNK_OVERLAP_TOKENS
+
+# a blank line (paragraph), a markdown style heading, or a top level key of json dumped with indent=2
+_BOUNDARY_PATTERNS = {
+    "HTML": re.compile(r"\n\s*\n"),
+    "TXT": re.compile(r"\n\s*\n|\n(?=#{1,6} )"),
+    "JSON": re.compile(r"\n(?=  \"[^\n]*\": )"),
+}
+
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+
+def _get_tokenizer():
+    '''
+        description: copy of the bi encoder's tokenizer without truncation or padding, so whole documents can be
+            tokenized and token offsets mapped back to characters. None when the model does not expose one.
+    '''
+    global _tokenizer
+    if _tokenizer is None:
+        with _tokenizer_lock:
+            if _tokenizer is None:
+                onnx = getattr(bi_encoder_model(), "model", None)
+                if onnx is None or not hasattr(onnx, "load_onnx_model"):
+                    _tokenizer = False
+                else:
+                    if getattr(onnx, "tokenizer", None) is None:
+                        onnx.load_onnx_model()
+                    tokenizer = Tokenizer.from_str(onnx.tokenizer.to_str())
+                    tokenizer.no_truncation()
+                    tokenizer.no_padding()
+                    _tokenizer = tokenizer
+    return _tokenizer or None
+
+def token_offsets(text: str) -> list:
+    '''
+        output: (start_char, end_char) of every token in text, with the bi encoder's tokenizer
+            (or one token per word/punctuation mark when it is not available)
+    '''
+    tokenizer = _get_tokenizer()
+    if tokenizer is None:
+        return [match.span() for match in re.finditer(r"\w+|[^\w\s]", text)]
+    return [offset for offset in tokenizer.encode(text, add_special_tokens=False).offsets if offset[1] > offset[0]]
+
+def _is_heading(block: str) -> bool:
+    # a single short line, i.e. a markdown heading or an html <h*> element, stays with the block after it
+    block = block.strip()
+    return "\n" not in block and len(block) <= 80
+
+def _boundary_tokens(text: str, offsets: list, data_format: str) -> set:
+    # token indices a chunk may start at because a structural break comes right before them
+    pattern = _BOUNDARY_PATTERNS.get(data_format)
+    if pattern is None:
+        return set()
+    boundaries = set()
+    token = 0
+    block_start = 0
+    for match in pattern.finditer(text):
+        block = text[block_start:match.start()]
+        block_start = match.end()
+        if _is_heading(block):
+            continue
+        while token < len(offsets) and offsets[token][0] < match.end():
+            token += 1
+        boundaries.add(token)
+    return boundaries
+
+def chunk_text(text: str, data_format: str, max_tokens: int = CHUNK_MAX_TOKENS,
+               min_tokens: int = CHUNK_MIN_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> list:
+    '''
+        description: sliding windows of at most max_tokens tokens.
+            - a window ends at the last structural boundary past min_tokens, the next window starts right there
+            - a window with no such boundary is cut at max_tokens, and the next one repeats its last overlap_tokens
+
+        output: list of (start_char, end_char, token_count), covering the text in order
+    '''
+    offsets = token_offsets(text)
+    if not offsets:
+        return []
+    boundaries = _boundary_tokens(text, offsets, data_format)
+    overlap_tokens = min(overlap_tokens, max_tokens - 1)
+
+    windows = []
+    start = 0
+    while start < len(offsets):
+        end = min(start + max_tokens, len(offsets))
+        next_start = end
+        if end < len(offsets):
+            snapped = [token for token in boundaries if start + max(min_tokens, 1) <= token <= end]
+            if snapped:
+                end = next_start = max(snapped)
+            else:
+                next_start = end - overlap_tokens
+        windows.append((offsets[start][0], offsets[end - 1][1], end - start))
+        start = next_start
+    return windows
+
+def chunk_document(document: dict, data_format: str, **kwargs) -> list:
+    '''
+        description: splits one parsed document (a parser output dict with "text") into token sized chunks.
+            every chunk keeps the document's other fields and adds chunk_index, start_char, end_char
+            (character offsets into the parsed text) and token_count.
+
+        output: list of chunk dicts, a single chunk when the document fits in one window
+    '''
+    text = document.get("text") or ""
+    chunks = []
+    for chunk_index, (start_char, end_char, token_count) in enumerate(chunk_text(text, data_format, **kwargs)):
+        chunk = dict(document)
+        chunk.update({
+            "text": text[start_char:end_char],
+            "chunk_index": chunk_index,
+            "start_char": start_char,
+            "end_char": end_char,
+            "token_count": token_count,
+        })
+        chunks.append(chunk)
+    return chunks
+
+def chunk_documents(documents, data_format: str, **kwargs):
+    '''
+        description: chunk_document over a stream of parsed documents.
+
+        output: generator of chunk dicts, in document order
+    '''
+    for document in documents:
+        yield from chunk_document(document, data_format, **kwargs)
@@ -0,0 +1,202 @@
+# local collection router: picks the collection for a query from its embedding, so query preprocess only
+# needs the LLM for ambiguous queries. each collection is represented by the centroid of its stored chunk embeddings.
+import json
+import os
+import sys
+import threading
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from phase_2_pipeline.lib.artifact_store import ArtifactStore
+from phase_2_pipeline.lib.embedding_models import bi_encoder_model
+from phase_2_pipeline.lib.embedding_cache import get_query_embedding_cache
+from phase_2_pipeline.lib.constants import (
+    CACHE_DIR,
+    COLLECTIONS,
+    EMBEDDING_MODEL_NAME,
+    ROUTER_MIN_MARGIN,
+    ROUTER_SAMPLE_SIZE,
+)
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+def _artifact_centroid(collection_name: str):
+    # sum of normalized rows, streamed shard by shard so the vectors are never all in memory
+    total, count = None, 0
+    for _, _, ids, vectors, _ in ArtifactStore(collection_name).iter_points():
+        shard_sum = _normalize(np.asarray(vectors, dtype=np.float32)).sum(axis=0)
+        total = shard_sum if total is None else total + shard_sum
+        count += len(ids)
+    return None if count == 0 else total / count
+
+def _qdrant_centroid(client, collection_name: str, sample_size: int):
+    # collections without artifacts: average a sample of stored vectors
+    points, _ = client.scroll(collection_name=collection_name, limit=sample_size, with_payload=False, with_vectors=True)
+    vectors = [point.vector.get("", None) if isinstance(point.vector, dict) else point.vector for point in points]
+    vectors = [vector for vector in vectors if vector is not None]
+    if not vectors:
+        return None
+    return _normalize(np.asarray(vectors, dtype=np.float32)).mean(axis=0)
+
+class CollectionRouter:
+    '''
+        description: nearest centroid classifier over the collections.
+            - route() compares a query embedding against every centroid (one small matrix product)
+            - a query is only routed when the best collection beats the runner up by min_margin in cosine similarity,
+              otherwise None is returned and the caller falls back to the LLM
+
+        input: {collection: centroid vector}, min cosine margin between the best and second best collection
+    '''
+    def __init__(self, centroids: dict, min_margin: float = ROUTER_MIN_MARGIN):
+        self.collections = list(centroids)
+        self.centroids = _normalize(np.asarray([centroids[name] for name in self.collections], dtype=np.float32))
+        self.min_margin = min_margin
+        self._stats_lock = threading.Lock()
+        self.routed = 0
+        self.fallbacks = 0
+
+    @classmethod
+    def build(cls, collections: list = COLLECTIONS, client=None, sample_size: int = ROUTER_SAMPLE_SIZE, **kwargs):
+        '''
+            description: computes centroids from the artifact store, or from a sample of qdrant vectors for
+                collections without artifacts. collections with no vectors are left out.
+        '''
+        centroids = {}
+        for collection_name in collections:
+            centroid = _artifact_centroid(collection_name)
+            if centroid is None and client is not None and client.collection_exists(collection_name):
+                centroid = _qdrant_centroid(client, collection_name, sample_size)
+            if centroid is not None:
+                centroids[collection_name] = centroid
+        return cls(centroids, **kwargs)
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        np.save(path + ".npy", self.centroids)
+        with open(path + ".json", "w", encoding="utf-8") as f:
+            json.dump({"collections": self.collections, "embedding_model": EMBEDDING_MODEL_NAME}, f)
+
+    @classmethod
+    def load(cls, path: str, **kwargs):
+        # returns None when nothing was saved, or when the centroids come from another embedding model
+        if not os.path.exists(path + ".json") or not os.path.exists(path + ".npy"):
+            return None
+        with open(path + ".json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("embedding_model") != EMBEDDING_MODEL_NAME:
+            return None
+        centroids = np.load(path + ".npy")
+        return cls(dict(zip(meta["collections"], centroids)), **kwargs)
+
+    def route(self, query_vector):
+        '''
+            output: collection name, or None when the query is ambiguous (or there are fewer than 2 collections)
+        '''
+        collection = None
+        if len(self.collections) >= 2:
+            similarities = self.centroids @ _normalize(np.asarray(query_vector, dtype=np.float32))
+            second, best = np.argsort(similarities)[-2:]
+            if similarities[best] - similarities[second] >= self.min_margin:
+                collection = self.collections[best]
+
+        with self._stats_lock:
+            if collection is None:
+                self.fallbacks += 1
+            else:
+                self.routed += 1
+        return collection
+
+    def route_query(self, query: str):
+        # the query embedding goes through the embedding cache, so the bi encoder step reuses it for the same text
+        query_vector = get_query_embedding_cache().embed(EMBEDDING_MODEL_NAME, bi_encoder_model, [query])[0]
+        return self.route(query_vector)
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            total = self.routed + self.fallbacks
+            return {
+                "routed": self.routed,
+                "fallbacks": self.fallbacks,
+                "routed_rate": round(self.routed / total, 3) if total else 0.0,
+            }
+
+ROUTER_PATH = os.path.join(CACHE_DIR, "collection_centroids")
+
+_router = None
+_router_loaded = False
+_router_lock = threading.Lock()
+
+def get_collection_router():
+    '''
+        description: router with the centroids saved in CACHE_DIR by build_collection_router. nothing is computed
+            here (it runs on the query path), missing centroids disable the router until they are built.
+
+        output: CollectionRouter, or None when no centroids were saved
+    '''
+    global _router, _router_loaded
+    if not _router_loaded:
+        with _router_lock:
+            if not _router_loaded:
+                _router = CollectionRouter.load(ROUTER_PATH)
+                if _router is None:
+                    print(f"collection router disabled, no centroids in {ROUTER_PATH} (run data load or python -m phase_2_pipeline.lib.collection_router)")
+                _router_loaded = True
+    return _router
+
+def build_collection_router(client=None, collections: list = COLLECTIONS):
+    '''
+        description: computes the centroids (see CollectionRouter.build) and saves them for get_collection_router.
+            called at the end of data load, reads every artifact shard (or up to ROUTER_SAMPLE_SIZE qdrant vectors) per collection.
+
+        output: CollectionRouter, or None when no collection has vectors
+    '''
+    global _router, _router_loaded
+    router = CollectionRouter.build(collections, client=client)
+    with _router_lock:
+        if router.collections:
+            router.save(ROUTER_PATH)
+            _router = router
+        else:
+            _remove_saved_centroids()
+            _router = None
+        _router_loaded = True
+    return _router
+
+def _remove_saved_centroids():
+    for path in (ROUTER_PATH + ".npy", ROUTER_PATH + ".json"):
+        if os.path.exists(path):
+            os.remove(path)
+
+def invalidate_collection_router():
+    # called when data load changes a collection, the stale centroids are dropped until build_collection_router runs
+    global _router, _router_loaded
+    with _router_lock:
+        _remove_saved_centroids()
+        _router = None
+        _router_loaded = False
+
+if __name__ == "__main__":
+    # rebuild the centroids and check routing on the eval prompts (category "x" belongs to collection "x_data"):
+    # python -m phase_2_pipeline.lib.collection_router [min margin]
+    import time
+    from phase_2_pipeline.lib.qdrant_client import get_qdrant_client
+
+    min_margin = float(sys.argv[1]) if len(sys.argv) > 1 else ROUTER_MIN_MARGIN
+    router = CollectionRouter.build(client=get_qdrant_client(), min_margin=min_margin)
+    router.save(ROUTER_PATH)
+    print(f"centroids for {router.collections} saved to {ROUTER_PATH}")
+
+    with open(os.path.join(os.path.dirname(__file__), "..", "..", "eval", "prompts2.json"), "r", encoding="utf-8") as f:
+        cases = [(prompt, f"{category['category']}_data") for category in json.load(f) for prompt in category["prompts"]]
+
+    vectors = get_query_embedding_cache().embed(EMBEDDING_MODEL_NAME, bi_encoder_model, [prompt for prompt, _ in cases])
+    start = time.perf_counter()
+    routes = [router.route(vector) for vector in vectors]
+    route_us = (time.perf_counter() - start) / len(cases) * 1e6
+
+    routed = [(route, gold) for route, (_, gold) in zip(routes, cases) if route is not None]
+    correct = sum(route == gold for route, gold in routed)
+    print(f"routed {len(routed)}/{len(cases)} prompts locally ({route_us:.1f} us/route), {correct}/{len(routed)} correct")
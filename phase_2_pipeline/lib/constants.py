@@ -5,9 +5,84 @@ load_dotenv()
 
 EMBEDDING_MODEL_NAME = "BAAI/bge-small-en-v1.5" # bi encoder
 RERANKER_MODEL_NAME = "BAAI/bge-reranker-base" # cross encoder
+SPARSE_MODEL_NAME = "Qdrant/bm25" # sparse lexical vectors for hybrid search
 QDRANT_URL = os.getenv("QDRANT_URL")
 QDRANT_KEY = os.getenv("QDRANT_KEY")
 RESULTS_COUNT = 50 # represents the number of initial search results to retrieve from Qdrant (used for bi encoder)
 FINAL_COUNT = 10
+RERANK_CASCADE = False # approximation: rerank in tranches and stop once the top FINAL_COUNT is stable, compare recall against full reranking before turning on
+RERANK_FIRST_TRANCHE = 20 # candidates scored in the first cascade round
+RERANK_TRANCHE_SIZE = 10 # candidates added in every later round
+RERANK_FIELD = "source_file" # payload field the cross encoder scores against the query: "text", "summary", "keywords" or "source_file"
+RERANK_MAX_TOKENS = 512 # token budget per (query, candidate) pair, the candidate text is truncated first
+RERANK_BATCH_SIZE = 32 # pairs per cross encoder call, pairs are grouped by token length so each batch pads little
+RERANK_SKIP_MARGIN = None # approximation: keep the bi encoder order when its score drops by this much (i.e. 0.1) right after the top FINAL_COUNT, None never skips
 LLM_CHUNKS = 5
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
\ No newline at end of file
+LAZY_PAYLOAD = True # candidates are fetched with CANDIDATE_PAYLOAD_FIELDS (+ RERANK_FIELD) only, text is retrieved for the final LLM_CHUNKS
+CANDIDATE_PAYLOAD_FIELDS = ["source_file", "page", "title"]
+LLM_CONCURRENCY = 8 # max gemini requests in flight when running queries in batch
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+# usd per 1M tokens, used by lib/metrics.py to estimate the cost of each llm stage
+LLM_PRICING = {
+    "gemini-2.0-flash-lite": {"input": 0.075, "output": 0.30},
+    "gemini-2.5-flash-lite": {"input": 0.10, "output": 0.40},
+}
+# llm token/latency events (lib/metrics.py) are appended here by a background thread, replaces eval/out/token_cost.txt
+METRICS_PATH = os.getenv("RAG_METRICS_PATH", os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "eval", "out", "llm_metrics.jsonl")))
+METRICS_FLUSH_INTERVAL = 5.0 # seconds between background writes of queued metric events
+METRICS_FLUSH_BATCH = 256 # queued events that trigger a write before the interval is up
+COLLECTIONS = ["camera_data", "displays_data", "headphone_data", "laptop_data", "phone_data"]
+
+# local collection router (lib/collection_router.py), queries it is confident about skip the query preprocess LLM call
+ROUTER_ENABLED = False # changes the query text and collection choice for routed queries, compare eval results before turning on
+ROUTER_MIN_MARGIN = 0.05 # cosine similarity the best collection centroid must beat the second best by, otherwise the LLM picks
+ROUTER_SAMPLE_SIZE = 2000 # vectors read from qdrant per collection when a collection has no artifacts
+
+# local caches (query embeddings, etc.) live here, defaults to .cache/ at the repo root
+CACHE_DIR = os.getenv("RAG_CACHE_DIR", os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", ".cache")))
+QUERY_EMBEDDING_CACHE_SIZE = 10000 # max query embeddings kept in memory, the on disk cache is unbounded
+PREPROCESS_CACHE_VERSION = 1 # bump to invalidate cached query rewrites, i.e. when ProcessedQuery changes
+PREPROCESS_CACHE_TTL = 7 * 24 * 60 * 60 # seconds a cached query rewrite stays valid
+PREPROCESS_CACHE_MAX_ENTRIES = 100000 # max cached query rewrites on disk, oldest are evicted first
+PREPROCESS_CACHE_MEMORY_SIZE = 1000 # max cached query rewrites kept in memory
+RERANK_CACHE_SIZE = 200000 # max cross encoder scores kept in memory (one per query/candidate pair)
+RERANK_CACHE_PERSIST = True # also keep cross encoder scores in sqlite under CACHE_DIR
+TRACING = os.getenv("RAG_TRACING", "0") == "1" # per stage spans of every query (lib/tracing.py), off costs one flag check per stage
+TRACE_PATH = os.getenv("RAG_TRACE_PATH", os.path.join(CACHE_DIR, "traces.jsonl")) # finished spans are appended here, one json object per line
+TRACE_FLUSH_INTERVAL = 1.0 # seconds between background writes of finished spans
+TRACE_FLUSH_BATCH = 512 # queued spans that trigger a write before the interval is up
+CHUNK_MAX_TOKENS = 256 # bi encoder tokens per chunk for HTML/TXT/JSON sources (bge-small truncates at 512)
+CHUNK_MIN_TOKENS = 64 # a chunk only ends early on a heading/paragraph/json key boundary past this many tokens
+CHUNK_OVERLAP_TOKENS = 32 # tokens repeated between consecutive chunks when a chunk is cut mid paragraph
+PARSE_WORKERS = int(os.getenv("RAG_PARSE_WORKERS", os.cpu_count() or 1)) # processes used to parse documents during data load, 1 parses in process
+
+# local LLM (LM Studio) used to generate chunk summaries/keywords during data load
+METADATA_LLM_URL = os.getenv("METADATA_LLM_URL", "http://localhost:1234/v1/chat/completions")
+METADATA_LLM_MODEL = "llama-3.2-3b-instruct"
+METADATA_WORKERS = 4 # concurrent requests to the metadata LLM
+METADATA_TIMEOUT = 120 # seconds per request
+METADATA_MAX_RETRIES = 3 # retries per chunk on http errors or malformed json
+EXTRACTION_CACHE = True # reuse extracted document text for files whose content and parser did not change
+EXTRACTION_CACHE_DIR = os.path.join(CACHE_DIR, "extracted")
+INGEST_MANIFEST_PATH = os.path.join(CACHE_DIR, "ingest_manifest.json") # files already uploaded by data load, used to skip unchanged files
+
+# every uploaded embedding is also written here so collections can be rebuilt without re-embedding, defaults to artifacts/ at the repo root
+ARTIFACT_DIR = os.getenv("RAG_ARTIFACT_DIR", os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "artifacts")))
+WRITE_ARTIFACTS = True
+
+# vector search backend: "qdrant" (remote cluster), "numpy" (exact, in process) or "hnsw" (approximate, in process), see lib/vector_store.py
+VECTOR_STORE_BACKEND = os.getenv("RAG_VECTOR_STORE", "qdrant")
+HNSW_M = 16 # graph degree of the hnsw index
+HNSW_EF_CONSTRUCTION = 200 # candidate list size while building the hnsw index
+HNSW_EF_SEARCH = 100 # candidate list size while searching, higher is slower but more accurate
+
+# vector quantization for new qdrant collections (lib/quantization.py): "none", "scalar" (int8) or "binary"
+QUANTIZATION = os.getenv("RAG_QUANTIZATION", "none") # for collections created from now on, searches follow each collection's own config
+SEARCH_OVERSAMPLING = 2.0 # quantized search fetches limit * oversampling candidates before rescoring
+SEARCH_RESCORE = True # rescore the oversampled candidates with the float32 vectors
+# hybrid search: collections created with this on also index bm25 sparse vectors, and bi encoder rank fuses
+# dense and sparse results with reciprocal rank fusion in one qdrant query. collections created without it
+# have no sparse vectors, recreate them before turning it on. in-process vector stores stay dense only.
+HYBRID_SEARCH = os.getenv("RAG_HYBRID_SEARCH", "0") == "1"
+SPARSE_VECTOR_NAME = "bm25"
+HYBRID_PREFETCH_LIMIT = 100 # candidates taken from each of the dense and sparse searches before fusion
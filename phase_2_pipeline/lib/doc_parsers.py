@@ -0,0 +1,207 @@
+# per file document parsers shared by the phase 1 and phase 2 data loaders.
+# pypdf and BeautifulSoup are pure python and cpu bound, so parse_directory spreads files over a process pool.
+# parser output is cached by file content (lib/extraction_cache.py), unchanged files are never parsed twice.
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import bs4
+import pypdf
+from pypdf import PdfReader
+from bs4 import BeautifulSoup
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from phase_2_pipeline.lib.extraction_cache import ExtractionCache
+from phase_2_pipeline.lib.constants import PARSE_WORKERS, EXTRACTION_CACHE
+
+def parse_pdf_file(file_path, max_pages=None):
+    """
+    Extracts text from a PDF file and splits it into chunks by page.
+
+    Returns:
+        A list of dictionaries, each containing the source filename, page number,
+        and the page's text. Only the first max_pages non-empty pages are kept when set.
+    """
+    filename = os.path.basename(file_path)
+    reader = PdfReader(file_path)
+    chunks = []
+    for page in reader.pages:
+        page_text = page.extract_text()
+        if page_text:
+            chunks.append(page_text.strip())
+        if max_pages is not None and len(chunks) >= max_pages:
+            break
+
+    return [
+        {
+            "source_file": filename,
+            "page": i+1,
+            "text": text
+        }
+        for i, text in enumerate(chunks)
+    ]
+
+def parse_html_file(file_path):
+    """
+    Extracts the visible text and title of an .html file.
+
+    Returns:
+        A list with one dictionary containing the source filename, the page title, and the text.
+    """
+    with open(file_path, 'r', encoding='utf-8') as f:
+        soup = BeautifulSoup(f, 'html.parser')
+
+    # Extract page title for metadata, if it exists
+    page_title = soup.title.string if soup.title else "No Title"
+
+    # Get all human-readable text from the body
+    # .get_text() is powerful; it strips tags and combines text.
+    # The separator ensures paragraphs are spaced, making chunking reliable.
+    full_text = soup.body.get_text(separator='\n\n', strip=True)
+
+    return [{
+        "source_file": os.path.basename(file_path),
+        "title": page_title,
+        "text": full_text
+    }]
+
+def parse_txt_file(file_path):
+    """
+    Returns:
+        A list with one dictionary containing the source filename and the file's text.
+    """
+    with open(file_path, 'r', encoding='utf-8') as f:
+        full_text = f.read()
+
+    return [{
+        "source_file": os.path.basename(file_path),
+        "text": full_text
+    }]
+
+def parse_json_file(file_path):
+    '''
+    expects data represented as a single json object
+    '''
+    with open(file_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    # Ensure data is one json object
+    if not isinstance(data, dict):
+        data = {"data": data}
+
+    return [{
+        "source_file": os.path.basename(file_path),
+        "text": json.dumps(data, indent=2)
+    }]
+
+# parser and matching file extensions for each valid DATA_FORMAT
+FILE_PARSERS = {
+    "PDF": (parse_pdf_file, (".pdf",)),
+    "HTML": (parse_html_file, (".html", ".htm")),
+    "TXT": (parse_txt_file, (".txt",)),
+    "JSON": (parse_json_file, (".json",)),
+}
+
+# bump a parser's version when its output changes, so cached extractions made by the old code are not reused
+PARSER_VERSIONS = {
+    "PDF": f"pdf-1-pypdf-{pypdf.__version__}",
+    "HTML": f"html-1-bs4-{bs4.__version__}",
+    "TXT": "txt-1",
+    "JSON": "json-1",
+}
+
+def list_files(dir_path, data_format):
+    """
+    Returns:
+        Sorted paths of the files in dir_path that match data_format, so output order is deterministic.
+    """
+    extensions = FILE_PARSERS[data_format][1]
+    return [
+        os.path.join(dir_path, filename)
+        for filename in sorted(os.listdir(dir_path))
+        if filename.lower().endswith(extensions)
+    ]
+
+def parse_file(data_format, file_path, parser_kwargs=None, file_hash=None):
+    """
+    Parses one file, catching any error so a bad file never takes down the rest of the directory.
+    With EXTRACTION_CACHE, files parsed before (same content, parser version, and options) are read
+    back from the extraction cache instead. Cached records are read into a list like parser output,
+    since results are sent back from the worker processes whole. Unreadable cache entries are
+    dropped and the file is parsed again. file_hash is the file's sha256 when the caller already
+    has it, otherwise the file is hashed here.
+
+    Returns:
+        (file_path, list of chunk dictionaries, error message or None)
+    """
+    parser = FILE_PARSERS[data_format][0]
+    try:
+        cache = key = None
+        if EXTRACTION_CACHE:
+            cache = ExtractionCache()
+            if file_hash is None:
+                key = cache.key_for_file(file_path, PARSER_VERSIONS[data_format], parser_kwargs)
+            else:
+                key = cache.key(file_hash, PARSER_VERSIONS[data_format], parser_kwargs)
+            records = cache.load(key)
+            if records is not None:
+                # the key ignores the file name, so a renamed copy reports its own name
+                filename = os.path.basename(file_path)
+                return file_path, [{**record, "source_file": filename} for record in records], None
+
+        chunks = parser(file_path, **(parser_kwargs or {}))
+        if cache is not None:
+            cache.put(key, chunks)
+        return file_path, chunks, None
+    except Exception as e:
+        return file_path, [], str(e)
+
+def parse_files(data_format, file_paths, workers=PARSE_WORKERS, parser_kwargs=None, file_hashes=None):
+    """
+    Parses files with a pool of worker processes (workers <= 1 parses in this process).
+    file_hashes optionally maps file paths to their known sha256, so they are not hashed again.
+
+    Yields:
+        (file_path, chunks, error) per file, in the same order as file_paths. At most 2 * workers
+        files are in flight at a time, so results never pile up in memory.
+    """
+    file_hashes = file_hashes or {}
+    if workers <= 1 or len(file_paths) <= 1:
+        for file_path in file_paths:
+            yield parse_file(data_format, file_path, parser_kwargs, file_hashes.get(file_path))
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = []
+        pending = iter(file_paths)
+        for file_path in pending:
+            in_flight.append(pool.submit(parse_file, data_format, file_path, parser_kwargs, file_hashes.get(file_path)))
+            if len(in_flight) >= 2 * workers:
+                break
+
+        while in_flight:
+            result = in_flight.pop(0).result()
+            next_path = next(pending, None)
+            if next_path is not None:
+                in_flight.append(pool.submit(parse_file, data_format, next_path, parser_kwargs, file_hashes.get(next_path)))
+            yield result
+
+def parse_directory(dir_path, data_format, workers=PARSE_WORKERS, **parser_kwargs):
+    """
+    Scans a directory for files of data_format and parses them in parallel.
+
+    Yields:
+        Chunk dictionaries, grouped by file in sorted filename order. Files that fail to parse are
+        reported and skipped.
+    """
+    print(f"Scanning for {data_format} files in '{dir_path}'...")
+    file_paths = list_files(dir_path, data_format)
+    for file_path, chunks, error in parse_files(data_format, file_paths, workers, parser_kwargs):
+        filename = os.path.basename(file_path)
+        if error is not None:
+            print(f"  - ERROR: Failed to process '{filename}': {error}")
+            continue
+
+        print(f"  - Extracted {len(chunks)} text chunks from '{filename}'.")
+        yield from chunks
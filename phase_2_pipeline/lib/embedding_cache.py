@@ -0,0 +1,71 @@
+# two tier cache for query embeddings: in-memory LRU in front of a persistent sqlite store (cache_store.TieredCache)
+import hashlib
+import os
+import sys
+import threading
+import unicodedata
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from phase_2_pipeline.lib.cache_store import TieredCache
+from phase_2_pipeline.lib.constants import CACHE_DIR, QUERY_EMBEDDING_CACHE_SIZE
+
+def normalize_query(text: str) -> str:
+    # collapse whitespace so trivially different spellings of the same query share an entry
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+def _cache_key(model_name: str, text: str) -> str:
+    return hashlib.sha256(f"{model_name}\0{normalize_query(text)}".encode("utf-8")).hexdigest()
+
+class QueryEmbeddingCache:
+    '''
+        description: caches query embeddings keyed by (model name, normalized query text).
+            - memory tier: bounded LRU, checked first
+            - disk tier: sqlite store, survives restarts and repeated eval runs
+            - only queries missing from both tiers are sent to the model
+    '''
+    def __init__(self, db_path: str, max_memory_entries: int):
+        self.cache = TieredCache(
+            db_path,
+            "query_embeddings",
+            max_memory_entries,
+            encode=lambda vector: vector.tobytes(),
+            decode=lambda value: np.frombuffer(value, dtype=np.float32),
+        )
+
+    def embed(self, model_name: str, load_model, texts: list) -> list:
+        '''
+            description: returns one embedding per text, computing only the ones that are not cached.
+
+            input: model_name (part of the cache key), load_model (zero arg function returning the fastembed model,
+                only called on a cache miss), texts to embed.
+            output: list of float32 numpy vectors in the same order as texts
+        '''
+        keys = [_cache_key(model_name, text) for text in texts]
+        # each distinct missing text is embedded once, in normalized form so the vector matches its cache key
+        texts_by_key = dict(zip(keys, texts))
+
+        def compute(missing_keys):
+            model = load_model()
+            return [np.asarray(vector, dtype=np.float32)
+                    for vector in model.embed([normalize_query(texts_by_key[key]) for key in missing_keys])]
+
+        return self.cache.get_or_compute(keys, compute)
+
+    def stats(self) -> dict:
+        return self.cache.stats()
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_query_embedding_cache() -> QueryEmbeddingCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = QueryEmbeddingCache(
+                    os.path.join(CACHE_DIR, "query_embeddings.sqlite"),
+                    QUERY_EMBEDDING_CACHE_SIZE,
+                )
+    return _cache
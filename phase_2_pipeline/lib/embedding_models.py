@@ -1,16 +1,112 @@
-from fastembed import TextEmbedding
+from fastembed import TextEmbedding, SparseTextEmbedding
 from fastembed.rerank.cross_encoder import TextCrossEncoder
 import os
 import sys
+import threading
+import time
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from phase_2_pipeline.lib.constants import EMBEDDING_MODEL_NAME, RERANKER_MODEL_NAME
+from phase_2_pipeline.lib.constants import EMBEDDING_MODEL_NAME, RERANKER_MODEL_NAME, SPARSE_MODEL_NAME, HYBRID_SEARCH, ROUTER_ENABLED
+
+# process wide model runtime, each model is loaded lazily once and then shared by every caller/thread.
+# onnxruntime sessions are safe to run from multiple threads, so only construction needs the lock.
+_models = {}
+_model_stats = {}
+_load_lock = threading.Lock()
+
+def _current_rss_mb():
+    '''
+        description: best effort resident memory of this process in MB.
+            - linux: current rss from /proc
+            - macOS/other: peak rss from resource (only grows, good enough to see model load cost)
+    '''
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is bytes on macOS, KB on linux
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    except (ImportError, OSError):
+        return None
+
+def _load_model(model_name, factory):
+    model = _models.get(model_name)
+    if model is not None:
+        return model
+
+    with _load_lock:
+        # another thread may have finished loading while we waited for the lock
+        model = _models.get(model_name)
+        if model is None:
+            rss_before = _current_rss_mb()
+            start = time.perf_counter()
+            model = factory(model_name)
+            load_time = time.perf_counter() - start
+            rss_after = _current_rss_mb()
+
+            _model_stats[model_name] = {
+                "load_time_s": round(load_time, 3),
+                "rss_before_mb": None if rss_before is None else round(rss_before, 1),
+                "rss_after_mb": None if rss_after is None else round(rss_after, 1),
+                "rss_delta_mb": None if rss_before is None or rss_after is None else round(rss_after - rss_before, 1),
+            }
+            _models[model_name] = model
+
+    return model
+
+def register_model(model_name, model):
+    '''
+        description: uses an already constructed model (or a stand-in with the same embed/rerank api, see eval/stubs.py)
+            for model_name instead of loading it with fastembed.
+    '''
+    with _load_lock:
+        _models[model_name] = model
+        _model_stats[model_name] = {"load_time_s": 0.0, "rss_before_mb": None, "rss_after_mb": None, "rss_delta_mb": None}
 
 def bi_encoder_model():
-    bi_encoder_model = TextEmbedding(EMBEDDING_MODEL_NAME)
-    return bi_encoder_model
+    return _load_model(EMBEDDING_MODEL_NAME, TextEmbedding)
 
 def cross_encoder_model():
-    cross_encoder_model = TextCrossEncoder(RERANKER_MODEL_NAME)
-    return cross_encoder_model
\ No newline at end of file
+    return _load_model(RERANKER_MODEL_NAME, TextCrossEncoder)
+
+def sparse_model():
+    return _load_model(SPARSE_MODEL_NAME, SparseTextEmbedding)
+
+def warm_up(bi_encoder=True, cross_encoder=True, sparse=HYBRID_SEARCH, router=ROUTER_ENABLED) -> dict:
+    '''
+        description: loads the models up front and runs one dummy inference so the first real query
+            does not pay for model construction or onnx session initialization.
+            with router, the saved collection router centroids are loaded as well.
+
+        input: which models to warm up.
+        output: model stats (see get_model_stats)
+    '''
+    if bi_encoder:
+        list(bi_encoder_model().embed(["warm up"]))
+    if cross_encoder:
+        list(cross_encoder_model().rerank("warm up", ["warm up"]))
+    if sparse:
+        list(sparse_model().query_embed("warm up"))
+    if router:
+        # imported here, the router module imports this one
+        from phase_2_pipeline.lib.collection_router import get_collection_router
+        get_collection_router()
+
+    return get_model_stats()
+
+def get_model_stats() -> dict:
+    '''
+        description: load time and memory used by each model loaded in this process.
+
+        output: {model_name: {"load_time_s", "rss_before_mb", "rss_after_mb", "rss_delta_mb"}}
+    '''
+    with _load_lock:
+        return {name: dict(stats) for name, stats in _model_stats.items()}
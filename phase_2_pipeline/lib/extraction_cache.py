@@ -0,0 +1,84 @@
+# content addressed cache of parser output, so re-running data load after a chunking/enrichment/embedding change
+# skips pdf text extraction and html parsing for files that did not change
+import gzip
+import hashlib
+import json
+import os
+import sys
+import zlib
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from phase_2_pipeline.lib.ingest_manifest import file_sha256
+from phase_2_pipeline.lib.constants import EXTRACTION_CACHE_DIR
+
+class ExtractionCache:
+    '''
+        description: parser output (one record per pdf page, or per html/txt/json file) stored as gzipped json lines,
+            one file per (file content hash, extractor version, parser options), under EXTRACTION_CACHE_DIR/<2 hex>/<key>.jsonl.gz
+            - the key never depends on the file's name or location, renamed or copied files hit the same entry
+            - entries are written to a temp file and renamed, so concurrent parser processes never read a partial entry
+            - get() streams records back one at a time, load() reads a whole entry and drops it when it is corrupt
+    '''
+    def __init__(self, root: str = EXTRACTION_CACHE_DIR):
+        self.root = root
+
+    @staticmethod
+    def key(file_hash: str, extractor_version: str, parser_kwargs: dict = None) -> str:
+        options = json.dumps(parser_kwargs or {}, sort_keys=True)
+        return hashlib.sha256("\0".join([file_hash, extractor_version, options]).encode("utf-8")).hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key + ".jsonl.gz")
+
+    def key_for_file(self, file_path: str, extractor_version: str, parser_kwargs: dict = None) -> str:
+        return self.key(file_sha256(file_path), extractor_version, parser_kwargs)
+
+    def get(self, key: str):
+        '''
+            output: generator of records, or None on a miss
+        '''
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+
+        def records():
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    yield json.loads(line)
+        return records()
+
+    def load(self, key: str):
+        '''
+            description: every record of an entry as a list. a truncated or corrupt entry is deleted and reported
+                as a miss, so the file is parsed again and the entry rewritten instead of failing on every run.
+
+            output: list of records, or None on a miss
+        '''
+        records = self.get(key)
+        if records is None:
+            return None
+        try:
+            if os.path.getsize(self.path(key)) == 0:
+                # gzip reads an empty file as zero records, a written entry always has a gzip header
+                raise EOFError("empty file")
+            return list(records)
+        except (OSError, EOFError, ValueError, zlib.error) as e:
+            print(f"  - extraction cache entry {key} is unreadable ({e}), parsing again")
+            self.delete(key)
+            return None
+
+    def delete(self, key: str):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def put(self, key: str, records: list):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, path)
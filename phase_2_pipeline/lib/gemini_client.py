@@ -1,12 +1,33 @@
 import os
 import sys
+import threading
 from google import genai
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from phase_2_pipeline.lib.constants import GEMINI_API_KEY
 
-client = genai.Client(api_key=GEMINI_API_KEY)
+# created on first use, so modules importing this one load without GEMINI_API_KEY (i.e. offline benchmarks with a stub client)
+client = None
+_client_lock = threading.Lock()
 
 def get_gemini_client():
-    return client
\ No newline at end of file
+    global client
+    if client is None:
+        with _client_lock:
+            if client is None:
+                client = genai.Client(api_key=GEMINI_API_KEY)
+    return client
+
+# async api of the same client, i.e. await get_async_gemini_client().models.generate_content(...)
+def get_async_gemini_client():
+    return get_gemini_client().aio
+
+def set_gemini_client(gemini_client):
+    '''
+        description: replaces the client used by every stage, i.e. with a stand-in exposing the same
+            models.generate_content / models.generate_content_stream / aio.models api (see eval/stubs.py).
+    '''
+    global client
+    with _client_lock:
+        client = gemini_client
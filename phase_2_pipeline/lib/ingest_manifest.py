@@ -0,0 +1,105 @@
+# deterministic point ids and a local manifest of ingested files, so data load only touches what changed
+import hashlib
+import json
+import os
+import sys
+import uuid
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from phase_2_pipeline.lib.constants import INGEST_MANIFEST_PATH
+
+# manifest keys are relative to the repository root, so they do not depend on where data load is run from
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+# fixed namespace so the same chunk always maps to the same point id
+POINT_ID_NAMESPACE = uuid.UUID("8f4f2a52-6b0c-4f7e-9a63-2f1d3c9e5b10")
+
+def file_sha256(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def point_id_for_chunk(chunk: dict) -> str:
+    '''
+        description: deterministic qdrant point id for a chunk, derived from its source file,
+            position in the file (page and/or character offset), and a hash of its text.
+            re-uploading the same chunk overwrites its point instead of duplicating it.
+    '''
+    text_hash = hashlib.sha256(chunk["text"].encode("utf-8")).hexdigest()
+    key = "\0".join([
+        str(chunk.get("source_file")),
+        str(chunk.get("page")),
+        str(chunk.get("start_char")),
+        text_hash,
+    ])
+    return str(uuid.uuid5(POINT_ID_NAMESPACE, key))
+
+class IngestManifest:
+    '''
+        description: json file recording, per collection, every ingested file with its content hash
+            and the point ids created from it.
+            {"collections": {collection: {file_key: {"hash": str, "point_ids": [str]}}}}
+            file keys are paths relative to the repository root (REPO_ROOT), whatever the current directory is.
+    '''
+    def __init__(self, path: str = INGEST_MANIFEST_PATH):
+        self.path = path
+        self.collections = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.collections = json.load(f).get("collections", {})
+
+    @staticmethod
+    def file_key(file_path: str) -> str:
+        return os.path.relpath(os.path.abspath(file_path), REPO_ROOT)
+
+    def files(self, collection: str) -> dict:
+        return self.collections.get(collection, {})
+
+    def diff(self, collection: str, dir_path: str, file_paths: list, extensions: tuple):
+        '''
+            description: compares the files currently in dir_path against the manifest.
+
+            input: collection, dir_path that was scanned, file_paths found in it, extensions of the scanned format
+                (only manifest entries from the same directory and format count as deleted).
+            output: (changed: [(file_path, hash)] for new or modified files, unchanged: [file_path], deleted: [file_key])
+        '''
+        recorded = self.files(collection)
+        changed, unchanged = [], []
+        current_keys = set()
+        for file_path in file_paths:
+            key = self.file_key(file_path)
+            current_keys.add(key)
+            file_hash = file_sha256(file_path)
+            if key in recorded and recorded[key]["hash"] == file_hash:
+                unchanged.append(file_path)
+            else:
+                changed.append((file_path, file_hash))
+
+        dir_key = self.file_key(dir_path)
+        deleted = [
+            key for key in recorded
+            if key not in current_keys
+            and os.path.dirname(key) == dir_key
+            and key.lower().endswith(extensions)
+        ]
+        return changed, unchanged, deleted
+
+    def point_ids(self, collection: str, file_key: str) -> list:
+        return self.files(collection).get(file_key, {}).get("point_ids", [])
+
+    def record(self, collection: str, file_key: str, file_hash: str, point_ids: list):
+        self.collections.setdefault(collection, {})[file_key] = {"hash": file_hash, "point_ids": point_ids}
+
+    def remove(self, collection: str, file_key: str):
+        self.collections.get(collection, {}).pop(file_key, None)
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        # write then rename so an interrupted save never leaves a half written manifest
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"collections": self.collections}, f, indent=2)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,173 @@
+# client for the local metadata LLM (LM Studio, openai compatible api) used to summarize chunks during data load
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from phase_2_pipeline.lib.constants import (
+    METADATA_LLM_URL,
+    METADATA_LLM_MODEL,
+    METADATA_WORKERS,
+    METADATA_TIMEOUT,
+    METADATA_MAX_RETRIES,
+)
+
+class MetadataClient:
+    '''
+        description: pooled, concurrent client for generating chunk summaries/keywords.
+            - one requests session with a connection pool sized to the worker count
+            - retries with exponential backoff on http errors, timeouts, and malformed json
+            - enrich() runs up to `workers` requests at a time and keeps chunk order
+            - stats() reports throughput (chunks/s, tokens/s) over the time at least one request was in flight,
+              so time the caller spends between chunks (embedding, upload) is not charged to the LLM
+
+        input: system_prompt sent with every chunk, url of the chat completions endpoint (point it at a stub server to test)
+    '''
+    def __init__(
+        self,
+        system_prompt: str,
+        url: str = METADATA_LLM_URL,
+        model: str = METADATA_LLM_MODEL,
+        workers: int = METADATA_WORKERS,
+        timeout: float = METADATA_TIMEOUT,
+        max_retries: int = METADATA_MAX_RETRIES,
+        backoff_seconds: float = 1.0,
+    ):
+        self.system_prompt = system_prompt
+        self.url = url
+        self.model = model
+        self.workers = workers
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"Content-Type": "application/json"})
+
+        self._stats_lock = threading.Lock()
+        self._busy_seconds = 0.0
+        self._in_flight = 0
+        self._busy_since = None
+        self.chunks = 0
+        self.failed = 0
+        self.retries = 0
+        self.completion_tokens = 0
+
+    def _request(self, chunk_text: str):
+        data = {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": self.system_prompt},
+                {"role": "user", "content": chunk_text}
+            ],
+            "temperature": 0.3,
+            "max_tokens": -1,
+            "stream": False
+        }
+
+        response = self.session.post(self.url, json=data, timeout=self.timeout)
+        response.raise_for_status()
+        body = response.json()
+        structured_response = json.loads(body['choices'][0]['message']['content'])
+        if not isinstance(structured_response, dict):
+            raise ValueError(f"expected a json object, got {type(structured_response).__name__}")
+
+        usage = body.get("usage") or {}
+        return structured_response, usage.get("completion_tokens", 0)
+
+    def _timed_request(self, chunk_text: str):
+        # busy time is the union of request intervals, concurrent requests are not counted twice
+        with self._stats_lock:
+            if self._in_flight == 0:
+                self._busy_since = time.perf_counter()
+            self._in_flight += 1
+        try:
+            return self._request(chunk_text)
+        finally:
+            with self._stats_lock:
+                self._in_flight -= 1
+                if self._in_flight == 0:
+                    self._busy_seconds += time.perf_counter() - self._busy_since
+
+    def gen_metadata(self, chunk_text: str) -> dict:
+        '''
+            description: returns json object from LLM with summary string and keywords list, retrying on failure.
+
+            input: chunk text.
+            output: {"summary": str, "keywords": list}, raises the last error once retries are exhausted.
+        '''
+        for attempt in range(self.max_retries + 1):
+            try:
+                structured_response, tokens = self._timed_request(chunk_text)
+                with self._stats_lock:
+                    self.completion_tokens += tokens
+                return structured_response
+            except (requests.RequestException, ValueError, KeyError, IndexError, TypeError):
+                # ValueError covers malformed json from the model
+                if attempt == self.max_retries:
+                    raise
+                with self._stats_lock:
+                    self.retries += 1
+                time.sleep(self.backoff_seconds * (2 ** attempt))
+
+    def _enrich_one(self, item: dict, text_chars: int) -> dict:
+        try:
+            metadata = self.gen_metadata(item['text'][:text_chars])
+        except Exception as e:
+            print(f"  - ERROR: Failed to generate metadata for '{item.get('source_file')}': {e}")
+            with self._stats_lock:
+                self.failed += 1
+            return item
+
+        if "summary" in metadata:
+            item['summary'] = metadata['summary']
+        if "keywords" in metadata:
+            item["keywords"] = metadata["keywords"]
+        with self._stats_lock:
+            self.chunks += 1
+        return item
+
+    def enrich(self, chunks, text_chars: int = 2000):
+        '''
+            description: adds 'summary' and 'keywords' to each chunk, `workers` requests in flight at a time.
+                chunks whose metadata still fails after retries are yielded unchanged.
+
+            input: iterable of chunk dicts (consumed lazily), number of text characters sent to the LLM.
+            output: generator of the same chunk dicts, in input order.
+        '''
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            in_flight = []
+            for item in chunks:
+                in_flight.append(pool.submit(self._enrich_one, item, text_chars))
+                # bound the number of pending chunks so memory stays flat
+                if len(in_flight) >= 2 * self.workers:
+                    yield in_flight.pop(0).result()
+            for future in in_flight:
+                yield future.result()
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            elapsed = self._busy_seconds
+            if self._in_flight:
+                elapsed += time.perf_counter() - self._busy_since
+            return {
+                "chunks": self.chunks,
+                "failed": self.failed,
+                "retries": self.retries,
+                "completion_tokens": self.completion_tokens,
+                "elapsed_s": round(elapsed, 2),
+                "chunks_per_s": round(self.chunks / elapsed, 2) if elapsed else 0.0,
+                "tokens_per_s": round(self.completion_tokens / elapsed, 2) if elapsed else 0.0,
+            }
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,236 @@
+# in memory token/latency/cost metrics for the llm stages. recording only updates counters under a lock and
+# queues the event, a background thread (JsonlWriter, also used for trace spans) writes queued events to a jsonl
+# file in batches, so requests never wait on (or interleave in) the metrics file
+import atexit
+import bisect
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from phase_2_pipeline.lib.constants import (
+    METRICS_PATH,
+    METRICS_FLUSH_INTERVAL,
+    METRICS_FLUSH_BATCH,
+    LLM_PRICING,
+)
+
+# 1, 2, 3, 5, 7, 10, 20 ... 7,000,000, fits token counts and milliseconds
+_BUCKET_BOUNDS = [multiplier * 10 ** exponent for exponent in range(7) for multiplier in (1, 2, 3, 5, 7)]
+
+def _round(value):
+    return None if value is None else round(value, 2)
+
+class Histogram:
+    '''
+        description: fixed bucket histogram, percentiles are the upper bound of the bucket they fall in
+            (capped at the largest value seen), so memory stays constant however many values are recorded.
+    '''
+    def __init__(self, bounds: list = _BUCKET_BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = None
+
+    def record(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, q: float):
+        if self.count == 0:
+            return None
+        target = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= target:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return self.max
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "total": round(self.total, 2),
+            "mean": round(self.total / self.count, 2) if self.count else None,
+            "p50": _round(self.percentile(0.5)),
+            "p95": _round(self.percentile(0.95)),
+            "max": _round(self.max),
+        }
+
+class JsonlWriter:
+    '''
+        description: appends json events to a file from a daemon thread, so callers never wait on (or interleave in) the file.
+            - write() only queues the event
+            - queued events are written every flush_interval seconds or flush_batch events, one append per batch
+            - flush() writes whatever is queued right away
+
+        input: jsonl path (None drops events), flush interval (s), events per write
+    '''
+    def __init__(self, path: str, flush_interval: float = METRICS_FLUSH_INTERVAL, flush_batch: int = METRICS_FLUSH_BATCH,
+                 name: str = "jsonl-writer"):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.name = name
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._flusher = None
+
+    def write(self, event: dict):
+        if self.path is None:
+            return
+        self._queue.put(event)
+        self._ensure_flusher()
+        if self._queue.qsize() >= self.flush_batch:
+            self._wake.set()
+
+    def _ensure_flusher(self):
+        if self._flusher is None:
+            with self._lock:
+                if self._flusher is None:
+                    self._flusher = threading.Thread(target=self._flush_loop, name=self.name, daemon=True)
+                    self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"{self.name} flush failed: {e}")
+
+    def flush(self):
+        # the write lock keeps batches from the flusher thread and callers whole
+        with self._write_lock:
+            events = []
+            while True:
+                try:
+                    events.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not events or self.path is None:
+                return
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(event, ensure_ascii=False, default=str) + "\n" for event in events))
+
+class MetricsCollector:
+    '''
+        description: per stage counters and histograms (prompt tokens, output tokens, latency in ms) for llm calls.
+            - record() is thread safe and never touches the file system
+            - events are written by a JsonlWriter every flush_interval seconds or flush_batch events,
+              flush() writes whatever is queued right away (also called at exit)
+            - summary() reports totals, percentiles, estimated cost (LLM_PRICING) and throughput per stage
+
+        input: jsonl path for the events (None keeps metrics in memory only), flush interval (s), events per write
+    '''
+    def __init__(self, path: str = METRICS_PATH, flush_interval: float = METRICS_FLUSH_INTERVAL,
+                 flush_batch: int = METRICS_FLUSH_BATCH):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._writer = JsonlWriter(path, flush_interval, flush_batch, name="metrics-flusher")
+
+    def record(self, stage: str, model: str = None, prompt_tokens: int = None, output_tokens: int = None,
+               latency_ms: float = None, **fields):
+        '''
+            description: records one llm call. extra fields (i.e. the query) only go to the jsonl event.
+        '''
+        with self._lock:
+            stage_metrics = self._stages.get(stage)
+            if stage_metrics is None:
+                stage_metrics = self._stages[stage] = {
+                    "calls": 0,
+                    "cost_usd": 0.0,
+                    "prompt_tokens": Histogram(),
+                    "output_tokens": Histogram(),
+                    "latency_ms": Histogram(),
+                }
+            stage_metrics["calls"] += 1
+            for name, value in (("prompt_tokens", prompt_tokens), ("output_tokens", output_tokens), ("latency_ms", latency_ms)):
+                if value is not None:
+                    stage_metrics[name].record(value)
+            stage_metrics["cost_usd"] += estimate_cost(model, prompt_tokens, output_tokens)
+
+        if self.path is None:
+            return
+        event = {"time": time.time(), "stage": stage, "model": model, "prompt_tokens": prompt_tokens,
+                 "output_tokens": output_tokens, "latency_ms": None if latency_ms is None else round(latency_ms, 2)}
+        event.update(fields)
+        self._writer.write(event)
+
+    def flush(self):
+        self._writer.flush()
+
+    def summary(self) -> dict:
+        '''
+            output: {stage: {"calls", "calls_per_s", "tokens_per_s", "cost_usd", "prompt_tokens", "output_tokens",
+                "latency_ms"}}, the last three as {"count", "total", "mean", "p50", "p95", "max"}.
+                rates are over the time since the collector was created (or reset).
+        '''
+        elapsed = max(time.time() - self.started_at, 1e-9)
+        with self._lock:
+            summary = {}
+            for stage, stage_metrics in self._stages.items():
+                tokens = stage_metrics["prompt_tokens"].total + stage_metrics["output_tokens"].total
+                summary[stage] = {
+                    "calls": stage_metrics["calls"],
+                    "calls_per_s": round(stage_metrics["calls"] / elapsed, 3),
+                    "tokens_per_s": round(tokens / elapsed, 1),
+                    "cost_usd": round(stage_metrics["cost_usd"], 6),
+                    "prompt_tokens": stage_metrics["prompt_tokens"].summary(),
+                    "output_tokens": stage_metrics["output_tokens"].summary(),
+                    "latency_ms": stage_metrics["latency_ms"].summary(),
+                }
+        return summary
+
+    def reset(self):
+        with self._lock:
+            self._stages = {}
+            self.started_at = time.time()
+
+def estimate_cost(model: str, prompt_tokens: int = None, output_tokens: int = None) -> float:
+    # usd, 0 for models without a price in LLM_PRICING
+    prices = LLM_PRICING.get(model)
+    if prices is None:
+        return 0.0
+    return ((prompt_tokens or 0) * prices["input"] + (output_tokens or 0) * prices["output"]) / 1_000_000
+
+def record_llm_usage(stage: str, model: str, response, latency_ms: float = None, **fields):
+    '''
+        description: records the token usage of a gemini response (responses without usage metadata only count the call).
+    '''
+    usage = getattr(response, "usage_metadata", None)
+    get_metrics().record(
+        stage,
+        model=model,
+        prompt_tokens=getattr(usage, "prompt_token_count", None),
+        output_tokens=getattr(usage, "candidates_token_count", None),
+        latency_ms=latency_ms,
+        **fields,
+    )
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+def get_metrics() -> MetricsCollector:
+    global _metrics
+    if _metrics is None:
+        with _metrics_lock:
+            if _metrics is None:
+                _metrics = MetricsCollector()
+                atexit.register(_metrics.flush)
+    return _metrics
@@ -1,4 +1,4 @@
-from qdrant_client import QdrantClient
+from qdrant_client import QdrantClient, AsyncQdrantClient
 import os
 import sys
 
@@ -10,5 +10,25 @@ client = QdrantClient(
     api_key=QDRANT_KEY,
 )
 
+# used by the async pipeline (p0_runner.run_pipeline_async)
+async_client = AsyncQdrantClient(
+    url=QDRANT_URL,
+    api_key=QDRANT_KEY,
+)
+
 def get_qdrant_client() -> QdrantClient:
-    return client
\ No newline at end of file
+    return client
+
+def get_async_qdrant_client() -> AsyncQdrantClient:
+    return async_client
+
+def set_qdrant_client(sync_client: QdrantClient, async_qdrant_client=None):
+    '''
+        description: points the pipeline at another qdrant, i.e. QdrantClient(":memory:") or QdrantClient(path=...) for
+            offline runs. the async client is only replaced when one is passed, it must read the same data.
+            call vector_store.set_vector_store() afterwards if the vector store was already created.
+    '''
+    global client, async_client
+    client = sync_client
+    if async_qdrant_client is not None:
+        async_client = async_qdrant_client
@@ -0,0 +1,124 @@
+# vector quantization for qdrant collections: quantized vectors stay in RAM for the search, the float32 originals
+# move to disk and are only read to rescore the oversampled candidates
+import os
+import sys
+import time
+import numpy as np
+from qdrant_client import models
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from phase_2_pipeline.lib.constants import QUANTIZATION, SEARCH_OVERSAMPLING, SEARCH_RESCORE
+
+# bytes per stored vector component
+_BYTES_PER_DIMENSION = {"none": 4, "scalar": 1, "binary": 1 / 8}
+
+def quantization_config(method: str = QUANTIZATION):
+    '''
+        input: "none", "scalar" (int8, ~4x smaller) or "binary" (1 bit, ~32x smaller, best with rescoring)
+        output: qdrant quantization config, None for "none"
+    '''
+    if method == "none":
+        return None
+    if method == "scalar":
+        return models.ScalarQuantization(
+            scalar=models.ScalarQuantizationConfig(type=models.ScalarType.INT8, quantile=0.99, always_ram=True)
+        )
+    if method == "binary":
+        return models.BinaryQuantization(binary=models.BinaryQuantizationConfig(always_ram=True))
+    raise ValueError(f"unknown quantization '{method}', expected none, scalar, or binary")
+
+def collection_config(size: int, distance=models.Distance.COSINE, method: str = QUANTIZATION) -> dict:
+    '''
+        description: create_collection arguments for the dense vectors of a collection.
+            quantized collections keep their float32 vectors on disk, only the quantized copy is held in RAM.
+    '''
+    return {
+        "vectors_config": models.VectorParams(size=size, distance=distance, on_disk=method != "none"),
+        "quantization_config": quantization_config(method),
+    }
+
+def search_params(method: str = QUANTIZATION, oversampling: float = SEARCH_OVERSAMPLING, rescore: bool = SEARCH_RESCORE):
+    '''
+        description: search over the quantized vectors for limit * oversampling candidates, then rescore them with
+            the float32 vectors and keep the best limit. None for collections without quantization.
+    '''
+    if method == "none":
+        return None
+    return models.SearchParams(
+        quantization=models.QuantizationSearchParams(rescore=rescore, oversampling=oversampling)
+    )
+
+def collection_search_params(collection_info, oversampling: float = SEARCH_OVERSAMPLING, rescore: bool = SEARCH_RESCORE):
+    '''
+        description: search params for a collection as it was created, whatever RAG_QUANTIZATION is set to in this process.
+            the dense vectors' own quantization config wins over the collection wide one, like in qdrant.
+
+        input: collection info (client.get_collection())
+        output: SearchParams with oversampling/rescoring for quantized collections, None otherwise
+    '''
+    config = collection_info.config
+    vectors = config.params.vectors
+    # the dense vectors are unnamed, so vectors is a VectorParams (a dict only for named vectors)
+    vector_params = vectors.get("") if isinstance(vectors, dict) else vectors
+    quantization = getattr(vector_params, "quantization_config", None) or config.quantization_config
+    if quantization is None or isinstance(quantization, models.Disabled):
+        return None
+    return models.SearchParams(
+        quantization=models.QuantizationSearchParams(rescore=rescore, oversampling=oversampling)
+    )
+
+def estimated_vector_ram_mb(points: int, size: int, method: str = QUANTIZATION) -> float:
+    # vectors qdrant keeps in RAM (graph and payload index not included)
+    return round(points * size * _BYTES_PER_DIMENSION[method] / (1024 * 1024), 2)
+
+def _collection_ram_mb(client, collection_name: str, method: str, size: int) -> float:
+    info = client.get_collection(collection_name)
+    return estimated_vector_ram_mb(info.points_count or 0, size, method)
+
+if __name__ == "__main__":
+    # builds quantized copies of a collection from its artifacts, then compares RAM, latency and recall@50 against
+    # exact float32 search on the original, stored vectors are reused as queries:
+    # python -m phase_2_pipeline.lib.quantization <collection> [number of queries] [methods, i.e. scalar,binary] [oversampling]
+    from phase_2_pipeline.lib.artifact_store import ArtifactStore, rebuild_collection, drop_collection
+    from phase_2_pipeline.lib.qdrant_client import get_qdrant_client
+
+    collection_name = sys.argv[1]
+    query_count = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    methods = sys.argv[3].split(",") if len(sys.argv) > 3 else ["scalar", "binary"]
+    oversampling = float(sys.argv[4]) if len(sys.argv) > 4 else SEARCH_OVERSAMPLING
+    limit = 50
+
+    client = get_qdrant_client()
+    store = ArtifactStore(collection_name)
+    size = store.meta()["size"]
+    rng = np.random.default_rng(0)
+    all_vectors = np.concatenate([np.asarray(vectors) for _, _, _, vectors, _ in store.iter_points()])
+    queries = all_vectors[rng.choice(len(all_vectors), size=min(query_count, len(all_vectors)), replace=False)]
+
+    def run(target, params):
+        start = time.perf_counter()
+        ids = [
+            [point.id for point in client.query_points(
+                collection_name=target, query=query.tolist(), limit=limit, search_params=params, with_payload=False,
+            ).points]
+            for query in queries
+        ]
+        return ids, (time.perf_counter() - start) / len(queries) * 1000
+
+    exact, _ = run(collection_name, models.SearchParams(exact=True))
+    baseline, latency_ms = run(collection_name, None)
+    recall = np.mean([len(set(a) & set(b)) / max(len(b), 1) for a, b in zip(baseline, exact)])
+    print(f"{'float32':>16}: ~{_collection_ram_mb(client, collection_name, 'none', size)} MB vectors in RAM, "
+          f"{latency_ms:.2f} ms/query, recall@{limit}: {recall:.3f}")
+
+    for method in methods:
+        target = f"{collection_name}_{method}"
+        rebuild_collection(client, collection_name, target, quantization=method)
+        for rescore in (False, True):
+            ids, latency_ms = run(target, search_params(method, oversampling, rescore))
+            recall = np.mean([len(set(a) & set(b)) / max(len(b), 1) for a, b in zip(ids, exact)])
+            label = f"{method}{' +rescore' if rescore else ''}"
+            print(f"{label:>16}: ~{_collection_ram_mb(client, target, method, size)} MB vectors in RAM, "
+                  f"{latency_ms:.2f} ms/query, recall@{limit}: {recall:.3f}")
+        drop_collection(client, target)
@@ -0,0 +1,70 @@
+# cache of cross encoder scores: in-memory LRU in front of an optional persistent sqlite store (cache_store.TieredCache)
+import hashlib
+import os
+import struct
+import sys
+import threading
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from phase_2_pipeline.lib.cache_store import TieredCache
+from phase_2_pipeline.lib.embedding_cache import normalize_query
+from phase_2_pipeline.lib.constants import CACHE_DIR, RERANK_CACHE_SIZE, RERANK_CACHE_PERSIST
+
+def _cache_key(model_name: str, query: str, candidate_text: str) -> str:
+    # candidates are keyed by a hash of their content, so an edited chunk is rescored even if its point id is reused
+    candidate_hash = hashlib.sha256((candidate_text or "").encode("utf-8")).hexdigest()
+    return hashlib.sha256(f"{model_name}\0{normalize_query(query)}\0{candidate_hash}".encode("utf-8")).hexdigest()
+
+class RerankScoreCache:
+    '''
+        description: caches cross encoder scores keyed by (reranker model, normalized query text, candidate text hash).
+            - memory tier: bounded LRU, checked first
+            - disk tier: sqlite store (only when persist is set), survives restarts and repeated eval runs
+            - only pairs missing from both tiers are sent to the cross encoder
+    '''
+    def __init__(self, db_path: str, max_memory_entries: int, persist: bool = True):
+        self.cache = TieredCache(
+            db_path if persist else None,
+            "rerank_scores",
+            max_memory_entries,
+            encode=lambda score: struct.pack("<d", score),
+            decode=lambda value: struct.unpack("<d", value)[0],
+        )
+
+    def score(self, model_name: str, load_model, pairs: list) -> list:
+        '''
+            description: returns one cross encoder score per (query, candidate text) pair, computing only the ones that are not cached.
+
+            input: model_name (part of the cache key), load_model (zero arg function returning the fastembed cross encoder,
+                only called on a cache miss), pairs of (query, candidate text).
+            output: list of float scores in the same order as pairs
+        '''
+        keys = [_cache_key(model_name, query, text) for query, text in pairs]
+        # each distinct missing pair is scored once, with the normalized query so the score matches its cache key
+        pairs_by_key = dict(zip(keys, pairs))
+
+        def compute(missing_keys):
+            model = load_model()
+            unique_pairs = [(normalize_query(pairs_by_key[key][0]), pairs_by_key[key][1] or "") for key in missing_keys]
+            return [float(score) for score in model.rerank_pairs(unique_pairs)]
+
+        return self.cache.get_or_compute(keys, compute)
+
+    def stats(self) -> dict:
+        return self.cache.stats()
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_rerank_cache() -> RerankScoreCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = RerankScoreCache(
+                    os.path.join(CACHE_DIR, "rerank_scores.sqlite"),
+                    RERANK_CACHE_SIZE,
+                    persist=RERANK_CACHE_PERSIST,
+                )
+    return _cache
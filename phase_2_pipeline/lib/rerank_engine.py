@@ -0,0 +1,108 @@
+# token aware cross encoder scoring: pre-tokenize pairs, truncate to a token budget, and batch pairs of similar length
+# fastembed pads every batch to its longest pair, so one long manual page in a batch of short chunks pads all of them
+import os
+import sys
+import threading
+import numpy as np
+from tokenizers import Tokenizer
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from phase_2_pipeline.lib.embedding_models import cross_encoder_model
+from phase_2_pipeline.lib.constants import RERANK_MAX_TOKENS, RERANK_BATCH_SIZE
+
+class RerankEngine:
+    '''
+        description: scores (query, candidate text) pairs with the onnx session of a fastembed TextCrossEncoder.
+            - pairs are tokenized once with the model's own tokenizer, truncated to max_tokens (longest side first,
+              so the candidate text is cut before the query)
+            - pairs are sorted by token length and split into batches of batch_size, each batch is only padded to
+              its own longest pair
+            - cross encoders that do not expose a tokenizer/onnx session fall back to rerank_pairs
+
+        input: fastembed TextCrossEncoder, token budget per pair, pairs per onnx call
+    '''
+    def __init__(self, cross_encoder, max_tokens: int = RERANK_MAX_TOKENS, batch_size: int = RERANK_BATCH_SIZE):
+        self.cross_encoder = cross_encoder
+        self.max_tokens = max_tokens
+        self.batch_size = batch_size
+        self._onnx = None
+        self._tokenizer = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> bool:
+        # returns False when the cross encoder is not a fastembed onnx model
+        with self._lock:
+            if self._tokenizer is not None:
+                return True
+            onnx = getattr(self.cross_encoder, "model", None)
+            if onnx is None or not hasattr(onnx, "load_onnx_model"):
+                return False
+            if getattr(onnx, "model", None) is None:
+                onnx.load_onnx_model()
+
+            # private copy, the shared tokenizer keeps fastembed's own truncation and padding settings
+            tokenizer = Tokenizer.from_str(onnx.tokenizer.to_str())
+            tokenizer.enable_truncation(max_length=self.max_tokens, strategy="longest_first")
+            tokenizer.no_padding()
+
+            padding = onnx.tokenizer.padding or {}
+            self._pad_id = padding.get("pad_id", 0)
+            self._input_names = {node.name for node in onnx.model.get_inputs()}
+            self._onnx = onnx
+            self._tokenizer = tokenizer
+            return True
+
+    def _run_batch(self, encodings: list) -> np.ndarray:
+        length = max(len(encoding.ids) for encoding in encodings)
+        input_ids = np.full((len(encodings), length), self._pad_id, dtype=np.int64)
+        token_type_ids = np.zeros((len(encodings), length), dtype=np.int64)
+        attention_mask = np.zeros((len(encodings), length), dtype=np.int64)
+        for row, encoding in enumerate(encodings):
+            size = len(encoding.ids)
+            input_ids[row, :size] = encoding.ids
+            token_type_ids[row, :size] = encoding.type_ids
+            attention_mask[row, :size] = 1
+
+        inputs = {"input_ids": input_ids}
+        if "token_type_ids" in self._input_names:
+            inputs["token_type_ids"] = token_type_ids
+        if "attention_mask" in self._input_names:
+            inputs["attention_mask"] = attention_mask
+        outputs = self._onnx.model.run(self._onnx.ONNX_OUTPUT_NAMES, inputs)
+        return outputs[0][:, 0]
+
+    def rerank_pairs(self, pairs: list) -> list:
+        '''
+            description: same contract as TextCrossEncoder.rerank_pairs.
+
+            input: list of (query, candidate text)
+            output: list of float scores in the same order as pairs
+        '''
+        pairs = list(pairs)
+        if not pairs:
+            return []
+        if not self._load():
+            return [float(score) for score in self.cross_encoder.rerank_pairs(pairs, batch_size=self.batch_size)]
+
+        encodings = self._tokenizer.encode_batch(pairs)
+        # length buckets: neighbours in this order have similar token counts, so little of each batch is padding
+        order = sorted(range(len(pairs)), key=lambda i: len(encodings[i].ids))
+
+        scores = [0.0] * len(pairs)
+        for start in range(0, len(order), self.batch_size):
+            bucket = order[start:start + self.batch_size]
+            for i, score in zip(bucket, self._run_batch([encodings[i] for i in bucket])):
+                scores[i] = float(score)
+        return scores
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_rerank_engine() -> RerankEngine:
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = RerankEngine(cross_encoder_model())
+    return _engine
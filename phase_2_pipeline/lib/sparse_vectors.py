@@ -0,0 +1,31 @@
+# bm25 sparse vectors for hybrid search, catches exact terms (model numbers like "XM4" or "SM-A556") that dense embeddings blur
+import os
+import sys
+from qdrant_client import models
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from phase_2_pipeline.lib.embedding_models import sparse_model
+from phase_2_pipeline.lib.constants import SPARSE_VECTOR_NAME
+
+def to_sparse_vector(embedding) -> models.SparseVector:
+    return models.SparseVector(indices=embedding.indices.tolist(), values=embedding.values.tolist())
+
+def embed_sparse_documents(texts: list, batch_size: int = 256) -> list:
+    '''
+        description: term frequency side of bm25, qdrant applies the idf part at query time (Modifier.IDF).
+
+        output: one SparseVector per text
+    '''
+    return [to_sparse_vector(embedding) for embedding in sparse_model().embed(texts, batch_size=batch_size)]
+
+def embed_sparse_queries(queries: list) -> list:
+    # query vectors only mark which terms are present, weighting comes from the documents
+    return [to_sparse_vector(embedding) for embedding in sparse_model().query_embed(queries)]
+
+def sparse_vectors_config() -> dict:
+    return {SPARSE_VECTOR_NAME: models.SparseVectorParams(modifier=models.Modifier.IDF)}
+
+def has_sparse_vectors(client, collection_name: str) -> bool:
+    sparse_vectors = client.get_collection(collection_name).config.params.sparse_vectors or {}
+    return SPARSE_VECTOR_NAME in sparse_vectors
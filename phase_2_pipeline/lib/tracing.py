@@ -0,0 +1,337 @@
+# span based tracing of the query pipeline: each stage (preprocess, query embedding, vector search, rerank,
+# generation) opens a span, stages called inside another stage become its children. finished spans are appended
+# to a jsonl file by a background thread, one span per line with opentelemetry field names, and can be converted
+# to otlp/json. with tracing off, span() and traced() only check a flag.
+import atexit
+import contextvars
+import functools
+import inspect
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from phase_2_pipeline.lib.metrics import Histogram, JsonlWriter
+from phase_2_pipeline.lib.constants import TRACING, TRACE_PATH, TRACE_FLUSH_INTERVAL, TRACE_FLUSH_BATCH
+
+SERVICE_NAME = "rag-pipeline"
+
+# 0.01 ms ... 700 s, each bound at most 1.7x the one before it
+_DURATION_BOUNDS_MS = [multiplier * 10 ** exponent for exponent in range(-2, 6) for multiplier in (1, 1.5, 2, 3, 5, 7)]
+
+_enabled = TRACING
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+class _NoopSpan:
+    # returned while tracing is off, so callers never need to check
+    def set_attribute(self, key: str, value):
+        pass
+
+    def set_attributes(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NOOP_SPAN = _NoopSpan()
+
+class Span:
+    '''
+        description: one timed stage. used as a context manager, the span is the current span (parent of spans opened
+            inside it) until it exits, then it is handed to the exporter. an exception marks the span as an error.
+
+        input: span name, parent span (None starts a new trace), attributes (str, int, float, bool)
+    '''
+    __slots__ = ("name", "trace_id", "span_id", "parent_span_id", "attributes", "start_time_unix_nano",
+                 "end_time_unix_nano", "status", "_token")
+
+    def __init__(self, name: str, parent=None, attributes: dict = None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else f"{random.getrandbits(128):032x}"
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_span_id = parent.span_id if parent is not None else None
+        self.attributes = dict(attributes) if attributes else {}
+        self.start_time_unix_nano = None
+        self.end_time_unix_nano = None
+        self.status = {"code": "OK"}
+        self._token = None
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def set_attributes(self, **attributes):
+        self.attributes.update(attributes)
+
+    def duration_ms(self) -> float:
+        return (self.end_time_unix_nano - self.start_time_unix_nano) / 1e6
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        self.start_time_unix_nano = time.time_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end_time_unix_nano = time.time_ns()
+        if exc is not None:
+            self.status = {"code": "ERROR", "message": f"{exc_type.__name__}: {exc}"}
+        try:
+            _current_span.reset(self._token)
+        except ValueError:
+            # a generator closed from another context (i.e. garbage collected), nothing to restore
+            pass
+        get_exporter().export(self)
+        return False
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_span_id,
+            "name": self.name,
+            "start_time_unix_nano": self.start_time_unix_nano,
+            "end_time_unix_nano": self.end_time_unix_nano,
+            "duration_ms": round(self.duration_ms(), 3),
+            "attributes": self.attributes,
+            "status": self.status,
+        }
+
+class JsonlExporter:
+    '''
+        description: queues finished spans for a background JsonlWriter (one append per batch, no file i/o on the
+            request path) and keeps a fixed bucket histogram of durations per span name for stats(), so memory stays
+            constant however long tracing runs. percentiles are bucket upper bounds, see metrics.Histogram.
+    '''
+    def __init__(self, path: str = TRACE_PATH, flush_interval: float = TRACE_FLUSH_INTERVAL, flush_batch: int = TRACE_FLUSH_BATCH):
+        self.path = path
+        self._writer = JsonlWriter(path, flush_interval, flush_batch, name="trace-flusher")
+        self._lock = threading.Lock()
+        self._durations = {}
+
+    def export(self, span: Span):
+        self._writer.write(span.to_dict())
+        with self._lock:
+            histogram = self._durations.get(span.name)
+            if histogram is None:
+                histogram = self._durations[span.name] = Histogram(_DURATION_BOUNDS_MS)
+            histogram.record(span.duration_ms())
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {name: _histogram_summary(histogram) for name, histogram in self._durations.items()}
+
+    def reset_stats(self):
+        with self._lock:
+            self._durations = {}
+
+    def flush(self):
+        # writes queued spans now, i.e. before reading the trace file in the same process
+        self._writer.flush()
+
+    def close(self):
+        self.flush()
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+def get_exporter() -> JsonlExporter:
+    global _exporter
+    if _exporter is None:
+        with _exporter_lock:
+            if _exporter is None:
+                _exporter = JsonlExporter()
+    return _exporter
+
+@atexit.register
+def _flush_at_exit():
+    if _exporter is not None:
+        _exporter.flush()
+
+def set_tracing(enabled: bool, path: str = None):
+    '''
+        description: turns tracing on or off at runtime (RAG_TRACING=1 turns it on at import), optionally writing
+            spans to another file from now on.
+    '''
+    global _enabled, _exporter
+    with _exporter_lock:
+        if path is not None:
+            if _exporter is not None:
+                _exporter.close()
+            _exporter = JsonlExporter(path)
+        _enabled = enabled
+
+def tracing_enabled() -> bool:
+    return _enabled
+
+def span(name: str, **attributes):
+    '''
+        description: span for a block of code, child of the current span, i.e.
+            with span("vector_search", collection=collection) as s:
+                points = ...
+                s.set_attribute("candidates", len(points))
+    '''
+    if not _enabled:
+        return _NOOP_SPAN
+    return Span(name, _current_span.get(), attributes)
+
+def current_span():
+    # innermost open span, used to attach attributes (token counts, cache hits) from helper functions
+    if not _enabled:
+        return _NOOP_SPAN
+    return _current_span.get() or _NOOP_SPAN
+
+def traced(name: str, **attributes):
+    '''
+        description: decorator that runs every call of a function (plain, async, generator or async generator)
+            in its own span. attributes can be added during the call with current_span().set_attribute().
+    '''
+    def decorator(fn):
+        if inspect.isasyncgenfunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                if not _enabled:
+                    async for item in fn(*args, **kwargs):
+                        yield item
+                    return
+                with span(name, **attributes):
+                    async for item in fn(*args, **kwargs):
+                        yield item
+        elif inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not _enabled:
+                    yield from fn(*args, **kwargs)
+                    return
+                with span(name, **attributes):
+                    yield from fn(*args, **kwargs)
+        elif inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                if not _enabled:
+                    return await fn(*args, **kwargs)
+                with span(name, **attributes):
+                    return await fn(*args, **kwargs)
+        else:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not _enabled:
+                    return fn(*args, **kwargs)
+                with span(name, **attributes):
+                    return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def propagate(fn):
+    '''
+        description: executor threads do not inherit the current span (asyncio's run_in_executor and
+            ThreadPoolExecutor.map do not copy context), wrapping the function keeps its spans in the caller's trace.
+    '''
+    if not _enabled:
+        return fn
+    parent = _current_span.get()
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        token = _current_span.set(parent)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current_span.reset(token)
+    return wrapper
+
+def get_span_stats() -> dict:
+    '''
+        output: {span name: {"count", "mean_ms", "p50_ms", "p95_ms", "max_ms"}} over the spans finished in this process
+    '''
+    return get_exporter().stats()
+
+def reset_span_stats():
+    # starts get_span_stats over, i.e. between load test levels. spans already written to the trace file stay there
+    get_exporter().reset_stats()
+
+def _histogram_summary(histogram: Histogram) -> dict:
+    return {
+        "count": histogram.count,
+        "mean_ms": round(histogram.total / histogram.count, 2),
+        "p50_ms": round(histogram.percentile(0.5), 2),
+        "p95_ms": round(histogram.percentile(0.95), 2),
+        "max_ms": round(histogram.max, 2),
+    }
+
+def _latency_summary(durations: list) -> dict:
+    durations = sorted(durations)
+    count = len(durations)
+    return {
+        "count": count,
+        "mean_ms": round(sum(durations) / count, 2),
+        "p50_ms": round(durations[(count - 1) // 2], 2),
+        "p95_ms": round(durations[min(count - 1, int(count * 0.95))], 2),
+        "max_ms": round(durations[-1], 2),
+    }
+
+def read_spans(path: str = TRACE_PATH) -> list:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def summarize(spans: list) -> dict:
+    # same format as get_span_stats, for spans read back from a trace file
+    durations = {}
+    for record in spans:
+        durations.setdefault(record["name"], []).append(record["duration_ms"])
+    return {name: _latency_summary(values) for name, values in durations.items()}
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    if isinstance(value, (list, tuple)):
+        return {"arrayValue": {"values": [_otlp_value(item) for item in value]}}
+    return {"stringValue": str(value)}
+
+def to_otlp(spans: list) -> dict:
+    '''
+        description: converts spans (as written to the trace file) to an otlp/json export request, which an
+            opentelemetry collector accepts on POST /v1/traces.
+    '''
+    otlp_spans = []
+    for record in spans:
+        otlp_span = {
+            "traceId": record["trace_id"],
+            "spanId": record["span_id"],
+            "name": record["name"],
+            "kind": 1, # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(record["start_time_unix_nano"]),
+            "endTimeUnixNano": str(record["end_time_unix_nano"]),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in record["attributes"].items()],
+            "status": {"code": 2 if record["status"]["code"] == "ERROR" else 1, "message": record["status"].get("message", "")},
+        }
+        if record["parent_span_id"]:
+            otlp_span["parentSpanId"] = record["parent_span_id"]
+        otlp_spans.append(otlp_span)
+
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+        "scopeSpans": [{"scope": {"name": "phase_2_pipeline"}, "spans": otlp_spans}],
+    }]}
+
+if __name__ == "__main__":
+    # per stage latency of a trace file, or convert it to otlp/json:
+    # python -m phase_2_pipeline.lib.tracing [trace file]
+    # python -m phase_2_pipeline.lib.tracing [trace file] --otlp > traces.json
+    path = sys.argv[1] if len(sys.argv) > 1 and not sys.argv[1].startswith("--") else TRACE_PATH
+    spans = read_spans(path)
+    if "--otlp" in sys.argv:
+        print(json.dumps(to_otlp(spans)))
+    else:
+        print(f"{len(spans)} spans in {len({record['trace_id'] for record in spans})} traces from {path}")
+        for name, stats in summarize(spans).items():
+            print(f"{name:>20}: {stats}")
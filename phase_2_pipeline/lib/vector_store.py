@@ -0,0 +1,406 @@
+# pluggable vector search backends, pick one with the RAG_VECTOR_STORE env variable:
+#   qdrant - remote qdrant cluster (default)
+#   numpy  - exact in-process search, matrix product over the memory mapped artifact shards
+#   hnsw   - approximate in-process search with an hnsw index built from the artifact shards (pip install hnswlib)
+# every backend returns qdrant ScoredPoint/Record objects, so the pipeline stages work unchanged with any of them
+# sparse query vectors (hybrid search) are only used by the qdrant backend, the in-process backends search dense vectors only
+import abc
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+import numpy as np
+from qdrant_client import models
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from phase_2_pipeline.lib.artifact_store import ArtifactStore
+from phase_2_pipeline.lib.quantization import collection_search_params
+from phase_2_pipeline.lib.constants import (
+    VECTOR_STORE_BACKEND,
+    HNSW_M,
+    HNSW_EF_CONSTRUCTION,
+    HNSW_EF_SEARCH,
+    SPARSE_VECTOR_NAME,
+    HYBRID_PREFETCH_LIMIT,
+)
+
+def _select_payload(payload: dict, with_payload):
+    # with_payload follows qdrant: True for everything, False for nothing, or a list of fields to keep
+    if with_payload is True:
+        return payload
+    if not with_payload:
+        return None
+    return {field: payload[field] for field in with_payload if field in payload}
+
+class VectorStore(abc.ABC):
+    '''
+        description: interface shared by every backend, a backend has to implement search() and retrieve().
+    '''
+    @abc.abstractmethod
+    def search(self, collection_name: str, query_vector, limit: int, with_payload=True, sparse_vector=None) -> list:
+        '''
+            input: dense query vector, optional sparse query vector to fuse with it (ignored by dense only backends)
+            output: list of ScoredPoint, best first
+        '''
+        raise NotImplementedError
+
+    def search_batch(self, collection_name: str, query_vectors: list, limit: int, with_payload=True, sparse_vectors=None) -> list:
+        '''
+            output: one list of ScoredPoint per query vector
+        '''
+        sparse_vectors = sparse_vectors or [None] * len(query_vectors)
+        return [
+            self.search(collection_name, vector, limit, with_payload, sparse_vector)
+            for vector, sparse_vector in zip(query_vectors, sparse_vectors)
+        ]
+
+    @abc.abstractmethod
+    def retrieve(self, collection_name: str, ids: list, with_payload=True) -> list:
+        '''
+            output: list of Record for the ids that exist
+        '''
+        raise NotImplementedError
+
+    async def search_async(self, collection_name: str, query_vector, limit: int, with_payload=True, sparse_vector=None) -> list:
+        # in-process backends are cpu bound, run them off the event loop
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.search, collection_name, query_vector, limit, with_payload, sparse_vector)
+
+class QdrantVectorStore(VectorStore):
+    '''
+        description: the remote qdrant cluster (lib/qdrant_client.py).
+            search params are sent with every dense search: oversampling and rescoring for collections created with
+            quantization, read from the collection's config once and cached (refresh() after recreating a collection).
+            params, when given, are used for every collection instead.
+    '''
+    def __init__(self, client, async_client=None, params=None):
+        self.client = client
+        self.async_client = async_client
+        self.params = params
+        self._collection_params = {}
+        self._lock = threading.Lock()
+
+    def _cached_params(self, collection_name: str) -> tuple:
+        # (True, params) once the collection's params are known
+        if self.params is not None:
+            return True, self.params
+        with self._lock:
+            if collection_name in self._collection_params:
+                return True, self._collection_params[collection_name]
+        return False, None
+
+    def _store_params(self, collection_name: str, collection_info):
+        params = collection_search_params(collection_info)
+        with self._lock:
+            self._collection_params[collection_name] = params
+        return params
+
+    def _params(self, collection_name: str):
+        known, params = self._cached_params(collection_name)
+        if known:
+            return params
+        return self._store_params(collection_name, self.client.get_collection(collection_name))
+
+    async def _params_async(self, collection_name: str):
+        known, params = self._cached_params(collection_name)
+        if known:
+            return params
+        return self._store_params(collection_name, await self.async_client.get_collection(collection_name))
+
+    def refresh(self, collection_name: str = None):
+        # drops cached search params, i.e. after a collection was recreated with another quantization
+        with self._lock:
+            if collection_name is None:
+                self._collection_params = {}
+            else:
+                self._collection_params.pop(collection_name, None)
+
+    def _query(self, query_vector, params, sparse_vector=None, params_key="search_params") -> dict:
+        '''
+            description: query_points arguments for a dense search, or for a hybrid search when a sparse vector is given:
+                dense and sparse candidates are prefetched and fused with reciprocal rank fusion in the same request.
+                params_key is "params" for a QueryRequest (batch search).
+        '''
+        query_vector = np.asarray(query_vector).tolist()
+        if sparse_vector is None:
+            return {"query": query_vector, params_key: params}
+        return {
+            "prefetch": [
+                models.Prefetch(query=query_vector, params=params, limit=HYBRID_PREFETCH_LIMIT),
+                models.Prefetch(query=sparse_vector, using=SPARSE_VECTOR_NAME, limit=HYBRID_PREFETCH_LIMIT),
+            ],
+            "query": models.FusionQuery(fusion=models.Fusion.RRF),
+        }
+
+    def search(self, collection_name, query_vector, limit, with_payload=True, sparse_vector=None):
+        search_results = self.client.query_points(
+            collection_name=collection_name,
+            limit=limit,
+            with_payload=with_payload,
+            **self._query(query_vector, self._params(collection_name), sparse_vector),
+        )
+        return [point for point in search_results.points]
+
+    def search_batch(self, collection_name, query_vectors, limit, with_payload=True, sparse_vectors=None):
+        sparse_vectors = sparse_vectors or [None] * len(query_vectors)
+        params = self._params(collection_name)
+        responses = self.client.query_batch_points(
+            collection_name=collection_name,
+            requests=[
+                models.QueryRequest(
+                    limit=limit,
+                    with_payload=with_payload,
+                    **self._query(vector, params, sparse_vector, params_key="params"),
+                )
+                for vector, sparse_vector in zip(query_vectors, sparse_vectors)
+            ],
+        )
+        return [[point for point in response.points] for response in responses]
+
+    def retrieve(self, collection_name, ids, with_payload=True):
+        return self.client.retrieve(
+            collection_name=collection_name,
+            ids=list(ids),
+            with_payload=with_payload,
+            with_vectors=False,
+        )
+
+    async def search_async(self, collection_name, query_vector, limit, with_payload=True, sparse_vector=None):
+        if self.async_client is None:
+            return await super().search_async(collection_name, query_vector, limit, with_payload, sparse_vector)
+        params = await self._params_async(collection_name)
+        search_results = await self.async_client.query_points(
+            collection_name=collection_name,
+            limit=limit,
+            with_payload=with_payload,
+            **self._query(query_vector, params, sparse_vector),
+        )
+        return [point for point in search_results.points]
+
+class _LoadedCollection:
+    '''
+        description: the live rows of one collection's artifacts, vectors stay memory mapped.
+    '''
+    def __init__(self, store: ArtifactStore):
+        self.store = store
+        self.distance = store.meta()["distance"]
+        if self.distance not in ("Cosine", "Dot"):
+            raise ValueError(f"in-process search supports Cosine and Dot collections, got {self.distance}")
+
+        self.shards = []
+        self.locations = {}
+        for shard, rows, ids, vectors, _ in store.iter_points():
+            # cosine scores need the row norms, computed once per shard (a vector of floats, not a copy of the matrix)
+            norms = np.linalg.norm(vectors, axis=1) if self.distance == "Cosine" else None
+            self.shards.append((shard, rows, ids, vectors, norms))
+            for position, point_id in enumerate(ids):
+                self.locations[point_id] = (shard, rows[position])
+
+    def point(self, point_id: str, score: float, with_payload):
+        shard, row = self.locations[point_id]
+        payload = _select_payload(self.store.payload(shard, row), with_payload)
+        return models.ScoredPoint(id=point_id, version=0, score=float(score), payload=payload)
+
+class NumpyVectorStore(VectorStore):
+    '''
+        description: exact search over the memory mapped artifact shards (lib/artifact_store.py),
+            scores are a matrix product between the query vectors and each shard.
+    '''
+    def __init__(self):
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def _collection(self, collection_name: str) -> _LoadedCollection:
+        with self._lock:
+            if collection_name not in self._collections:
+                self._collections[collection_name] = _LoadedCollection(ArtifactStore(collection_name))
+            return self._collections[collection_name]
+
+    def refresh(self, collection_name: str = None):
+        # drop loaded collections so the next search picks up newly written shards
+        with self._lock:
+            if collection_name is None:
+                self._collections.clear()
+            else:
+                self._collections.pop(collection_name, None)
+
+    def search(self, collection_name, query_vector, limit, with_payload=True, sparse_vector=None):
+        return self.search_batch(collection_name, [query_vector], limit, with_payload)[0]
+
+    def search_batch(self, collection_name, query_vectors, limit, with_payload=True, sparse_vectors=None):
+        collection = self._collection(collection_name)
+        queries = np.asarray(query_vectors, dtype=np.float32)
+        if collection.distance == "Cosine":
+            queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+        candidate_ids = [[] for _ in queries]
+        candidate_scores = [[] for _ in queries]
+        for shard, rows, ids, vectors, norms in collection.shards:
+            scores = vectors @ queries.T # (rows, queries)
+            if norms is not None:
+                scores = scores / norms[:, None]
+
+            k = min(limit, scores.shape[0])
+            top = np.argpartition(-scores, k - 1, axis=0)[:k]
+            for q in range(queries.shape[0]):
+                candidate_ids[q].extend(ids[i] for i in top[:, q])
+                candidate_scores[q].extend(scores[top[:, q], q])
+
+        results = []
+        for ids, scores in zip(candidate_ids, candidate_scores):
+            order = np.argsort(-np.asarray(scores))[:limit]
+            results.append([collection.point(ids[i], scores[i], with_payload) for i in order])
+        return results
+
+    def retrieve(self, collection_name, ids, with_payload=True):
+        collection = self._collection(collection_name)
+        records = []
+        for point_id in ids:
+            point_id = str(point_id)
+            if point_id in collection.locations:
+                point = collection.point(point_id, 0.0, with_payload)
+                records.append(models.Record(id=point_id, payload=point.payload))
+        return records
+
+class HnswVectorStore(NumpyVectorStore):
+    '''
+        description: approximate search with an hnsw graph built from the artifact shards.
+            the index is saved next to the shards and rebuilt when the shards or tombstones change.
+    '''
+    def __init__(self, m: int = HNSW_M, ef_construction: int = HNSW_EF_CONSTRUCTION, ef_search: int = HNSW_EF_SEARCH):
+        try:
+            import hnswlib
+        except ImportError as e:
+            raise ImportError("the hnsw vector store needs hnswlib, run `pip install hnswlib`") from e
+        super().__init__()
+        self._hnswlib = hnswlib
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self._indexes = {}
+
+    def _signature(self, store: ArtifactStore) -> str:
+        state = [store.shards(), self.m, self.ef_construction]
+        tombstones = os.path.join(store.dir_path, "tombstones.json")
+        if os.path.exists(tombstones):
+            state.append(os.path.getmtime(tombstones))
+        return hashlib.sha256(json.dumps(state).encode("utf-8")).hexdigest()
+
+    def _index(self, collection_name: str):
+        collection = self._collection(collection_name)
+        with self._lock:
+            if collection_name in self._indexes:
+                return collection, self._indexes[collection_name]
+
+            store = collection.store
+            labels = [point_id for _, _, ids, _, _ in collection.shards for point_id in ids]
+            space = "cosine" if collection.distance == "Cosine" else "ip"
+            index = self._hnswlib.Index(space=space, dim=store.meta()["size"])
+
+            index_path = os.path.join(store.dir_path, "hnsw_index.bin")
+            signature_path = os.path.join(store.dir_path, "hnsw_index.json")
+            signature = self._signature(store)
+            saved_signature = None
+            if os.path.exists(signature_path):
+                with open(signature_path, "r", encoding="utf-8") as f:
+                    saved_signature = json.load(f).get("signature")
+
+            if saved_signature == signature and os.path.exists(index_path):
+                index.load_index(index_path, max_elements=max(len(labels), 1))
+            else:
+                index.init_index(max_elements=max(len(labels), 1), ef_construction=self.ef_construction, M=self.m)
+                offset = 0
+                for _, _, ids, vectors, _ in collection.shards:
+                    index.add_items(np.asarray(vectors), np.arange(offset, offset + len(ids)))
+                    offset += len(ids)
+                index.save_index(index_path)
+                with open(signature_path, "w", encoding="utf-8") as f:
+                    json.dump({"signature": signature}, f)
+
+            index.set_ef(max(self.ef_search, 1))
+            self._indexes[collection_name] = (index, labels)
+            return collection, self._indexes[collection_name]
+
+    def refresh(self, collection_name: str = None):
+        super().refresh(collection_name)
+        with self._lock:
+            if collection_name is None:
+                self._indexes.clear()
+            else:
+                self._indexes.pop(collection_name, None)
+
+    def search_batch(self, collection_name, query_vectors, limit, with_payload=True, sparse_vectors=None):
+        collection, (index, labels) = self._index(collection_name)
+        k = min(limit, len(labels))
+        if k == 0:
+            return [[] for _ in query_vectors]
+
+        # hnsw needs ef >= k to return k neighbours
+        index.set_ef(max(self.ef_search, k))
+        neighbours, distances = index.knn_query(np.asarray(query_vectors, dtype=np.float32), k=k)
+        results = []
+        for row_labels, row_distances in zip(neighbours, distances):
+            # hnswlib returns distances (1 - similarity) for both cosine and ip
+            results.append([
+                collection.point(labels[label], 1.0 - distance, with_payload)
+                for label, distance in zip(row_labels, row_distances)
+            ])
+        return results
+
+_store = None
+_store_lock = threading.Lock()
+
+def create_vector_store(backend: str) -> VectorStore:
+    if backend == "qdrant":
+        from phase_2_pipeline.lib.qdrant_client import get_qdrant_client, get_async_qdrant_client
+        return QdrantVectorStore(get_qdrant_client(), get_async_qdrant_client())
+    if backend == "numpy":
+        return NumpyVectorStore()
+    if backend == "hnsw":
+        return HnswVectorStore()
+    raise ValueError(f"unknown vector store backend '{backend}', expected qdrant, numpy, or hnsw")
+
+def get_vector_store() -> VectorStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = create_vector_store(VECTOR_STORE_BACKEND)
+    return _store
+
+def set_vector_store(store: VectorStore = None):
+    # replaces the shared vector store, None recreates it from VECTOR_STORE_BACKEND on next use (i.e. after set_qdrant_client)
+    global _store
+    with _store_lock:
+        _store = store
+
+if __name__ == "__main__":
+    # compare backends on one collection's artifacts, stored vectors are reused as queries:
+    # python -m phase_2_pipeline.lib.vector_store <collection> [number of queries] [backends, i.e. numpy,hnsw,qdrant]
+    collection_name = sys.argv[1]
+    query_count = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    backends = sys.argv[3].split(",") if len(sys.argv) > 3 else ["numpy", "hnsw", "qdrant"]
+    limit = 50
+
+    rng = np.random.default_rng(0)
+    all_vectors = np.concatenate([np.asarray(vectors) for _, _, _, vectors, _ in ArtifactStore(collection_name).iter_points()])
+    queries = all_vectors[rng.choice(len(all_vectors), size=min(query_count, len(all_vectors)), replace=False)]
+
+    exact = None
+    for backend in backends:
+        store = create_vector_store(backend)
+        store.search(collection_name, queries[0], limit) # warm up, loads artifacts/builds index
+
+        start = time.perf_counter()
+        results = [store.search(collection_name, query, limit, with_payload=False) for query in queries]
+        latency_ms = (time.perf_counter() - start) / len(queries) * 1000
+
+        ids = [[str(point.id) for point in points] for points in results]
+        if exact is None:
+            exact = ids
+        recall = np.mean([len(set(a) & set(b)) / max(len(b), 1) for a, b in zip(ids, exact)])
+        print(f"{backend:>7}: {latency_ms:.3f} ms/query, recall@{limit} vs {backends[0]}: {recall:.3f}")
@@ -3,13 +3,22 @@ import sys
 import os
 from tqdm import tqdm
 import pprint
+from concurrent.futures import ThreadPoolExecutor
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from phase_2_pipeline.p1_query_preprocess import query_preprocess
-from phase_2_pipeline.p2_bi_encoder_rank import bi_encoder_rank
-from phase_2_pipeline.p3_cross_encoder_rerank import cross_encoder_rerank
-from phase_2_pipeline.p4_output_generation import output_generation
+from phase_2_pipeline.p1_query_preprocess import query_preprocess, query_preprocess_async
+from phase_2_pipeline.p2_bi_encoder_rank import bi_encoder_rank, bi_encoder_rank_batch, bi_encoder_rank_async
+from phase_2_pipeline.p3_cross_encoder_rerank import cross_encoder_rerank, cross_encoder_rerank_batch, cross_encoder_rerank_async
+from phase_2_pipeline.p4_output_generation import (
+    output_generation,
+    output_generation_async,
+    output_generation_stream,
+    output_generation_stream_async,
+)
+from phase_2_pipeline.lib.embedding_models import warm_up
+from phase_2_pipeline.lib.tracing import traced, current_span, propagate
+from phase_2_pipeline.lib.constants import LLM_CONCURRENCY
 from datetime import datetime
 
 # TODO change query to pass into pipeline for unit testing
@@ -19,6 +28,7 @@ QUERIES = [
 ]
 
 # function called by phase_2_pipeline to run automated evals
+@traced("pipeline")
 def run_pipeline(query) -> str:
     '''
         description: takes raw user query and runs our RAG pipeline. 
@@ -34,7 +44,84 @@ def run_pipeline(query) -> str:
 
     return final_output
 
+@traced("pipeline")
+async def run_pipeline_async(query) -> str:
+    '''
+        description: async version of run_pipeline. network calls (gemini, qdrant) are awaited and
+            embedding/reranking run on executor threads, so one process can keep many queries in flight,
+            i.e. await asyncio.gather(*(run_pipeline_async(q) for q in queries))
+
+        input: raw user query.
+        output: same as run_pipeline.
+    '''
+
+    padded_query = await query_preprocess_async(query)
+    initial_ranking = await bi_encoder_rank_async(padded_query)
+    final_rank = await cross_encoder_rerank_async(initial_ranking, padded_query)
+    final_output = await output_generation_async(final_rank, padded_query["query"])
+
+    return final_output
+
+@traced("pipeline", stream=True)
+def run_pipeline_stream(query):
+    '''
+        description: streaming version of run_pipeline, the answer is yielded as the llm generates it
+            instead of after the full response is done.
+
+        input: raw user query.
+        output: generator of events, see p4_output_generation.output_generation_stream
+            ("chunks" first, then "token" pieces, then "done" with the full answer and generation timings).
+    '''
+
+    padded_query = query_preprocess(query)
+    initial_ranking = bi_encoder_rank(padded_query)
+    final_rank = cross_encoder_rerank(initial_ranking, padded_query)
+    yield from output_generation_stream(final_rank, padded_query["query"])
+
+@traced("pipeline", stream=True)
+async def run_pipeline_stream_async(query):
+    '''
+        description: async iterator version of run_pipeline_stream, i.e. async for event in run_pipeline_stream_async(query)
+
+        input: raw user query.
+        output: async generator of events, same as run_pipeline_stream.
+    '''
+
+    padded_query = await query_preprocess_async(query)
+    initial_ranking = await bi_encoder_rank_async(padded_query)
+    final_rank = await cross_encoder_rerank_async(initial_ranking, padded_query)
+    async for event in output_generation_stream_async(final_rank, padded_query["query"]):
+        yield event
+
+@traced("pipeline_batch")
+def run_pipeline_batch(queries: list) -> list:
+    '''
+        description: runs our RAG pipeline over many raw user queries at once.
+            - llm calls (preprocess, output generation) run concurrently, up to LLM_CONCURRENCY at a time
+            - all queries are embedded, searched, and reranked in batched calls
+
+        input: list of raw user queries.
+        output: list of final outputs (same format as run_pipeline), in the same order as the queries.
+    '''
+    if not queries:
+        return []
+    current_span().set_attribute("queries", len(queries))
+
+    with ThreadPoolExecutor(max_workers=min(LLM_CONCURRENCY, len(queries))) as pool:
+        padded_queries = list(pool.map(propagate(query_preprocess), queries))
+        initial_rankings = bi_encoder_rank_batch(padded_queries)
+        final_ranks = cross_encoder_rerank_batch(initial_rankings, padded_queries)
+        final_outputs = list(pool.map(
+            propagate(output_generation),
+            final_ranks,
+            [padded_query["query"] for padded_query in padded_queries],
+        ))
+
+    return final_outputs
+
 if __name__ == "__main__":
+    print(f"models loaded: {warm_up()}")
+
     output_dir = os.path.join(os.path.dirname(__file__), "results")
     os.makedirs(output_dir, exist_ok=True)
     file_name = datetime.now().strftime("%Y%m%d_%H%M%S") + "_phase2_results.txt"
@@ -1,11 +1,27 @@
 # query preprocess module
 from pydantic import BaseModel, Field
+import hashlib
 import json
 import os
 import sys
+import threading
+import asyncio
+import time
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from phase_2_pipeline.lib.gemini_client import get_gemini_client
+from phase_2_pipeline.lib.gemini_client import get_gemini_client, get_async_gemini_client
+from phase_2_pipeline.lib.cache_store import TieredCache
+from phase_2_pipeline.lib.collection_router import get_collection_router
+from phase_2_pipeline.lib.tracing import traced, span, current_span, propagate
+from phase_2_pipeline.lib.metrics import record_llm_usage
+from phase_2_pipeline.lib.constants import (
+    CACHE_DIR,
+    ROUTER_ENABLED,
+    PREPROCESS_CACHE_VERSION,
+    PREPROCESS_CACHE_TTL,
+    PREPROCESS_CACHE_MAX_ENTRIES,
+    PREPROCESS_CACHE_MEMORY_SIZE,
+)
 
 class ProcessedQuery(BaseModel):
     query: str = Field(description="query with additional information using original query.")
@@ -41,36 +57,151 @@ phone_data: 1. Apple manuals, specs, downloads (HTML): https://support.apple.com
 Return me a JSON object with "query" which is the improved query you make using their original query and another key "collection" for which collection to read from.
 '''
 
+MODEL_NAME = "gemini-2.5-flash-lite"
+
+def _build_contents(raw_user_query: str) -> list:
+    return [
+        {"role": "model", "parts": [{"text":SYS_PROMPT}]},
+        {"role": "user", "parts": [{"text":raw_user_query}]},
+    ]
+
+GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_json_schema": ProcessedQuery.model_json_schema(),
+}
+
+def _report_token_metrics(raw_user_query: str, response, start: float):
+    # in memory counters, written to METRICS_PATH in the background (see lib/metrics.py)
+    record_llm_usage("query_preprocess", MODEL_NAME, response, (time.perf_counter() - start) * 1000, query=raw_user_query)
+    current_span().set_attributes(
+        prompt_tokens=response.usage_metadata.prompt_token_count,
+        output_tokens=response.usage_metadata.candidates_token_count,
+    )
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_preprocess_cache() -> TieredCache:
+    '''
+        description: cache of query rewrites (ProcessedQuery dicts as json), in memory and on disk.
+    '''
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = TieredCache(
+                    os.path.join(CACHE_DIR, "query_preprocess.sqlite"),
+                    "processed_queries",
+                    PREPROCESS_CACHE_MEMORY_SIZE,
+                    ttl_seconds=PREPROCESS_CACHE_TTL,
+                    max_entries=PREPROCESS_CACHE_MAX_ENTRIES,
+                )
+    return _cache
+
+def _cache_key(raw_user_query: str) -> str:
+    # any change to the prompt, model, or cache version produces new keys, so stale rewrites are never served
+    key_parts = [str(PREPROCESS_CACHE_VERSION), MODEL_NAME, SYS_PROMPT, raw_user_query]
+    return hashlib.sha256("\0".join(key_parts).encode("utf-8")).hexdigest()
+
+def _get_cached(raw_user_query: str):
+    cached = get_preprocess_cache().get(_cache_key(raw_user_query))
+    return None if cached is None else json.loads(cached)
+
+def _put_cached(raw_user_query: str, query_dict: dict):
+    get_preprocess_cache().put(_cache_key(raw_user_query), json.dumps(query_dict).encode("utf-8"))
+
+def _route_locally(raw_user_query: str):
+    '''
+        description: picks the collection with the local centroid router, the raw query is used as is.
+
+        output: processed query dict, or None when the router is disabled/unavailable or the query is ambiguous
+    '''
+    if not ROUTER_ENABLED:
+        return None
+    router = get_collection_router()
+    if router is None:
+        return None
+    with span("route", router="centroid") as route_span:
+        collection = router.route_query(raw_user_query)
+        route_span.set_attribute("routed", collection is not None)
+    if collection is None:
+        return None
+    return {"query": raw_user_query, "collection": collection}
+
+@traced("query_preprocess")
 def query_preprocess(raw_user_query: str) -> str:
     '''
         description: takes raw user query and adds information using LLM to potentially make the query better and help the RAG downstream.
+            queries that were already rewritten are served from the preprocess cache without calling the LLM.
+            queries the local collection router is confident about skip the LLM and keep their original wording.
 
         input: raw user query.
         output: processed user query.
     '''
+    query_dict = _get_cached(raw_user_query)
+    if query_dict is not None:
+        current_span().set_attributes(source="cache", collection=query_dict["collection"])
+        return query_dict
+
+    query_dict = _route_locally(raw_user_query)
+    if query_dict is not None:
+        current_span().set_attributes(source="router", collection=query_dict["collection"])
+        return query_dict
+
     client = get_gemini_client()
 
-    response = client.models.generate_content(
-        model="gemini-2.5-flash-lite",
-        contents=[
-            {"role": "model", "parts": [{"text":SYS_PROMPT}]},
-            {"role": "user", "parts": [{"text":raw_user_query}]},
-        ],
-        config={
-            "response_mime_type": "application/json",
-            "response_json_schema": ProcessedQuery.model_json_schema(),
-        },
-    )
+    with span("llm", model=MODEL_NAME):
+        start = time.perf_counter()
+        response = client.models.generate_content(
+            model=MODEL_NAME,
+            contents=_build_contents(raw_user_query),
+            config=GENERATION_CONFIG,
+        )
+
+        # report token metrics
+        _report_token_metrics(raw_user_query, response, start)
+
+    query_dict = json.loads(response.text)
+    current_span().set_attributes(source="llm", collection=query_dict["collection"])
+    _put_cached(raw_user_query, query_dict)
+    return query_dict
 
-    # report token metrics
-    with open("eval/out/token_cost.txt", "a") as f:
-        f.write("-" * 40 + "\n")
-        f.write(f"prompt: {raw_user_query}\n")
-        f.write(f"query preprocess prompt tokens: {response.usage_metadata.prompt_token_count}\n")
-        f.write(f"query preprocess output tokens: {response.usage_metadata.candidates_token_count}\n")
-        f.write("\n")
+@traced("query_preprocess")
+async def query_preprocess_async(raw_user_query: str) -> str:
+    '''
+        description: async version of query_preprocess, awaits the gemini call instead of blocking on it.
+
+        input: raw user query.
+        output: processed user query.
+    '''
+    query_dict = _get_cached(raw_user_query)
+    if query_dict is not None:
+        current_span().set_attributes(source="cache", collection=query_dict["collection"])
+        return query_dict
+
+    # routing embeds the query, keep the onnx inference off the event loop
+    loop = asyncio.get_running_loop()
+    query_dict = await loop.run_in_executor(None, propagate(_route_locally), raw_user_query)
+    if query_dict is not None:
+        current_span().set_attributes(source="router", collection=query_dict["collection"])
+        return query_dict
+
+    client = get_async_gemini_client()
+
+    with span("llm", model=MODEL_NAME):
+        start = time.perf_counter()
+        response = await client.models.generate_content(
+            model=MODEL_NAME,
+            contents=_build_contents(raw_user_query),
+            config=GENERATION_CONFIG,
+        )
+
+        # report token metrics
+        _report_token_metrics(raw_user_query, response, start)
 
     query_dict = json.loads(response.text)
+    current_span().set_attributes(source="llm", collection=query_dict["collection"])
+    _put_cached(raw_user_query, query_dict)
     return query_dict
 
 if __name__ == "__main__":
@@ -1,12 +1,25 @@
 # run bi encoder and do initial similarity search for candidate chunks
 import sys
 import os
+import asyncio
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from phase_2_pipeline.lib.embedding_models import bi_encoder_model
-from phase_2_pipeline.lib.qdrant_client import get_qdrant_client
-from phase_2_pipeline.lib.constants import RESULTS_COUNT
+from phase_2_pipeline.lib.vector_store import get_vector_store
+from phase_2_pipeline.lib.embedding_cache import get_query_embedding_cache
+from phase_2_pipeline.lib.sparse_vectors import embed_sparse_queries
+from phase_2_pipeline.lib.tracing import traced, span, current_span, propagate
+from phase_2_pipeline.lib.constants import (
+    RESULTS_COUNT,
+    VECTOR_STORE_BACKEND,
+    EMBEDDING_MODEL_NAME,
+    HYBRID_SEARCH,
+    LLM_CHUNKS,
+    RERANK_FIELD,
+    LAZY_PAYLOAD,
+    CANDIDATE_PAYLOAD_FIELDS,
+)
 
 # TODO modify prompt to run unit test
 PROCESSED_QUERY = {
@@ -14,29 +27,153 @@ PROCESSED_QUERY = {
     "collection": "production_data"
 }
 
+@traced("embed_query")
+def embed_queries(queries: list) -> list:
+    # repeated queries are served from the embedding cache, only new ones go through the bi encoder
+    current_span().set_attribute("queries", len(queries))
+    return get_query_embedding_cache().embed(EMBEDDING_MODEL_NAME, bi_encoder_model, queries)
+
+def candidate_payload_fields():
+    # candidates only need the fields used to rerank and report them, "text" (often a whole page) is fetched later
+    # for the final chunks only, see load_chunk_text
+    if not LAZY_PAYLOAD:
+        return True
+    return list(dict.fromkeys(CANDIDATE_PAYLOAD_FIELDS + [RERANK_FIELD]))
+
+@traced("load_chunk_text")
+def load_chunk_text(ranked_lists: list, collections: list, count: int = LLM_CHUNKS) -> list:
+    '''
+        description: adds the "text" payload field to the top `count` chunks of each ranked list that do not have it yet,
+            with one batched retrieve per collection.
+
+        input: ranked lists of (ScoredPoint, score) tuples (from the cross encoder step), the collection of each list
+        output: the same ranked lists, payloads updated in place. chunks whose id the store no longer has (i.e. deleted
+            between search and retrieve) are left without text and counted in the span's "not_found" attribute
+    '''
+    missing = {}
+    for ranked, collection in zip(ranked_lists, collections):
+        for item, _ in ranked[:count]:
+            if not item.payload or "text" not in item.payload:
+                missing.setdefault(collection, []).append(item)
+
+    current_span().set_attribute("chunks", sum(len(items) for items in missing.values()))
+    vector_store = get_vector_store()
+    not_found = 0
+    for collection, items in missing.items():
+        records = vector_store.retrieve(collection, list({item.id: None for item in items}), with_payload=["text"])
+        texts = {str(record.id): (record.payload or {}).get("text") for record in records}
+        collection_not_found = []
+        for item in items:
+            if texts.get(str(item.id)) is not None:
+                item.payload = {**(item.payload or {}), "text": texts[str(item.id)]}
+            else:
+                collection_not_found.append(str(item.id))
+        if collection_not_found:
+            print(f"no text found in '{collection}' for {len(collection_not_found)} chunks: {collection_not_found}")
+            not_found += len(collection_not_found)
+
+    current_span().set_attribute("not_found", not_found)
+    return ranked_lists
+
+def sparse_queries(queries: list):
+    # bm25 query vectors for hybrid search, None searches dense vectors only
+    if not HYBRID_SEARCH:
+        return None
+    with span("embed_sparse_query", queries=len(queries)):
+        return embed_sparse_queries(queries)
+
+def _search_span(collection: str, queries: int = 1):
+    return span("vector_search", collection=collection, backend=VECTOR_STORE_BACKEND, hybrid=HYBRID_SEARCH, queries=queries)
+
 # TODO determine what format to give initial rank
+@traced("bi_encoder_rank")
 def bi_encoder_rank(processed_user_query: dict) -> dict:
     '''
         description: Given a processed user query, use a bi-encoder model to find and rank relevant document chunks based on similarity.
             - vectorizes query
-            - make inference request to qdrant
+            - make inference request to qdrant (with HYBRID_SEARCH, dense and bm25 results fused with rrf in the same request)
             - return formatted qdrant response
 
         input: {"query": processed from previous preprocessing step, "collection": what collection to take data from} (dict)
         output: qdrant response in format (TODO)
     '''
-    embedding_model = bi_encoder_model()
-    client = get_qdrant_client()
+    vector_store = get_vector_store()
+
+    query_vector = embed_queries([processed_user_query['query']])[0]
+    sparse_vectors = sparse_queries([processed_user_query['query']])
+    with _search_span(processed_user_query['collection']) as search_span:
+        points = vector_store.search(
+            collection_name=processed_user_query['collection'],
+            query_vector=query_vector,
+            limit=RESULTS_COUNT,
+            with_payload=candidate_payload_fields(),
+            sparse_vector=sparse_vectors[0] if sparse_vectors else None,
+        )
+        search_span.set_attribute("candidates", len(points))
+    return points
+
+@traced("bi_encoder_rank")
+async def bi_encoder_rank_async(processed_user_query: dict) -> dict:
+    '''
+        description: async version of bi_encoder_rank.
+            - vectorizes query (or reads it from the embedding cache) on an executor thread so the event loop is not blocked by onnx inference
+            - awaits the search (async qdrant client, or an executor thread for in-process vector stores)
+
+        input: {"query": processed from previous preprocessing step, "collection": what collection to take data from} (dict)
+        output: list of ScoredPoint objs
+    '''
+    vector_store = get_vector_store()
+
+    loop = asyncio.get_running_loop()
+    query_vector = (await loop.run_in_executor(None, propagate(embed_queries), [processed_user_query['query']]))[0]
+    sparse_vectors = await loop.run_in_executor(None, propagate(sparse_queries), [processed_user_query['query']])
+    with _search_span(processed_user_query['collection']) as search_span:
+        points = await vector_store.search_async(
+            collection_name=processed_user_query['collection'],
+            query_vector=query_vector,
+            limit=RESULTS_COUNT,
+            with_payload=candidate_payload_fields(),
+            sparse_vector=sparse_vectors[0] if sparse_vectors else None,
+        )
+        search_span.set_attribute("candidates", len(points))
+    return points
+
+@traced("bi_encoder_rank")
+def bi_encoder_rank_batch(processed_user_queries: list) -> list:
+    '''
+        description: batched version of bi_encoder_rank for many queries at once.
+            - vectorizes all queries in a single embed call
+            - groups queries by collection and sends one batch search per collection (query_batch_points on qdrant)
+            - returns candidates per query in the same order as the input
+
+        input: list of {"query": ..., "collection": ...} dicts
+        output: list of candidate lists (ScoredPoint objs), one per query
+    '''
+    vector_store = get_vector_store()
+
+    query_vectors = embed_queries([item['query'] for item in processed_user_queries])
+    sparse_vectors = sparse_queries([item['query'] for item in processed_user_queries])
+
+    # batch searches are scoped to a single collection
+    queries_by_collection = {}
+    for i, item in enumerate(processed_user_queries):
+        queries_by_collection.setdefault(item['collection'], []).append(i)
 
-    query_vector = next(embedding_model.embed([processed_user_query['query']]))
-    search_results = client.query_points(
-        collection_name=processed_user_query['collection'],
-        query=query_vector.tolist(),
-        limit=RESULTS_COUNT,   
-        with_payload=True 
-    )
+    results = [None] * len(processed_user_queries)
+    for collection, indices in queries_by_collection.items():
+        with _search_span(collection, len(indices)) as search_span:
+            responses = vector_store.search_batch(
+                collection_name=collection,
+                query_vectors=[query_vectors[i] for i in indices],
+                limit=RESULTS_COUNT,
+                with_payload=candidate_payload_fields(),
+                sparse_vectors=[sparse_vectors[i] for i in indices] if sparse_vectors else None,
+            )
+            search_span.set_attribute("candidates", sum(len(points) for points in responses))
+        for i, points in zip(indices, responses):
+            results[i] = points
 
-    return [point for point in search_results.points]
+    return results
 
 if __name__ == "__main__":
     # print(bi_encoder_rank(PROCESSED_QUERY))
@@ -1,13 +1,27 @@
 # cross encoder rerank for initial candidate chunks
 import os
 import sys
+import asyncio
+import threading
 from pprint import pprint
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from phase_2_pipeline.p2_bi_encoder_rank import bi_encoder_rank
-from phase_2_pipeline.lib.embedding_models import cross_encoder_model
-from phase_2_pipeline.lib.constants import FINAL_COUNT
+from phase_2_pipeline.p2_bi_encoder_rank import bi_encoder_rank, load_chunk_text
+from phase_2_pipeline.lib.rerank_cache import get_rerank_cache
+from phase_2_pipeline.lib.rerank_engine import get_rerank_engine
+from phase_2_pipeline.lib.tracing import traced, span, current_span, propagate
+from phase_2_pipeline.lib.constants import (
+    FINAL_COUNT,
+    LLM_CHUNKS,
+    RERANKER_MODEL_NAME,
+    RERANK_FIELD,
+    RERANK_MAX_TOKENS,
+    RERANK_CASCADE,
+    RERANK_FIRST_TRANCHE,
+    RERANK_TRANCHE_SIZE,
+    RERANK_SKIP_MARGIN,
+)
 
 # TODO modify prompt to run unit test
 PROCESSED_QUERY = {
@@ -15,35 +29,246 @@ PROCESSED_QUERY = {
     "collection": "production_data"
 }
 
-''' try cross encoder with multiple options:
+''' try cross encoder with multiple options (RERANK_FIELD in lib/constants.py):
 - summary
 - keywords
 - raw text
+- source_file
 '''
 
+def _rerank_text(item, field: str = RERANK_FIELD) -> str:
+    value = item.payload.get(field)
+    if isinstance(value, list):
+        # keywords are stored as a list
+        return ", ".join(str(keyword) for keyword in value)
+    return value or ""  # Use empty string if the field is not present
+
+def _score_pairs(pairs: list) -> list:
+    # scores for (query, candidate text) pairs seen before come from the rerank cache, only new pairs go through the cross encoder.
+    # the token budget changes scores, so it is part of the cache key
+    with span("cross_encoder", pairs=len(pairs)):
+        return get_rerank_cache().score(f"{RERANKER_MODEL_NAME}:{RERANK_MAX_TOKENS}", get_rerank_engine, pairs)
+
+def _rank_by_scores(initial_chunks: list, scores: list) -> list:
+    scored_summaries = list(zip(initial_chunks, scores))
+    scored_summaries.sort(key=lambda x: x[1], reverse=True)
+    # Return the sorted summaries and their scores
+    return scored_summaries[:FINAL_COUNT]
+
+_stats_lock = threading.Lock()
+_totals = {"queries": 0, "candidates": 0, "pairs_scored": 0, "margin_skips": 0, "early_exits": 0}
+
+def _record_stats(stats_list: list):
+    with _stats_lock:
+        for stats in stats_list:
+            _totals["queries"] += 1
+            _totals["candidates"] += stats["candidates"]
+            _totals["pairs_scored"] += stats["pairs_scored"]
+            _totals["margin_skips"] += stats["exit"] == "margin"
+            _totals["early_exits"] += stats["exit"] == "stable"
+
+def get_rerank_stats() -> dict:
+    '''
+        output: totals over every query reranked in this process, pairs_scored / candidates is the share of
+            cross encoder work actually done (pairs served by the rerank cache still count as scored)
+    '''
+    with _stats_lock:
+        totals = dict(_totals)
+    totals["scored_fraction"] = round(totals["pairs_scored"] / totals["candidates"], 3) if totals["candidates"] else 0.0
+    return totals
+
+def _decisive_margin(initial_chunks: list, skip_margin: float = RERANK_SKIP_MARGIN) -> bool:
+    # heuristic: a large bi encoder gap right below the cut is taken as a sign the cross encoder would keep the same
+    # chunks. it can still promote any of the later candidates, and the kept chunks stay in bi encoder order
+    if skip_margin is None or len(initial_chunks) <= FINAL_COUNT:
+        return False
+    return initial_chunks[FINAL_COUNT - 1].score - initial_chunks[FINAL_COUNT].score >= skip_margin
+
+def _top_ids(ranked: list) -> list:
+    return [item.id for item, _ in ranked]
+
+def _rerank_cascade(initial_chunks_list: list, processed_queries: list, skip_margin: float = RERANK_SKIP_MARGIN) -> tuple:
+    '''
+        description: adaptive rerank for many queries at once.
+            - queries with a decisive bi encoder margin at FINAL_COUNT keep their bi encoder order, nothing is scored
+            - the other queries score their best RERANK_FIRST_TRANCHE candidates, then RERANK_TRANCHE_SIZE more per round
+            - a query stops once a round leaves its top FINAL_COUNT unchanged, or when it runs out of candidates
+            both exits are approximations of scoring every candidate: unscored candidates could still rank higher
+            - every round scores the pending pairs of all active queries in one batched call
+
+        output: (reranked chunks per query, stats per query)
+    '''
+    results = [None] * len(initial_chunks_list)
+    stats = []
+    scores = []
+    active = []
+    for i, initial_chunks in enumerate(initial_chunks_list):
+        stats.append({"candidates": len(initial_chunks), "pairs_scored": 0, "tranches": 0, "exit": "exhausted"})
+        scores.append([])
+        if _decisive_margin(initial_chunks, skip_margin):
+            # scores stay on the bi encoder scale for these queries
+            results[i] = [(item, item.score) for item in initial_chunks[:FINAL_COUNT]]
+            stats[i]["exit"] = "margin"
+        else:
+            active.append(i)
+
+    while active:
+        pairs = []
+        spans = []
+        for i in active:
+            scored = len(scores[i])
+            tranche = RERANK_FIRST_TRANCHE if scored == 0 else RERANK_TRANCHE_SIZE
+            tranche_chunks = initial_chunks_list[i][scored:scored + tranche]
+            pairs.extend((processed_queries[i]['query'], _rerank_text(item)) for item in tranche_chunks)
+            spans.append((i, len(tranche_chunks)))
+
+        new_scores = _score_pairs(pairs)
+
+        still_active = []
+        offset = 0
+        for i, count in spans:
+            initial_chunks = initial_chunks_list[i]
+            previous = results[i]
+            scores[i].extend(new_scores[offset:offset + count])
+            offset += count
+
+            scored = len(scores[i])
+            results[i] = _rank_by_scores(initial_chunks[:scored], scores[i])
+            stats[i]["pairs_scored"] = scored
+            stats[i]["tranches"] += 1
+
+            if scored >= len(initial_chunks):
+                continue
+            if previous is not None and _top_ids(previous) == _top_ids(results[i]):
+                stats[i]["exit"] = "stable"
+                continue
+            still_active.append(i)
+        active = still_active
+
+    return results, stats
+
+def _rerank_full(initial_chunks_list: list, processed_queries: list) -> tuple:
+    # scores every candidate of every query in one batched call
+    pairs = []
+    for initial_chunks, processed_query in zip(initial_chunks_list, processed_queries):
+        for item in initial_chunks:
+            pairs.append((processed_query['query'], _rerank_text(item)))
+
+    scores = _score_pairs(pairs)
+
+    results = []
+    offset = 0
+    for initial_chunks in initial_chunks_list:
+        results.append(_rank_by_scores(initial_chunks, scores[offset:offset + len(initial_chunks)]))
+        offset += len(initial_chunks)
+
+    stats = [
+        {"candidates": len(initial_chunks), "pairs_scored": len(initial_chunks), "tranches": 1, "exit": "exhausted"}
+        for initial_chunks in initial_chunks_list
+    ]
+    return results, stats
+
+def compare_with_full_rerank(initial_chunks_list: list, processed_queries: list, skip_margin: float = 0.1) -> dict:
+    '''
+        description: measures how far the cascade (with skip_margin as RERANK_SKIP_MARGIN, None for the cascade alone)
+            drifts from scoring every candidate. run it on real queries before turning RERANK_CASCADE or RERANK_SKIP_MARGIN on.
+            nothing is added to get_rerank_stats, the full pass reuses the cascade's scores from the rerank cache.
+
+        output: {"queries", "recall_at_final" (share of the full top FINAL_COUNT the cascade also keeps),
+            "llm_chunks_match" (share of queries whose top LLM_CHUNKS are identical and in the same order),
+            "scored_fraction", "margin_skips", "early_exits"}
+    '''
+    approx, stats = _rerank_cascade(initial_chunks_list, processed_queries, skip_margin)
+    full, _ = _rerank_full(initial_chunks_list, processed_queries)
+
+    recalls = []
+    matches = 0
+    for approx_ranked, full_ranked in zip(approx, full):
+        full_ids = _top_ids(full_ranked)
+        approx_ids = _top_ids(approx_ranked)
+        recalls.append(len(set(full_ids) & set(approx_ids)) / len(full_ids) if full_ids else 1.0)
+        matches += approx_ids[:LLM_CHUNKS] == full_ids[:LLM_CHUNKS]
+
+    queries = len(initial_chunks_list)
+    candidates = sum(item["candidates"] for item in stats)
+    return {
+        "queries": queries,
+        "recall_at_final": round(sum(recalls) / queries, 3) if queries else None,
+        "llm_chunks_match": round(matches / queries, 3) if queries else None,
+        "scored_fraction": round(sum(item["pairs_scored"] for item in stats) / candidates, 3) if candidates else 0.0,
+        "margin_skips": sum(item["exit"] == "margin" for item in stats),
+        "early_exits": sum(item["exit"] == "stable" for item in stats),
+    }
+
+@traced("rerank")
+def _rerank(initial_chunks_list: list, processed_queries: list) -> tuple:
+    '''
+        description: reranks the candidates of many queries, then fetches the text of the top LLM_CHUNKS chunks
+            (candidates only carry the payload fields needed to rerank them, see p2_bi_encoder_rank.candidate_payload_fields).
+
+        output: (reranked chunks per query, stats per query)
+    '''
+    if RERANK_CASCADE:
+        results, stats = _rerank_cascade(initial_chunks_list, processed_queries)
+    else:
+        results, stats = _rerank_full(initial_chunks_list, processed_queries)
+    _record_stats(stats)
+
+    current_span().set_attributes(
+        candidates=sum(item["candidates"] for item in stats),
+        pairs_scored=sum(item["pairs_scored"] for item in stats),
+        exits=[item["exit"] for item in stats],
+    )
+    load_chunk_text(results, [processed_query['collection'] for processed_query in processed_queries])
+    return results, stats
+
+def cross_encoder_rerank_with_stats(initial_chunks: list, processed_query: dict) -> tuple:
+    '''
+        description: cross_encoder_rerank that also reports how much reranking was done for the query.
+
+        input: initial_chunks, candidate chunks from bi-encoder step as a list of ScorePoint objs
+        output: (reranked chunks, {"candidates", "pairs_scored", "tranches", "exit"}) where exit is
+            "margin" (skipped), "stable" (stopped early), or "exhausted" (every candidate scored)
+    '''
+    results, stats = _rerank([initial_chunks], [processed_query])
+    return results[0], stats[0]
+
 def cross_encoder_rerank(initial_chunks: list, processed_query: str) -> dict:
     '''
         description: Given initial candidate chunks from bi-encoder, use a cross-encoder model to rerank them for better relevance.
             - use cross encoder to embed query and chunk summaries
             - use cross encoder scores to rerank initial chunks
+            - with RERANK_CASCADE, candidates are scored in tranches and only until the top FINAL_COUNT stops changing
+            - text of the top LLM_CHUNKS chunks is fetched in one batched retrieve
 
         input: initial_chunks, candidate chunks from bi-encoder step as a list of ScorePoint objs
         output: reranked chunks in 
     '''
-    cross_encoder = cross_encoder_model()
+    return cross_encoder_rerank_with_stats(initial_chunks, processed_query)[0]
 
-    initial_chunk_summaries = []
-    for item in initial_chunks:
-        # qdrant_ids.append(point.id)
-        initial_chunk_summaries.append(item.payload.get("source_file"))  # Use empty string if "summary" not present
+async def cross_encoder_rerank_async(initial_chunks: list, processed_query: str) -> dict:
+    '''
+        description: async version of cross_encoder_rerank, runs the cpu bound rerank on an executor thread.
 
-    score = cross_encoder.rerank(processed_query['query'], initial_chunk_summaries)
-    scores = [i for i in score]
+        input: initial_chunks, candidate chunks from bi-encoder step as a list of ScorePoint objs
+        output: reranked chunks (same format as cross_encoder_rerank)
+    '''
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, propagate(cross_encoder_rerank), initial_chunks, processed_query)
 
-    scored_summaries = list(zip(initial_chunks, scores))
-    scored_summaries.sort(key=lambda x: x[1], reverse=True)
-    # Return the sorted summaries and their scores
-    return scored_summaries[:FINAL_COUNT]
+def cross_encoder_rerank_batch(initial_chunks_list: list, processed_queries: list) -> list:
+    '''
+        description: batched version of cross_encoder_rerank for many queries at once.
+            - flattens every (query, candidate) pair across all queries
+            - scores all pairs not in the rerank cache with batched cross encoder calls
+            - splits scores back per query and reranks each candidate list
+            - with RERANK_CASCADE, each round only flattens the next tranche of the queries still changing
+            - text of every query's top LLM_CHUNKS chunks is fetched with one retrieve per collection
+
+        input: initial_chunks_list, one candidate list per query (from bi_encoder_rank_batch), processed_queries in the same order
+        output: list of reranked chunks, one per query
+    '''
+    return _rerank(initial_chunks_list, processed_queries)[0]
 
 if __name__ == "__main__":
     # call bi_encoder_rank to get initial candidate chunks
@@ -1,12 +1,15 @@
 # final output generation given final chunks
 import os
 import sys
+import time
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from phase_2_pipeline.p2_bi_encoder_rank import bi_encoder_rank
 from phase_2_pipeline.p3_cross_encoder_rerank import cross_encoder_rerank
-from phase_2_pipeline.lib.gemini_client import get_gemini_client
+from phase_2_pipeline.lib.gemini_client import get_gemini_client, get_async_gemini_client
+from phase_2_pipeline.lib.tracing import traced, current_span
+from phase_2_pipeline.lib.metrics import record_llm_usage
 from phase_2_pipeline.lib.constants import LLM_CHUNKS
 
 SYS_PROMPT = '''You are tasked with generating the final response in a RAG system.
@@ -21,24 +24,25 @@ PROCESSED_QUERY = {
     "collection": "production_data",
 }
 
-# uses top 5 chunks for final llm response generation
-def output_generation(final_chunks: list, query) -> str:
-    '''
-        description: simple function to make api call to LLM to generate final output based on reranked chunks.
+MODEL_NAME = "gemini-2.0-flash-lite"
 
-        input: final_chunks, reranked chunks from cross-encoder step
-        output: final response (str)
+def _build_prompt(final_chunks: list, query):
     '''
-    client = get_gemini_client()
+        description: builds the llm prompt from the top LLM_CHUNKS chunks, chunks without text (see load_chunk_text) are left out.
 
+        output: (prompt contents for gemini, list of all final chunks)
+    '''
     chunk_text = []
     chunk_list = []
     chunk_count = 0
     for chunk in final_chunks:
         chunk_list.append(chunk[0])
         if chunk_count < LLM_CHUNKS:
-            chunk_text.append(chunk[0].payload.get("text")[:800]) # TODO change to text once data is uploaded
+            text = (chunk[0].payload or {}).get("text") or ""
+            if text:
+                chunk_text.append(text[:800]) # TODO change to text once data is uploaded
         chunk_count += 1
+    current_span().set_attribute("context_chunks", len(chunk_text))
 
     query_for_llm = """<user_query>
     {query}
@@ -53,22 +57,148 @@ def output_generation(final_chunks: list, query) -> str:
         f.write(GEMINI_API_KEY)
     '''
 
+    contents = [
+        {"role": "model", "parts": [{"text":SYS_PROMPT}]},
+        {"role": "user", "parts": [{"text":query_for_llm}]},
+    ]
+    return contents, chunk_list
+
+def _report_token_metrics(response, start: float):
+    # in memory counters, written to METRICS_PATH in the background (see lib/metrics.py)
+    record_llm_usage("output_generation", MODEL_NAME, response, (time.perf_counter() - start) * 1000)
+    current_span().set_attributes(
+        prompt_tokens=response.usage_metadata.prompt_token_count,
+        output_tokens=response.usage_metadata.candidates_token_count,
+    )
+
+# uses top 5 chunks for final llm response generation
+@traced("output_generation", model=MODEL_NAME)
+def output_generation(final_chunks: list, query) -> str:
+    '''
+        description: simple function to make api call to LLM to generate final output based on reranked chunks.
+
+        input: final_chunks, reranked chunks from cross-encoder step
+        output: final response (str)
+    '''
+    client = get_gemini_client()
+
+    contents, chunk_list = _build_prompt(final_chunks, query)
+    start = time.perf_counter()
     response = client.models.generate_content(
-        model="gemini-2.0-flash-lite",
-        contents=[
-            {"role": "model", "parts": [{"text":SYS_PROMPT}]},
-            {"role": "user", "parts": [{"text":query_for_llm}]},
-        ],
+        model=MODEL_NAME,
+        contents=contents,
     )
 
     # report token metrics
-    with open("eval/out/token_cost.txt", "a") as f: 
-        f.write(f"llm generation prompt tokens: {response.usage_metadata.prompt_token_count}\n")
-        f.write(f"llm generation output tokens: {response.usage_metadata.candidates_token_count}\n")
+    _report_token_metrics(response, start)
 
     return response.text, chunk_list
     # return "hi", [chunk[0] for chunk in final_chunks]
 
+@traced("output_generation", model=MODEL_NAME)
+async def output_generation_async(final_chunks: list, query) -> str:
+    '''
+        description: async version of output_generation, awaits the gemini call instead of blocking on it.
+
+        input: final_chunks, reranked chunks from cross-encoder step
+        output: final response (str), list of final chunks
+    '''
+    client = get_async_gemini_client()
+
+    contents, chunk_list = _build_prompt(final_chunks, query)
+    start = time.perf_counter()
+    response = await client.models.generate_content(
+        model=MODEL_NAME,
+        contents=contents,
+    )
+
+    # report token metrics
+    _report_token_metrics(response, start)
+
+    return response.text, chunk_list
+
+def _stream_done_event(text_parts: list, start: float, first_token_at: float) -> dict:
+    end = time.perf_counter()
+    event = {
+        "type": "done",
+        "text": "".join(text_parts),
+        "time_to_first_token_s": None if first_token_at is None else round(first_token_at - start, 3),
+        "generation_time_s": round(end - start, 3),
+    }
+    current_span().set_attribute("time_to_first_token_s", event["time_to_first_token_s"])
+    return event
+
+@traced("output_generation", model=MODEL_NAME, stream=True)
+def output_generation_stream(final_chunks: list, query):
+    '''
+        description: streaming version of output_generation, yields the answer as gemini produces it.
+
+        input: final_chunks, reranked chunks from cross-encoder step
+        output: generator of events (dicts)
+            - {"type": "chunks", "chunks": list of final chunks}, sent first before the llm call
+            - {"type": "token", "text": next piece of the answer}, one per streamed piece
+            - {"type": "done", "text": full answer, "time_to_first_token_s", "generation_time_s"}, sent last
+    '''
+    client = get_gemini_client()
+
+    contents, chunk_list = _build_prompt(final_chunks, query)
+    yield {"type": "chunks", "chunks": chunk_list}
+
+    start = time.perf_counter()
+    first_token_at = None
+    text_parts = []
+    last_response = None
+    for response in client.models.generate_content_stream(
+        model=MODEL_NAME,
+        contents=contents,
+    ):
+        last_response = response
+        if response.text:
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            text_parts.append(response.text)
+            yield {"type": "token", "text": response.text}
+
+    # token usage is reported on the final streamed response
+    if last_response is not None and last_response.usage_metadata is not None:
+        _report_token_metrics(last_response, start)
+
+    yield _stream_done_event(text_parts, start, first_token_at)
+
+@traced("output_generation", model=MODEL_NAME, stream=True)
+async def output_generation_stream_async(final_chunks: list, query):
+    '''
+        description: async iterator version of output_generation_stream, yields the same events.
+
+        input: final_chunks, reranked chunks from cross-encoder step
+        output: async generator of events (see output_generation_stream)
+    '''
+    client = get_async_gemini_client()
+
+    contents, chunk_list = _build_prompt(final_chunks, query)
+    yield {"type": "chunks", "chunks": chunk_list}
+
+    start = time.perf_counter()
+    first_token_at = None
+    text_parts = []
+    last_response = None
+    async for response in await client.models.generate_content_stream(
+        model=MODEL_NAME,
+        contents=contents,
+    ):
+        last_response = response
+        if response.text:
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            text_parts.append(response.text)
+            yield {"type": "token", "text": response.text}
+
+    # token usage is reported on the final streamed response
+    if last_response is not None and last_response.usage_metadata is not None:
+        _report_token_metrics(last_response, start)
+
+    yield _stream_done_event(text_parts, start, first_token_at)
+
 if __name__ == "__main__":
     initial_chunks = bi_encoder_rank(PROCESSED_QUERY)
     final_chunks = cross_encoder_rerank(initial_chunks, PROCESSED_QUERY)